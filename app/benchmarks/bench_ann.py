@@ -0,0 +1,153 @@
+"""
+Benchmark dei parametri dell'indice vettoriale: recall e latenza.
+
+Per ogni dimensione di collection costruisce collection SQLite + HNSW
+(app.services.vector_store) con i valori di M indicati e, per ognuna, misura
+le ricerche con i diversi ef_search:
+- recall@k rispetto alla ricerca esatta (brute force) sugli stessi vettori;
+- latenza p50/p99 della ricerca, confrontata con quella della ricerca esatta
+  (exact_threshold >= dimensione della collection);
+- tempo di costruzione dell'indice.
+
+Per ogni dimensione indica la configurazione più veloce che raggiunge
+--target-recall, oppure la ricerca esatta se è più veloce di tutte: i valori
+si applicano con VECTOR_HNSW_*/VECTOR_EXACT_THRESHOLD o, per collection,
+con python -m app.services.reindex --index-param.
+
+Gli embedding sono sintetici, raggruppati in cluster come quelli di documenti
+simili (vettori uniformi sarebbero il caso peggiore per HNSW).
+
+Uso:
+    python -m app.benchmarks.bench_ann
+    python -m app.benchmarks.bench_ann --sizes 300,3000,30000 --m 8,16,32 --ef-search 16,32,64,128 --k 3
+    python -m app.benchmarks.bench_ann --compare bench_results/vecchio.json bench_results/nuovo.json
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from app.benchmarks.common import compare_files, percentiles, save_results
+from app.services import vector_store
+
+
+def clustered_vectors(rng, n: int, dim: int, clusters: int, spread: float = 0.6) -> np.ndarray:
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(0, clusters, size=n)] + spread * rng.normal(size=(n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def build_store(path: str, vectors: np.ndarray, index_params: dict):
+    store = vector_store.SQLiteHNSWStore(path, index_params=index_params)
+    t0 = time.perf_counter()
+    for start in range(0, len(vectors), 1000):
+        batch = vectors[start:start + 1000]
+        ids = [str(i) for i in range(start, start + len(batch))]
+        store.add_embeddings(ids, batch, ids, [{"i": i} for i in range(start, start + len(batch))])
+    return store, time.perf_counter() - t0
+
+
+def run_queries(store, queries: np.ndarray, truth, k: int) -> dict:
+    times, hits = [], 0
+    for query, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        found = store.similarity_search_by_vector_with_score(query.tolist(), k)
+        times.append(time.perf_counter() - t0)
+        hits += len(expected & {doc.metadata["i"] for doc, _ in found})
+    return {"recall_at_k": round(hits / (len(truth) * k), 4), "latency": percentiles(times)}
+
+
+def bench_size(size: int, args, rng) -> list:
+    clusters = max(4, size // 50)
+    data = clustered_vectors(rng, size + args.queries, args.dim, clusters)
+    vectors, queries = data[:size], data[size:]
+    truth = [set(vector_store.exact_knn(q, vectors, args.k)[0].tolist()) for q in queries]
+
+    root = tempfile.mkdtemp(prefix="bench_ann_")
+    results = []
+    try:
+        store, build_s = build_store(f"{root}/exact", vectors, {"exact_threshold": size})
+        entry = {"label": f"n{size}/exact", "size": size, "exact": True, "build_s": round(build_s, 3),
+                 **run_queries(store, queries, truth, args.k)}
+        store.close()
+        results.append(entry)
+        print(f"   n={size:<7} esatta            recall@{args.k} {entry['recall_at_k']:.3f}  "
+              f"p50 {entry['latency']['p50'] * 1000:7.2f} ms  p99 {entry['latency']['p99'] * 1000:7.2f} ms")
+
+        for m in args.m:
+            store, build_s = build_store(f"{root}/m{m}", vectors,
+                                         {"m": m, "ef_construction": args.ef_construction, "exact_threshold": 0})
+            for ef in args.ef_search:
+                store.set_index_params(ef_search=ef)
+                entry = {"label": f"n{size}/m{m}/ef{ef}", "size": size, "exact": False, "m": m,
+                         "ef_construction": args.ef_construction, "ef_search": ef, "build_s": round(build_s, 3),
+                         **run_queries(store, queries, truth, args.k)}
+                results.append(entry)
+                print(f"   n={size:<7} m={m:<3} ef={ef:<5}    recall@{args.k} {entry['recall_at_k']:.3f}  "
+                      f"p50 {entry['latency']['p50'] * 1000:7.2f} ms  p99 {entry['latency']['p99'] * 1000:7.2f} ms  "
+                      f"(costruzione {build_s:.1f} s)")
+            store.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def recommend(entries: list, target: float) -> dict:
+    """Configurazione con la p99 più bassa tra quelle che raggiungono la recall richiesta (la ricerca esatta la raggiunge sempre)."""
+    eligible = [e for e in entries if e["recall_at_k"] >= target]
+    best = min(eligible, key=lambda e: e["latency"]["p99"])
+    if best["exact"]:
+        return {"label": best["label"], "index_params": {"exact_threshold": best["size"]}}
+    return {"label": best["label"],
+            "index_params": {"m": best["m"], "ef_construction": best["ef_construction"],
+                             "ef_search": best["ef_search"]}}
+
+
+def _ints(value: str):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark recall/latenza dei parametri dell'indice HNSW")
+    parser.add_argument("--sizes", type=_ints, default=_ints("500,2000,10000"),
+                        help="dimensioni delle collection (chunk) separate da virgola")
+    parser.add_argument("--m", type=_ints, default=_ints("8,16,32"), help="valori di M separati da virgola")
+    parser.add_argument("--ef-search", type=_ints, default=_ints("16,32,64,128"),
+                        help="valori di ef_search separati da virgola")
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3, help="vicini per ricerca (la chat ne usa 3)")
+    parser.add_argument("--queries", type=int, default=200, help="ricerche misurate per configurazione")
+    parser.add_argument("--dim", type=int, default=1024, help="dimensione degli embedding")
+    parser.add_argument("--target-recall", type=float, default=0.98, help="recall@k minima per la raccomandazione")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    rng = np.random.default_rng(args.seed)
+    results, recommended = [], {}
+    for size in sorted(args.sizes):
+        print(f"▶️  Collection da {size} chunk")
+        entries = bench_size(size, args, rng)
+        results.extend(entries)
+        recommended[str(size)] = recommend(entries, args.target_recall)
+        print(f"   ⭐ consigliata per recall@{args.k} >= {args.target_recall}: {recommended[str(size)]['label']}")
+
+    config = {"sizes": sorted(args.sizes), "m": args.m, "ef_search": args.ef_search,
+              "ef_construction": args.ef_construction, "k": args.k, "queries": args.queries, "dim": args.dim,
+              "target_recall": args.target_recall, "seed": args.seed}
+    path = save_results("ann", {"config": config, "results": results, "recommended": recommended}, args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
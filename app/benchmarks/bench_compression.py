@@ -0,0 +1,153 @@
+"""
+Benchmark dei vettori compressi del backend SQLite (float16 e quantizzazione prodotto).
+
+Indicizza i chunk del corpus sintetico in una collection per ogni encoding
+(float32 di riferimento, float16, pq con i blocchi indicati) e misura:
+- recall@k rispetto alla ricerca esatta sugli embedding float32 originali;
+- latenza p50/p99 della ricerca (exact_threshold=0, per misurare il percorso
+  approssimato anche sulle collection piccole);
+- memoria stimata della collection aperta e spazio su disco, con il rapporto
+  rispetto a float32.
+Per pq la ricerca viene ripetuta con i diversi pq_rerank (candidati
+riordinati a piena precisione per ogni risultato); con --small-chunks si
+misura anche una collection pq più piccola di PQ_TRAIN_MIN, il cui
+quantizzatore viene addestrato solo al salvataggio dell'indice.
+
+Con --embeddings hash (default) gli embedding sono quelli deterministici di
+app.benchmarks.stubs, senza scaricare modelli; con hf/int8/onnx si usa il
+backend di embedding indicato.
+
+Uso:
+    python -m app.benchmarks.bench_compression
+    python -m app.benchmarks.bench_compression --patients 200 --docs 10 --pq-subvectors 32,64,128 --pq-rerank 1,5,10
+    python -m app.benchmarks.bench_compression --embeddings hf --patients 20
+    python -m app.benchmarks.bench_compression --compare bench_results/vecchio.json bench_results/nuovo.json
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from app.benchmarks.common import compare_files, percentiles, save_results
+from app.benchmarks.corpus import generate_corpus, generate_queries
+from app.benchmarks.stubs import HashEmbeddings
+from app.services import indexing, vector_store
+from app.services.embeddings import BACKENDS, build_embeddings
+from app.services.quantization import PQ_TRAIN_MIN
+
+
+def _dir_mb(path: str) -> float:
+    total = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return round(total / 2**20, 3)
+
+
+def build_collection(path: str, vectors: np.ndarray, chunks, index_params: dict):
+    store = vector_store.SQLiteHNSWStore(path, index_params={**index_params, "exact_threshold": 0})
+    t0 = time.perf_counter()
+    for start in range(0, len(vectors), 500):
+        ids = [str(i) for i in range(start, min(start + 500, len(vectors)))]
+        store.add_embeddings(ids, vectors[start:start + 500], chunks[start:start + 500],
+                             [{"i": int(i)} for i in ids])
+    store.save_index()
+    return store, time.perf_counter() - t0
+
+
+def _per_chunk(footprint: dict, key: str) -> float:
+    return footprint[key] / footprint["chunks"]
+
+
+def measure(store, query_vectors: np.ndarray, truth, k: int) -> dict:
+    times, hits = [], 0
+    for query, expected in zip(query_vectors, truth):
+        t0 = time.perf_counter()
+        found = store.similarity_search_by_vector_with_score(query.tolist(), k)
+        times.append(time.perf_counter() - t0)
+        hits += len(expected & {doc.metadata["i"] for doc, _ in found})
+    return {"recall_at_k": round(hits / (len(truth) * k), 4), "latency": percentiles(times)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei vettori compressi (float16, PQ) del backend sqlite")
+    parser.add_argument("--embeddings", default="hash", choices=("hash",) + BACKENDS,
+                        help="hash = embedding deterministici offline, altrimenti il backend di embedding")
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--docs", type=int, default=10, help="documenti per paziente")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3, help="chunk recuperati per domanda (come RETRIEVAL_K)")
+    parser.add_argument("--pq-subvectors", default="32,64,128", help="blocchi PQ da provare, separati da virgola")
+    parser.add_argument("--pq-rerank", default="1,5,10", help="valori di pq_rerank da provare, separati da virgola")
+    parser.add_argument("--small-chunks", type=int, default=PQ_TRAIN_MIN // 4,
+                        help="chunk della collection pq piccola (sotto PQ_TRAIN_MIN); 0 = non misurata")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    patients = generate_corpus(args.patients, args.docs, seed=args.seed)
+    chunks = [c for sp in patients for text in sp.documents for c in indexing.split_text(text)]
+    queries = generate_queries(patients, args.queries, seed=args.seed + 1)
+    embeddings = HashEmbeddings() if args.embeddings == "hash" else build_embeddings(args.embeddings)
+    print(f"▶️  {len(chunks)} chunk, {len(queries)} domande, embedding {args.embeddings}")
+    vectors = np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+    query_vectors = np.asarray([embeddings.embed_query(q) for q in queries], dtype=np.float32)
+    sizes = {len(vectors)}
+    configs = [("float32", {"encoding": "float32"}, len(vectors)), ("float16", {"encoding": "float16"}, len(vectors))]
+    pq_subvectors = [int(m) for m in args.pq_subvectors.split(",") if m.strip()]
+    configs += [(f"pq{m}", {"encoding": "pq", "pq_subvectors": m}, len(vectors)) for m in pq_subvectors]
+    small = min(args.small_chunks, len(vectors), PQ_TRAIN_MIN - 1)
+    if args.k <= small < len(vectors) and pq_subvectors:
+        sizes.add(small)
+        configs.append((f"pq{pq_subvectors[0]}-n{small}", {"encoding": "pq", "pq_subvectors": pq_subvectors[0]}, small))
+    truth = {n: [set(vector_store.exact_knn(q, vectors[:n], args.k)[0].tolist()) for q in query_vectors]
+             for n in sizes}
+    reranks = [int(r) for r in args.pq_rerank.split(",") if r.strip()]
+
+    root = tempfile.mkdtemp(prefix="bench_compression_")
+    results, reference = [], None
+    try:
+        for name, params, n in configs:
+            path = os.path.join(root, name)
+            store, build_s = build_collection(path, vectors[:n], chunks[:n], params)
+            footprint = {"chunks": n, "build_s": round(build_s, 3),
+                         "memory_mb": round(store.memory_bytes() / 2**20, 3), "disk_mb": _dir_mb(path)}
+            if reference is None:
+                reference = footprint
+            for rerank in (reranks if params["encoding"] == "pq" else [None]):
+                if rerank is not None:
+                    store.set_index_params(pq_rerank=rerank)
+                entry = {
+                    "label": name if rerank is None else f"{name}/rerank{rerank}",
+                    **params, **({"pq_rerank": rerank} if rerank is not None else {}), **footprint,
+                    # rapporti per chunk, confrontabili anche per la collection piccola
+                    "memory_ratio": round(_per_chunk(footprint, "memory_mb") / _per_chunk(reference, "memory_mb"), 4),
+                    "disk_ratio": round(_per_chunk(footprint, "disk_mb") / _per_chunk(reference, "disk_mb"), 4),
+                    **measure(store, query_vectors, truth[n], args.k),
+                }
+                results.append(entry)
+                print(f"   {entry['label']:<22} recall@{args.k} {entry['recall_at_k']:.3f}  "
+                      f"p50 {entry['latency']['p50'] * 1000:6.2f} ms  p99 {entry['latency']['p99'] * 1000:6.2f} ms  "
+                      f"memoria {entry['memory_mb']:8.2f} MB (x{entry['memory_ratio']:.3f})  "
+                      f"disco {entry['disk_mb']:8.2f} MB (x{entry['disk_ratio']:.3f})")
+            store.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    config = {"embeddings": args.embeddings, "patients": args.patients, "docs_per_patient": args.docs,
+              "chunks": len(chunks), "queries": args.queries, "k": args.k, "pq_subvectors": args.pq_subvectors,
+              "pq_rerank": reranks, "small_chunks": small, "seed": args.seed}
+    path = save_results("compression", {"config": config, "results": results}, args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Benchmark dei backend di embedding (app.services.embeddings).
+
+Codifica i chunk di un corpus sintetico con il modello di riferimento ("hf",
+fp32) e con i backend ottimizzati ("int8", "onnx"), misurando:
+- throughput di codifica dei documenti (chunk al secondo) e latenza delle query;
+- similarità coseno tra i vettori del backend e quelli di riferimento;
+- accordo del retrieval: sovrapposizione dei top-k chunk restituiti per le
+  stesse domande rispetto al modello di riferimento.
+
+Uso:
+    python -m app.benchmarks.bench_embeddings
+    python -m app.benchmarks.bench_embeddings --backends int8 --patients 5 --docs 10 --k 3
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from langchain.text_splitter import CharacterTextSplitter
+
+from app.benchmarks.common import compare_files, percentiles, save_results
+from app.benchmarks.corpus import generate_corpus, generate_queries
+from app.services.embeddings import BACKENDS, build_embeddings
+
+REFERENCE = "hf"
+
+
+def encode(embeddings, chunks, queries) -> dict:
+    t0 = time.perf_counter()
+    doc_vectors = np.asarray(embeddings.embed_documents(chunks), dtype=np.float32)
+    elapsed = time.perf_counter() - t0
+
+    query_vectors, query_times = [], []
+    for q in queries:
+        t1 = time.perf_counter()
+        query_vectors.append(embeddings.embed_query(q))
+        query_times.append(time.perf_counter() - t1)
+
+    return {
+        "doc_vectors": doc_vectors,
+        "query_vectors": np.asarray(query_vectors, dtype=np.float32),
+        "stats": {
+            "chunks": len(chunks),
+            "encode_s": round(elapsed, 4),
+            "chunks_per_s": round(len(chunks) / elapsed, 3) if elapsed else 0.0,
+            "query": percentiles(query_times),
+        },
+    }
+
+
+def top_k(query_vectors: np.ndarray, doc_vectors: np.ndarray, k: int) -> np.ndarray:
+    # vettori già normalizzati: il prodotto scalare è la similarità coseno
+    scores = query_vectors @ doc_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def agreement(reference: dict, candidate: dict, k: int) -> dict:
+    cosines = (reference["doc_vectors"] * candidate["doc_vectors"]).sum(axis=1)
+    ref_top = top_k(reference["query_vectors"], reference["doc_vectors"], k)
+    cand_top = top_k(candidate["query_vectors"], candidate["doc_vectors"], k)
+    overlap = [len(set(r) & set(c)) / k for r, c in zip(ref_top.tolist(), cand_top.tolist())]
+    return {
+        "cosine_mean": round(float(cosines.mean()), 5),
+        "cosine_min": round(float(cosines.min()), 5),
+        "topk_agreement": round(float(np.mean(overlap)), 4),
+        "top1_agreement": round(float(np.mean(ref_top[:, 0] == cand_top[:, 0])), 4),
+    }
+
+
+def run(backends, n_patients: int, docs_per_patient: int, n_queries: int, k: int, seed: int) -> dict:
+    patients = generate_corpus(n_patients, docs_per_patient, seed=seed)
+    queries = generate_queries(patients, n_queries, seed=seed + 1)
+    splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
+    chunks = [c for sp in patients for text in sp.documents for c in splitter.split_text(text)]
+    print(f"▶️  {len(chunks)} chunk, {len(queries)} domande")
+
+    encoded, results = {}, {}
+    for backend in [REFERENCE] + [b for b in backends if b != REFERENCE]:
+        t0 = time.perf_counter()
+        embeddings = build_embeddings(backend)
+        load_s = time.perf_counter() - t0
+        encoded[backend] = encode(embeddings, chunks, queries)
+        entry = {"load_s": round(load_s, 3), **encoded[backend]["stats"]}
+        if backend != REFERENCE:
+            entry.update(agreement(encoded[REFERENCE], encoded[backend], k))
+            entry["speedup"] = round(entry["chunks_per_s"] / results[REFERENCE]["chunks_per_s"], 3)
+        results[backend] = entry
+        print(f"   {backend}: {entry['chunks_per_s']} chunk/s"
+              + (f", top-{k} accordo {entry['topk_agreement']:.2%}, coseno min {entry['cosine_min']}"
+                 if backend != REFERENCE else ""))
+
+    return {
+        "config": {
+            "backends": list(results),
+            "patients": n_patients,
+            "docs_per_patient": docs_per_patient,
+            "queries": n_queries,
+            "k": k,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark dei backend di embedding di MyNurseAI")
+    parser.add_argument("--backends", default="int8,onnx",
+                        help=f"backend da confrontare con '{REFERENCE}' ({', '.join(BACKENDS)})")
+    parser.add_argument("--patients", type=int, default=5)
+    parser.add_argument("--docs", type=int, default=10, help="documenti per paziente")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3, help="chunk recuperati per domanda (come RETRIEVAL_K)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    payload = run(backends, args.patients, args.docs, args.queries, args.k, args.seed)
+    path = save_results("embeddings", payload, args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Report dei tempi di import, per tenere sotto controllo il costo di avvio.
+
+Ogni modulo viene importato in un interprete nuovo con `python -X importtime`,
+così i tempi sono quelli di un avvio a freddo e non dipendono dall'ordine dei
+target. Per ogni target riporta tempo di import cumulativo, memoria residente
+del processo e i moduli più costosi (tempo "self"). Un target nella forma
+"modulo:funzione" chiama anche la funzione dopo l'import (es. la costruzione
+dell'analyzer Presidio) e ne misura il tempo a parte.
+
+Il target "startup" è ciò che main.py importa prima del login.
+
+Uso:
+    python -m app.benchmarks.bench_imports
+    python -m app.benchmarks.bench_imports --targets startup,app.pages_custom.ask_chatbot --top 20
+    python -m app.benchmarks.bench_imports --max-startup-s 1.5
+    python -m app.benchmarks.bench_imports --compare bench_results/vecchio.json bench_results/nuovo.json
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+from app.benchmarks.common import compare_files, save_results
+
+STARTUP_MODULES = [
+    "streamlit",
+    "app.pages_custom.login",
+    "app.pages_custom.registry",
+    "app.database.postgres",
+    "app.models.doc",
+    "app.services.prewarm",
+    "app.services.tracing",
+]
+
+DEFAULT_TARGETS = [
+    "startup",
+    "app.pages_custom.area_personale",
+    "app.pages_custom.show_pazienti",
+    "app.pages_custom.show_docs",
+    "app.pages_custom.upload_docs",
+    "app.pages_custom.ask_chatbot",
+    "app.security_components.PII_obfuscation:get_analyzer",
+]
+
+_CHILD = """
+import importlib, resource, sys, time
+modules, call = sys.argv[1].split(","), sys.argv[2]
+start = time.perf_counter()
+for name in modules:
+    importlib.import_module(name)
+import_s = time.perf_counter() - start
+call_s = 0.0
+if call:
+    start = time.perf_counter()
+    getattr(sys.modules[modules[-1]], call)()
+    call_s = time.perf_counter() - start
+print("RESULT", import_s, call_s, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_importtime(stderr: str):
+    """Righe di -X importtime -> lista di (modulo, self_s, cumulative_s)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return rows
+
+
+def measure(target: str, top: int) -> dict:
+    module_spec, _, call = target.partition(":")
+    modules = STARTUP_MODULES if module_spec == "startup" else [module_spec]
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD, ",".join(modules), call],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    result_line = next((l for l in proc.stdout.splitlines() if l.startswith("RESULT")), None)
+    if proc.returncode != 0 or result_line is None:
+        error = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+        return {"error": error[-1] if error else f"exit code {proc.returncode}"}
+
+    _, import_s, call_s, maxrss_kb = result_line.split()
+    rows = parse_importtime(proc.stderr)
+    rows.sort(key=lambda r: r[1], reverse=True)
+    entry = {
+        "import_s": round(float(import_s), 4),
+        "rss_mb": round(int(maxrss_kb) / 1024, 1),
+        "modules_loaded": len(rows),
+        "top_self": [{"module": name, "self_s": round(s, 4), "cumulative_s": round(c, 4)}
+                     for name, s, c in rows[:top]],
+    }
+    if call:
+        entry["call_s"] = round(float(call_s), 4)
+    return entry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report dei tempi di import di MyNurseAI")
+    parser.add_argument("--targets", default=",".join(DEFAULT_TARGETS),
+                        help="moduli separati da virgola; 'startup' = import di main.py prima del login")
+    parser.add_argument("--top", type=int, default=15, help="moduli più costosi da riportare per target")
+    parser.add_argument("--max-startup-s", type=float, default=None,
+                        help="esce con errore se l'import di 'startup' supera questa soglia")
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il report")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    results = {}
+    for target in [t.strip() for t in args.targets.split(",") if t.strip()]:
+        entry = measure(target, args.top)
+        results[target] = entry
+        if "error" in entry:
+            print(f"❌ {target}: {entry['error']}")
+            continue
+        extra = f", chiamata {entry['call_s'] * 1000:.0f} ms" if "call_s" in entry else ""
+        print(f"▶️  {target}: import {entry['import_s'] * 1000:.0f} ms{extra}, "
+              f"RSS {entry['rss_mb']} MB, {entry['modules_loaded']} moduli")
+        for row in entry["top_self"][:5]:
+            print(f"      {row['self_s'] * 1000:8.1f} ms  {row['module']}")
+
+    path = save_results("imports", {"config": {"startup_modules": STARTUP_MODULES}, "results": results}, args.out)
+    print(f"📄 Risultati salvati in {path}")
+
+    startup = results.get("startup", {})
+    if args.max_startup_s is not None and startup.get("import_s", 0) > args.max_startup_s:
+        print(f"⚠️ Import di avvio oltre la soglia: {startup['import_s']} s > {args.max_startup_s} s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
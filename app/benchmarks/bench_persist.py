@@ -0,0 +1,163 @@
+"""
+Benchmark del costo di persistenza al crescere della collection.
+
+Per ogni backend (chroma = duckdb+parquet, sqlite = SQLite + HNSW) fa
+crescere una collection fino alle dimensioni indicate e a ogni dimensione
+simula alcuni upload da --chunks chunk lungo lo stesso percorso di
+documents.py: handle condiviso (indexing.cached_vectorstore), add_texts,
+persist() e indexing.mark_written. Misura:
+- upload, cioè il percorso intero, apertura dell'handle compresa;
+- add_texts (inserimento) e persist() separatamente;
+- la domanda successiva all'upload, servita dall'handle condiviso (con
+  chroma comprende la riapertura della collection).
+
+Gli embedding sono vettori casuali normalizzati: si misura solo lo storage.
+
+Uso:
+    python -m app.benchmarks.bench_persist
+    python -m app.benchmarks.bench_persist --sizes 500,2000,8000 --uploads 5 --chunks 20 --backends sqlite
+    python -m app.benchmarks.bench_persist --compare bench_results/vecchio.json bench_results/nuovo.json
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from app.benchmarks.common import compare_files, percentiles, save_results
+from app.services import indexing
+
+DEFAULT_SIZES = "500,2000,8000"
+
+
+class RandomEmbeddings(Embeddings):
+    """Vettori casuali normalizzati L2 (riproducibili con il seed)."""
+
+    def __init__(self, dim: int = 1024, seed: int = 42):
+        self.dim = dim
+        self.rng = np.random.default_rng(seed)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.rng.normal(size=(len(texts), self.dim)).astype(np.float32)
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _dir_mb(path: str) -> float:
+    total = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return round(total / 2**20, 2)
+
+
+def _add(vectorstore, start: int, n: int, doc_id: int):
+    texts = [f"chunk {i} del documento {doc_id}" for i in range(start, start + n)]
+    metadatas = [{"doc_id": doc_id, "chunk": i} for i in range(n)]
+    vectorstore.add_texts(texts, metadatas=metadatas, ids=[f"{doc_id}-{i}" for i in range(n)])
+
+
+def bench_backend(backend: str, sizes, uploads: int, chunks: int, embeddings) -> list:
+    root = tempfile.mkdtemp(prefix=f"bench_persist_{backend}_")
+    path = os.path.join(root, "collection")
+    results = []
+    try:
+        count = doc_id = 0
+        for size in sizes:
+            # riempimento fino alla dimensione richiesta, non cronometrato
+            vectorstore = indexing.cached_vectorstore(path, embeddings, backend=backend)
+            while count < size:
+                n = min(500, size - count)
+                _add(vectorstore, count, n, doc_id)
+                count += n
+                doc_id += 1
+            vectorstore.persist()
+            indexing.mark_written(path, vectorstore, embeddings)
+            del vectorstore
+
+            upload_times, add_times, persist_times, query_times = [], [], [], []
+            for _ in range(uploads):
+                t0 = time.perf_counter()
+                vectorstore = indexing.cached_vectorstore(path, embeddings)
+                t1 = time.perf_counter()
+                _add(vectorstore, count, chunks, doc_id)
+                t2 = time.perf_counter()
+                vectorstore.persist()
+                t3 = time.perf_counter()
+                indexing.mark_written(path, vectorstore, embeddings)
+                t4 = time.perf_counter()
+                del vectorstore
+                indexing.cached_vectorstore(path, embeddings).similarity_search("domanda", k=3)
+                t5 = time.perf_counter()
+                count += chunks
+                doc_id += 1
+                upload_times.append(t4 - t0)
+                add_times.append(t2 - t1)
+                persist_times.append(t3 - t2)
+                query_times.append(t5 - t4)
+
+            entry = {
+                "label": f"{backend}@{size}",
+                "backend": backend,
+                "chunks": count,
+                "disk_mb": _dir_mb(path),
+                "upload": percentiles(upload_times),
+                "add_texts": percentiles(add_times),
+                "persist": percentiles(persist_times),
+                "query_after_upload": percentiles(query_times),
+            }
+            results.append(entry)
+            print(f"   {backend:<6} {count:>7} chunk: upload p50 {entry['upload']['p50'] * 1000:8.1f} ms "
+                  f"(add {entry['add_texts']['p50'] * 1000:.1f}, persist {entry['persist']['p50'] * 1000:.1f}), "
+                  f"domanda dopo l'upload p50 {entry['query_after_upload']['p50'] * 1000:7.1f} ms, "
+                  f"{entry['disk_mb']} MB")
+    finally:
+        indexing.drop_vectorstore(path)
+        shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del persist delle collection al crescere della dimensione")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="dimensioni della collection (chunk) separate da virgola")
+    parser.add_argument("--backends", default=",".join(indexing.VECTOR_BACKENDS), help="backend separati da virgola")
+    parser.add_argument("--uploads", type=int, default=5, help="upload misurati per ogni dimensione")
+    parser.add_argument("--chunks", type=int, default=20, help="chunk per upload")
+    parser.add_argument("--dim", type=int, default=1024, help="dimensione degli embedding")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    sizes = sorted(int(s) for s in args.sizes.split(",") if s.strip())
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    results = []
+    for backend in backends:
+        if backend not in indexing.VECTOR_BACKENDS:
+            print(f"❌ Backend sconosciuto: {backend}")
+            return 2
+        print(f"▶️  Backend {backend}")
+        entries = bench_backend(backend, sizes, args.uploads, args.chunks, RandomEmbeddings(args.dim, args.seed))
+        results.extend(entries)
+        first, last = entries[0]["upload"]["p50"], entries[-1]["upload"]["p50"]
+        if first:
+            print(f"   upload da {entries[0]['chunks']} a {entries[-1]['chunks']} chunk: x{last / first:.1f}")
+
+    config = {"sizes": sizes, "backends": backends, "uploads": args.uploads, "chunks": args.chunks,
+              "dim": args.dim, "seed": args.seed}
+    path = save_results("persist", {"config": config, "results": results}, args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Benchmark del riuso del prefisso dei prompt (KV cache di Ollama).
+
+Per ogni template del registro (app.services.prompts) invia a Ollama una serie
+di richieste con contenuto variabile preso dal corpus sintetico, in due modi:
+
+- "reuse": i messaggi come li costruisce l'app, con il messaggio di sistema
+  identico a ogni chiamata;
+- "cold":  gli stessi messaggi con un identificativo casuale in testa al
+  messaggio di sistema, così nessun prefisso è riusabile.
+
+Dalle risposte di Ollama riporta il tempo di prefill (prompt_eval_duration) e
+i token effettivamente valutati (prompt_eval_count), più lo speedup del
+prefill mediano. Ogni richiesta genera un solo token (num_predict=1), così il
+tempo misurato è quasi tutto prefill. Richiede un server Ollama con i modelli
+configurati.
+
+Uso:
+    python -m app.benchmarks.bench_prompts
+    python -m app.benchmarks.bench_prompts --templates rag_answer,therapy_classifier --requests 20
+    python -m app.benchmarks.bench_prompts --compare bench_results/vecchio.json bench_results/nuovo.json
+"""
+import argparse
+import random
+import sys
+import uuid
+
+from app.benchmarks.common import compare_files, percentiles, save_results
+from app.benchmarks.corpus import generate_corpus, generate_queries
+from app.config import CHAT_MODEL, GUARD_MODEL, THERAPY_MODEL
+from app.services import prompts
+from app.services.llm_scheduler import scheduler
+
+TEMPLATE_MODELS = {
+    "rag_answer": CHAT_MODEL,
+    "therapy_classifier": THERAPY_MODEL,
+    "prompt_risk": GUARD_MODEL,
+    "chat_summary": CHAT_MODEL,
+    "patient_digest": CHAT_MODEL,
+}
+
+
+def make_inputs(name: str, n: int, seed: int):
+    """Valori variabili del template `name` presi dal corpus sintetico."""
+    rng = random.Random(seed)
+    patients = generate_corpus(max(2, n // 4), 3, seed=seed)
+    paragraphs = [p for sp in patients for doc in sp.documents for p in doc.split("\n\n")]
+    queries = generate_queries(patients, n, seed=seed)
+    inputs = []
+    for i in range(n):
+        p = rng.choice(patients).user
+        if name == "rag_answer":
+            therapy = rng.random() < 0.5
+            inputs.append({
+                "therapy_instruction": prompts.RAG_THERAPY_PRESENT if therapy else prompts.RAG_THERAPY_ABSENT,
+                "patient_info": f"Pazienti coinvolti: {p.nome} {p.cognome}.",
+                "history": "",
+                "context": "\n\n".join(rng.sample(paragraphs, 3)),
+                "query": queries[i],
+            })
+        elif name in ("therapy_classifier", "prompt_risk"):
+            inputs.append({"text": rng.choice(paragraphs) if name == "therapy_classifier" else queries[i]})
+        elif name == "chat_summary":
+            inputs.append({"max_chars": 1200, "previous": "(vuoto)",
+                           "messages": f"Utente: {queries[i]}\nMyNurseAI: {rng.choice(paragraphs)}"})
+        else:
+            inputs.append({"max_chars": 2000, "previous": "(vuota)", "filename": f"referto_{i}.pdf",
+                           "text": "\n\n".join(rng.sample(paragraphs, 4))})
+    return inputs
+
+
+def _field(response, name: str):
+    """Campo della risposta di Ollama (oggetto o dizionario a seconda della versione del client)."""
+    value = getattr(response, name, None)
+    if value is None and isinstance(response, dict):
+        value = response.get(name)
+    return value or 0
+
+
+def call(model: str, messages) -> tuple:
+    response = scheduler.chat(model, messages, coalesce=False, options={"num_predict": 1})
+    return _field(response, "prompt_eval_duration") / 1e9, _field(response, "prompt_eval_count")
+
+
+def bench_template(name: str, n: int, seed: int) -> dict:
+    model = TEMPLATE_MODELS[name]
+    inputs = make_inputs(name, n, seed)
+    # caricamento del modello, escluso dalle misure
+    call(model, prompts.render(name, **inputs[0]))
+
+    entry = {"label": name, "model": model, "requests": n}
+    for mode in ("cold", "reuse"):
+        seconds, tokens = [], []
+        for values in inputs:
+            messages = prompts.render(name, **values)
+            if mode == "cold":
+                messages[0] = {"role": "system", "content": f"[{uuid.uuid4().hex}]\n{messages[0]['content']}"}
+            s, t = call(model, messages)
+            seconds.append(s)
+            tokens.append(t)
+        entry[mode] = {"prefill": percentiles(seconds), "evaluated_tokens": percentiles(tokens)}
+    cold, reuse = entry["cold"]["prefill"]["p50"], entry["reuse"]["prefill"]["p50"]
+    entry["speedup"] = round(cold / reuse, 2) if reuse else 0.0
+    return entry
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del riuso del prefisso dei prompt su Ollama")
+    parser.add_argument("--templates", default=",".join(TEMPLATE_MODELS), help="template separati da virgola")
+    parser.add_argument("--requests", type=int, default=10, help="richieste per template e modalità")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    results = []
+    for name in [t.strip() for t in args.templates.split(",") if t.strip()]:
+        if name not in TEMPLATE_MODELS:
+            print(f"❌ Template sconosciuto: {name}")
+            return 2
+        entry = bench_template(name, args.requests, args.seed)
+        results.append(entry)
+        print(f"▶️  {name} ({entry['model']}): prefill p50 {entry['cold']['prefill']['p50'] * 1000:.0f} ms "
+              f"-> {entry['reuse']['prefill']['p50'] * 1000:.0f} ms (x{entry['speedup']}), token valutati "
+              f"{entry['cold']['evaluated_tokens']['mean']:.0f} -> {entry['reuse']['evaluated_tokens']['mean']:.0f}")
+
+    path = save_results("prompts", {"config": {"requests": args.requests, "seed": args.seed}, "results": results},
+                        args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
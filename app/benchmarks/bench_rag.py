@@ -0,0 +1,180 @@
+"""
+Benchmark riproducibile della pipeline RAG della chat.
+
+Per corpora sintetici di dimensione crescente misura:
+- throughput di indicizzazione (documenti e chunk al secondo, costo del persist);
+- percentili di latenza di caricamento vectorstore e retrieval;
+- dimensione del prompt RAG;
+- latenza end-to-end di un turno di chat con LLM finto (offline).
+
+Uso:
+    python -m app.benchmarks.bench_rag
+    python -m app.benchmarks.bench_rag --sizes 5x10,20x25 --queries 50 --out risultati.json
+    python -m app.benchmarks.bench_rag --compare bench_results/vecchio.json bench_results/nuovo.json
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+from app.benchmarks.common import compare_files, percentiles, save_results
+from app.benchmarks.corpus import generate_corpus, generate_queries, make_medico
+from app.benchmarks.stubs import HashEmbeddings, install_offline_llm
+from app.config import CHAT_MODEL
+from app.services import chat_service, indexing
+from app.services.embeddings import BACKENDS, get_embeddings
+from app.services.tracing import tracer
+
+DEFAULT_SIZES = "1x5,5x10,10x25,20x50"
+
+
+def parse_sizes(spec: str):
+    """'5x10,20x25' -> [(5, 10), (20, 25)] come (pazienti per medico, documenti per paziente)."""
+    sizes = []
+    for item in spec.split(","):
+        patients, docs = item.lower().split("x")
+        sizes.append((int(patients), int(docs)))
+    return sizes
+
+
+def build_embeddings(kind: str):
+    if kind == "hash":
+        return HashEmbeddings()
+    # senza cache su disco: si misura il costo reale del modello
+    return get_embeddings(kind, cached=False)
+
+
+def bench_indexing(patients, root: str, embeddings) -> dict:
+    add_times, persist_times = [], []
+    n_docs = n_chunks = 0
+    start = time.perf_counter()
+    for sp in patients:
+        persist_dir = indexing.current_collection_dir(sp.user.email, root, create=True)
+        vectorstore = indexing.open_vectorstore(persist_dir, embeddings)
+        for text in sp.documents:
+            chunks = indexing.split_text(text)
+            t0 = time.perf_counter()
+            vectorstore.add_texts(chunks, metadatas=[{"doc_id": n_docs, "chunk": i} for i in range(len(chunks))])
+            t1 = time.perf_counter()
+            vectorstore.persist()
+            t2 = time.perf_counter()
+            add_times.append(t1 - t0)
+            persist_times.append(t2 - t1)
+            n_docs += 1
+            n_chunks += len(chunks)
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": n_docs,
+        "chunks": n_chunks,
+        "total_s": round(elapsed, 4),
+        "docs_per_s": round(n_docs / elapsed, 3) if elapsed else 0.0,
+        "chunks_per_s": round(n_chunks / elapsed, 3) if elapsed else 0.0,
+        "add_texts": percentiles(add_times),
+        "persist": percentiles(persist_times),
+    }
+
+
+def bench_retrieval(patients, queries, embeddings) -> dict:
+    by_name = {f"{sp.user.nome} {sp.user.cognome}": sp.user for sp in patients}
+    load_times, retrieval_times = [], []
+    for q in queries:
+        target = next(u for name, u in by_name.items() if name in q)
+        t0 = time.perf_counter()
+        vs = chat_service.load_vectorstore(target.email, embeddings)
+        t1 = time.perf_counter()
+        vs.as_retriever(search_kwargs={"k": chat_service.RETRIEVAL_K}).get_relevant_documents(q)
+        t2 = time.perf_counter()
+        load_times.append(t1 - t0)
+        retrieval_times.append(t2 - t1)
+    return {"vectorstore_load": percentiles(load_times), "retrieval": percentiles(retrieval_times)}
+
+
+def bench_chat_turns(patients, queries, embeddings) -> dict:
+    medico = make_medico()
+    pazienti = [sp.user for sp in patients]
+    chatbot = chat_service.OllamaWrapper(model_name=CHAT_MODEL)
+    turn_times, prompt_chars, prompt_words = [], [], []
+    for q in queries:
+        with tracer.turn("bench_chat") as trace:
+            result = chat_service.run_chat_turn(medico, pazienti, q, chatbot, embeddings=embeddings)
+        turn_times.append(trace.total)
+        if result.prompt:
+            prompt_chars.append(len(result.prompt))
+            prompt_words.append(len(result.prompt.split()))
+    return {
+        "turn": percentiles(turn_times),
+        "prompt_chars": percentiles(prompt_chars),
+        "prompt_words": percentiles(prompt_words),
+    }
+
+
+def run(sizes, n_queries: int, embeddings_kind: str, llm_latency_s: float, seed: int) -> dict:
+    stub = install_offline_llm(llm_latency_s)
+    embeddings = build_embeddings(embeddings_kind)
+    results = []
+    for n_patients, docs_per_patient in sizes:
+        label = f"{n_patients}x{docs_per_patient}"
+        print(f"▶️  Corpus {label}: {n_patients} pazienti, {docs_per_patient} documenti ciascuno")
+        patients = generate_corpus(n_patients, docs_per_patient, seed=seed)
+        queries = generate_queries(patients, n_queries, seed=seed + 1)
+
+        root = tempfile.mkdtemp(prefix="bench_rag_")
+        previous_root = indexing.CHROMA_ROOT
+        indexing.CHROMA_ROOT = root
+        try:
+            entry = {
+                "label": label,
+                "patients": n_patients,
+                "docs_per_patient": docs_per_patient,
+                "indexing": bench_indexing(patients, root, embeddings),
+                "retrieval": bench_retrieval(patients, queries, embeddings),
+                "chat": bench_chat_turns(patients, queries, embeddings),
+            }
+        finally:
+            indexing.CHROMA_ROOT = previous_root
+            shutil.rmtree(root, ignore_errors=True)
+        results.append(entry)
+        print(f"   indicizzazione {entry['indexing']['docs_per_s']} doc/s, "
+              f"retrieval p95 {entry['retrieval']['retrieval']['p95'] * 1000:.1f} ms, "
+              f"turno p95 {entry['chat']['turn']['p95'] * 1000:.1f} ms")
+
+    return {
+        "config": {
+            "sizes": [f"{p}x{d}" for p, d in sizes],
+            "queries": n_queries,
+            "embeddings": embeddings_kind,
+            "llm_latency_s": llm_latency_s,
+            "seed": seed,
+            "llm_calls": stub.calls,
+        },
+        "results": results,
+        "stages": tracer.snapshot().get("bench_chat", {}),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline RAG di MyNurseAI")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="corpora come PAZIENTIxDOCUMENTI separati da virgola")
+    parser.add_argument("--queries", type=int, default=30, help="domande per corpus")
+    parser.add_argument("--embeddings", choices=("hash",) + BACKENDS, default="hash",
+                        help="hash = offline deterministico, altrimenti il backend e5 indicato")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="latenza simulata per chiamata LLM")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    payload = run(parse_sizes(args.sizes), args.queries, args.embeddings, args.llm_latency_ms / 1000, args.seed)
+    path = save_results("rag", payload, args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
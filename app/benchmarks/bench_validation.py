@@ -0,0 +1,156 @@
+"""
+Benchmark della validazione dei PDF caricati (doc_validation).
+
+Genera PDF da 1 a 500 pagine (referti clinici puliti e varianti con Base64,
+codice o testo ad alta entropia) e misura separatamente ogni stadio della
+validazione. Per gli stadi testuali confronta l'implementazione di
+riferimento con quella veloce (fast_scan) e verifica che i verdetti siano
+identici. Misura infine la validazione in streaming completa, con la
+classificazione LLM sostituita da uno stub.
+
+Uso:
+    python -m app.benchmarks.bench_validation
+    python -m app.benchmarks.bench_validation --pages 1,10,100 --kinds clinical,base64
+"""
+import argparse
+import base64
+import io
+import random
+import sys
+import time
+
+from PyPDF2 import PdfReader
+
+from app.benchmarks.common import compare_files, save_results
+from app.benchmarks.corpus import load_template_texts, make_document
+from app.benchmarks.pdf_factory import make_pdf
+from app.security_components import doc_validation, fast_scan
+
+DEFAULT_PAGES = "1,10,50,100,250,500"
+KINDS = ("clinical", "base64", "code", "entropy")
+
+CODE_LINES = [
+    "import os, subprocess; def run(cmd): return subprocess.call(cmd, shell=True)",
+    "function load(){ var x = document.getElementById('a'); eval(x.value); }",
+    "class Payload: def __init__(self, data): self.data = data; print(self.data)",
+    "for (var i = 0; i < n; i++) { buf[i] = key[i % k] ^ data[i]; }",
+]
+
+
+def make_page(rng: random.Random, kind: str, page_no: int, extra_templates) -> str:
+    text = make_document(rng, "Mario", "Rossi", 4, extra_templates)
+    if kind == "base64" and page_no % 10 == 0:
+        blob = base64.b64encode(rng.randbytes(600)).decode("ascii")
+        text = blob + "\n" + text
+    elif kind == "code" and page_no % 2 == 0:
+        text = "\n".join(rng.choice(CODE_LINES) for _ in range(20)) + "\n" + text
+    elif kind == "entropy" and page_no % 3 == 0:
+        alphabet = [chr(c) for c in range(0x21, 0x7f)] + [chr(c) for c in range(0xc0, 0x100)]
+        text = "\n".join("".join(rng.choice(alphabet) for _ in range(90)) for _ in range(30))
+    return text
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    value = fn(*args)
+    return value, time.perf_counter() - t0
+
+
+def bench_document(pdf_bytes: bytes) -> dict:
+    stages = {}
+
+    def extract():
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+    text, stages["text_extraction_s"] = timed(extract)
+    _, stages["length_check_s"] = timed(lambda t: len(t.strip()) < 300, text)
+    _, stages["structure_check_s"] = timed(doc_validation.check_pdf_structure, pdf_bytes)
+
+    comparisons = {}
+    for name, ref_fn, fast_fn in (
+        ("base64", doc_validation.detect_base64, fast_scan.detect_base64),
+        ("entropy", doc_validation.entropy_stats, fast_scan.entropy_stats),
+        ("code_lines", doc_validation.count_code_like_lines, fast_scan.count_code_like_lines),
+    ):
+        ref_value, ref_s = timed(ref_fn, text)
+        fast_value, fast_s = timed(fast_fn, text)
+        if name == "entropy":
+            ref_verdict = ref_value[0] > 5.5 or ref_value[1] > 5.5
+            fast_verdict = fast_value[0] > 5.5 or fast_value[1] > 5.5
+            max_diff = max(abs(ref_value[0] - fast_value[0]), abs(ref_value[1] - fast_value[1]))
+        elif name == "code_lines":
+            ref_verdict, fast_verdict, max_diff = ref_value > 15, fast_value > 15, abs(ref_value - fast_value)
+        else:
+            ref_verdict, fast_verdict, max_diff = ref_value, fast_value, 0.0
+        comparisons[name] = {
+            "reference_s": round(ref_s, 6),
+            "fast_s": round(fast_s, 6),
+            "speedup": round(ref_s / fast_s, 2) if fast_s else None,
+            "verdict": bool(ref_verdict),
+            "identical_verdict": bool(ref_verdict) == bool(fast_verdict),
+            "max_abs_diff": float(max_diff),
+        }
+
+    report, stages["streaming_validation_s"] = timed(doc_validation.validate_pdf_stream, pdf_bytes)
+
+    return {
+        "chars": len(text),
+        "stages": {k: round(v, 6) for k, v in stages.items()},
+        "scanners": comparisons,
+        "streaming": {"valid": report.valid, "pages_read": report.pages_read, "llm_skipped": report.llm_skipped,
+                      "chunks_classified": report.chunks_classified},
+    }
+
+
+def _stub_chunk_classification(text_chunk: str):
+    return True, "medico", 1.0, "stub di benchmark"
+
+
+def run(page_counts, kinds, seed: int) -> dict:
+    # la validazione in streaming viene misurata senza chiamate a Ollama
+    doc_validation.classify_chunk_with_ollama = _stub_chunk_classification
+    extra_templates = load_template_texts()
+    results = []
+    mismatches = 0
+    for kind in kinds:
+        for n_pages in page_counts:
+            rng = random.Random(seed + n_pages)
+            pdf_bytes = make_pdf([make_page(rng, kind, i + 1, extra_templates) for i in range(n_pages)])
+            entry = {"label": f"{kind}-{n_pages}", "kind": kind, "pages": n_pages, "bytes": len(pdf_bytes)}
+            entry.update(bench_document(pdf_bytes))
+            results.append(entry)
+            bad = [n for n, c in entry["scanners"].items() if not c["identical_verdict"]]
+            mismatches += len(bad)
+            speedups = ", ".join(f"{n} x{c['speedup']}" for n, c in entry["scanners"].items())
+            print(f"▶️  {entry['label']}: {entry['chars']} caratteri, {speedups}"
+                  + (f"  ❌ verdetti diversi: {bad}" if bad else ""))
+    return {
+        "config": {"pages": page_counts, "kinds": kinds, "seed": seed},
+        "verdict_mismatches": mismatches,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della validazione PDF di MyNurseAI")
+    parser.add_argument("--pages", default=DEFAULT_PAGES, help="numero di pagine dei PDF generati")
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"tipi di documento tra {', '.join(KINDS)}")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None, help="file JSON di output")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="confronta due file di risultati invece di eseguire il benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="regressione relativa tollerata")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare_files(args.compare[0], args.compare[1], args.tolerance)
+
+    payload = run([int(p) for p in args.pages.split(",")], args.kinds.split(","), args.seed)
+    path = save_results("validation", payload, args.out)
+    print(f"📄 Risultati salvati in {path}")
+    return 1 if payload["verdict_mismatches"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Utility condivise dai benchmark: percentili, metadati dell'ambiente,
+salvataggio dei risultati in JSON e confronto tra due esecuzioni.
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, Iterable, List, Tuple
+
+RESULTS_DIR = "bench_results"
+
+
+def percentiles(values: Iterable[float], ps=(50, 95, 99)) -> Dict[str, float]:
+    """Percentili (nearest-rank) più media, in secondi."""
+    data = sorted(values)
+    if not data:
+        return {f"p{p}": 0.0 for p in ps} | {"mean": 0.0}
+    result = {}
+    for p in ps:
+        rank = max(0, min(len(data) - 1, math.ceil(p / 100 * len(data)) - 1))
+        result[f"p{p}"] = round(data[rank], 6)
+    result["mean"] = round(sum(data) / len(data), 6)
+    return result
+
+
+def environment_info() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_results(name: str, payload: dict, out_path: str = None) -> str:
+    """Salva i risultati in bench_results/<name>_<timestamp>.json (o in out_path)."""
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out_path = os.path.join(RESULTS_DIR, f"{name}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    payload = {"benchmark": name, "environment": environment_info(), **payload}
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    return out_path
+
+
+def _flatten(prefix: str, value, out: Dict[str, float]):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else str(k), v, out)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            key = v.get("label", i) if isinstance(v, dict) else i
+            _flatten(f"{prefix}[{key}]", v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = float(value)
+
+
+def _direction(path: str) -> int:
+    """+1 se più alto è meglio (throughput), -1 se più basso è meglio (latenze), 0 se non confrontabile."""
+    leaf = path.rsplit(".", 1)[-1]
+    if (leaf.endswith("_per_s") or leaf.startswith(("recall", "cosine")) or leaf.endswith("agreement")
+            or leaf == "speedup"):
+        return 1
+    if leaf in ("p50", "p95", "p99", "mean") or leaf.endswith(("_s", "_mb")):
+        return -1
+    return 0
+
+
+def compare_results(baseline: dict, current: dict, tolerance: float = 0.2) -> List[Tuple[str, float, float, float]]:
+    """
+    Confronta due risultati e restituisce le regressioni oltre la tolleranza
+    relativa come tuple (metrica, baseline, attuale, variazione).
+    """
+    old, new = {}, {}
+    _flatten("", baseline.get("results", baseline), old)
+    _flatten("", current.get("results", current), new)
+
+    regressions = []
+    for path, before in old.items():
+        direction = _direction(path)
+        if direction == 0 or path not in new or before == 0:
+            continue
+        after = new[path]
+        change = (after - before) / abs(before)
+        if direction * change < -tolerance:
+            regressions.append((path, before, after, change))
+    return regressions
+
+
+def compare_files(baseline_path: str, current_path: str, tolerance: float = 0.2) -> int:
+    """Stampa le regressioni tra due file di risultati; ritorna il codice di uscita."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(current_path, encoding="utf-8") as f:
+        current = json.load(f)
+
+    regressions = compare_results(baseline, current, tolerance)
+    if not regressions:
+        print(f"✅ Nessuna regressione oltre il {tolerance:.0%}.")
+        return 0
+    print(f"❌ {len(regressions)} regressioni oltre il {tolerance:.0%}:")
+    for path, before, after, change in regressions:
+        print(f"  {path}: {before:.6g} -> {after:.6g} ({change:+.1%})")
+    return 1
@@ -0,0 +1,150 @@
+"""
+Generazione di corpora sintetici di pazienti e referti per i benchmark.
+
+I referti sono composti da paragrafi clinici a template (visite, ecografie,
+esami ematochimici, terapie) e, se disponibili, dal testo dei PDF di esempio
+in fakeDocs/. La generazione è deterministica dato il seed.
+"""
+import datetime
+import glob
+import io
+import os
+import random
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from PyPDF2 import PdfReader
+
+from app.models.user import User
+
+FAKE_DOCS_DIR = "fakeDocs"
+
+NOMI = ["Mario", "Giulia", "Luca", "Francesca", "Marco", "Chiara", "Andrea", "Sara", "Paolo", "Elena",
+        "Giovanni", "Anna", "Stefano", "Laura", "Davide", "Martina", "Alessandro", "Silvia", "Matteo", "Valentina"]
+COGNOMI = ["Rossi", "Bianchi", "Esposito", "Romano", "Colombo", "Ricci", "Marino", "Greco", "Bruno", "Gallo",
+           "Conti", "De Luca", "Costa", "Giordano", "Mancini", "Rizzo", "Lombardi", "Moretti", "Barbieri", "Fontana"]
+SPECIALITA = ["cardiologica", "gastroenterologica", "pneumologica", "neurologica", "ortopedica", "endocrinologica"]
+FARMACI = [("ramipril", "5 mg"), ("metformina", "500 mg"), ("omeprazolo", "20 mg"),
+           ("atorvastatina", "20 mg"), ("amoxicillina", "1 g"), ("bisoprololo", "2,5 mg")]
+
+PARAGRAPH_TEMPLATES = [
+    "Visita {specialita} del {data}. Il paziente {nome} {cognome} riferisce {sintomo} da circa {giorni} giorni. "
+    "All'esame obiettivo addome trattabile, non dolente alla palpazione profonda. Parametri vitali nella norma: "
+    "PA {pa_sis}/{pa_dia} mmHg, FC {fc} bpm. Si consiglia controllo tra {settimane} settimane.",
+    "Referto ecografia addominale del {data}: fegato di dimensioni regolari ed ecostruttura omogenea, "
+    "colecisti alitiasica, vie biliari non dilatate. Reni in sede, di normali dimensioni. "
+    "Non versamento libero in addome. Conclusioni: quadro ecografico nei limiti della norma.",
+    "Esami ematochimici del {data}: emoglobina {hb} g/dl, glicemia {glic} mg/dl, creatinina {creat} mg/dl, "
+    "colesterolo totale {col} mg/dl, potassio {k} mmol/l, ALT {alt} u/l. Valori da rivalutare al prossimo controllo.",
+    "Terapia domiciliare: {farmaco} {dose} una volta al giorno, da assumere al mattino. "
+    "Si raccomanda aderenza alla terapia farmacologica e monitoraggio pressorio domiciliare.",
+    "Diagnosi di dimissione del {data}: {diagnosi}. Decorso clinico regolare, paziente dimesso in buone "
+    "condizioni generali con indicazione a follow-up ambulatoriale presso il medico curante.",
+    "Anamnesi: {nome} {cognome}, nato il {nascita}. Familiarità per ipertensione arteriosa e diabete mellito tipo 2. "
+    "Non allergie note a farmaci. Ex fumatore, attività fisica moderata.",
+]
+SINTOMI = ["dolore epigastrico", "dispnea da sforzo", "cefalea ricorrente", "astenia", "pirosi retrosternale",
+           "dolore lombare"]
+DIAGNOSI = ["gastrite cronica", "ipertensione arteriosa essenziale", "broncopneumopatia cronica ostruttiva",
+            "diabete mellito tipo 2", "lombalgia acuta", "reflusso gastroesofageo"]
+
+QUERY_TEMPLATES = [
+    "Quali esami ha fatto {nome} {cognome}?",
+    "Riassumi l'ultima visita di {nome} {cognome}",
+    "Che valore di emoglobina ha {nome} {cognome}?",
+    "Che terapia segue {nome} {cognome}?",
+    "Cosa dice il referto dell'ecografia di {nome} {cognome}?",
+    "Qual è la diagnosi di dimissione di {nome} {cognome}?",
+]
+
+
+@dataclass
+class SyntheticPatient:
+    user: User
+    documents: List[str] = field(default_factory=list)
+
+
+def load_template_texts(directory: str = FAKE_DOCS_DIR) -> List[str]:
+    """Testo dei PDF di esempio, usato come paragrafo aggiuntivo nei referti sintetici."""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.pdf"))):
+        try:
+            with open(path, "rb") as f:
+                reader = PdfReader(io.BytesIO(f.read()))
+            text = "\n".join(page.extract_text() or "" for page in reader.pages)
+            # l'estrazione spezza il testo una parola per riga: si ricompone in un paragrafo
+            text = re.sub(r"\s+", " ", text).strip()
+            if text:
+                texts.append(text)
+        except Exception as e:
+            print(f"⚠️ Template {path} ignorato: {e}")
+    return texts
+
+
+def _random_date(rng: random.Random, start_year=2018, end_year=2025) -> datetime.date:
+    start = datetime.date(start_year, 1, 1).toordinal()
+    end = datetime.date(end_year, 12, 31).toordinal()
+    return datetime.date.fromordinal(rng.randint(start, end))
+
+
+def make_document(rng: random.Random, nome: str, cognome: str, paragraphs: int, extra_templates: List[str]) -> str:
+    parts = []
+    for _ in range(paragraphs):
+        if extra_templates and rng.random() < 0.15:
+            parts.append(rng.choice(extra_templates))
+            continue
+        farmaco, dose = rng.choice(FARMACI)
+        parts.append(rng.choice(PARAGRAPH_TEMPLATES).format(
+            specialita=rng.choice(SPECIALITA),
+            data=_random_date(rng).strftime("%d/%m/%Y"),
+            nascita=_random_date(rng, 1935, 2000).strftime("%d/%m/%Y"),
+            nome=nome, cognome=cognome,
+            sintomo=rng.choice(SINTOMI), giorni=rng.randint(2, 60), settimane=rng.randint(2, 12),
+            pa_sis=rng.randint(105, 165), pa_dia=rng.randint(60, 100), fc=rng.randint(55, 105),
+            hb=round(rng.uniform(9.5, 17.0), 1), glic=rng.randint(70, 210), creat=round(rng.uniform(0.6, 1.8), 2),
+            col=rng.randint(140, 290), k=round(rng.uniform(3.3, 5.4), 1), alt=rng.randint(10, 90),
+            farmaco=farmaco, dose=dose, diagnosi=rng.choice(DIAGNOSI),
+        ))
+    return "\n\n".join(parts)
+
+
+def generate_corpus(n_patients: int, docs_per_patient: int, paragraphs_per_doc: int = 6,
+                    seed: int = 42, medico_email: str = "medico.bench@mynurseai.local") -> List[SyntheticPatient]:
+    """Genera `n_patients` pazienti del medico indicato, ognuno con `docs_per_patient` referti."""
+    rng = random.Random(seed)
+    extra_templates = load_template_texts()
+    patients = []
+    for i in range(n_patients):
+        nome = NOMI[i % len(NOMI)]
+        cognome = COGNOMI[(i // len(NOMI)) % len(COGNOMI)]
+        if i >= len(NOMI) * len(COGNOMI):
+            # garantisce nomi completi univoci anche con molti pazienti
+            cognome = f"{cognome} {i // (len(NOMI) * len(COGNOMI))}"
+        user = User(
+            username=f"paziente{i}", email=f"paziente{i}@bench.local", hashed_password="",
+            role="Paziente", nome=nome, cognome=cognome, via="Via Roma", numero_civico="1",
+            citta="Salerno", cap="84100", data_nascita=_random_date(rng, 1935, 2000), sesso="Altro",
+            medicoAssociato=medico_email,
+        )
+        docs = [make_document(rng, nome, cognome, paragraphs_per_doc, extra_templates)
+                for _ in range(docs_per_patient)]
+        patients.append(SyntheticPatient(user=user, documents=docs))
+    return patients
+
+
+def make_medico(email: str = "medico.bench@mynurseai.local") -> User:
+    return User(
+        username="medico_bench", email=email, hashed_password="", role="Medico", nome="Medico",
+        cognome="Benchmark", via="Via Roma", numero_civico="1", citta="Salerno", cap="84100",
+        data_nascita=datetime.date(1970, 1, 1), sesso="Altro",
+    )
+
+
+def generate_queries(patients: List[SyntheticPatient], n_queries: int, seed: int = 7) -> List[str]:
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n_queries):
+        p = rng.choice(patients).user
+        queries.append(rng.choice(QUERY_TEMPLATES).format(nome=p.nome, cognome=p.cognome))
+    return queries
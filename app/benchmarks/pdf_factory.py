@@ -0,0 +1,63 @@
+"""
+Generatore minimale di PDF testuali (Helvetica, WinAnsiEncoding) per i
+benchmark, senza dipendenze esterne. Il testo è estraibile con PyPDF2.
+"""
+import textwrap
+from typing import List
+
+LINE_WIDTH = 95
+LINES_PER_PAGE = 52
+
+
+def _escape(line: str) -> bytes:
+    raw = line.encode("cp1252", errors="replace")
+    return raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+def _page_stream(text: str) -> bytes:
+    lines = []
+    for paragraph in text.split("\n"):
+        lines.extend(textwrap.wrap(paragraph, LINE_WIDTH) or [""])
+    body = [b"BT", b"/F1 9 Tf", b"11 TL", b"40 800 Td"]
+    for line in lines[:LINES_PER_PAGE]:
+        body.append(b"(" + _escape(line) + b") Tj T*")
+    body.append(b"ET")
+    return b"\n".join(body)
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """Crea un PDF con una pagina per ogni stringa di `pages`."""
+    objects: List[bytes] = []
+
+    def add(obj: bytes) -> int:
+        objects.append(obj)
+        return len(objects)
+
+    catalog = add(b"")  # riempito dopo aver creato l'albero delle pagine
+    pages_obj = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    kids = []
+    for text in pages:
+        stream = _page_stream(text)
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_obj, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % k for k in kids)
+                              + b"] /Count %d >>" % len(kids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
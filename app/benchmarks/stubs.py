@@ -0,0 +1,74 @@
+"""
+Sostituti offline per i benchmark: un LLM finto compatibile con `ollama.chat`
+e un embedding deterministico basato su hashing (nessun download di modelli).
+"""
+import hashlib
+import math
+import re
+import time
+from types import SimpleNamespace
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+
+from app.config import DOC_CLASSIFIER_MODEL, GUARD_MODEL, THERAPY_MODEL
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashEmbeddings(Embeddings):
+    """Bag-of-words con hashing firmato su `dim` dimensioni, normalizzato L2."""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _embed(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        for token in _TOKEN_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:8], "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class StubChat:
+    """
+    Finto `ollama.chat`: risponde in modo deterministico in base al modello
+    richiesto, con una latenza simulata opzionale.
+    """
+
+    def __init__(self, latency_s: float = 0.0):
+        self.latency_s = latency_s
+        self.calls = 0
+
+    def __call__(self, model: str, messages=None, stream: bool = False, **kwargs):
+        self.calls += 1
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        # solo l'ultimo messaggio: le istruzioni fisse del messaggio di sistema citano terapie e farmaci
+        prompt = (messages or [{}])[-1].get("content", "").lower()
+        if model == GUARD_MODEL:
+            content = "safe"
+        elif model in (THERAPY_MODEL, DOC_CLASSIFIER_MODEL):
+            if "medico o non_medico" in prompt:
+                content = '{"label":"MEDICO", "confidence":0.9, "reason":"referto clinico"}'
+            else:
+                content = "TERAPIA" if re.search(r"\b(terapia|mg|farmac\w*)\b", prompt) else "NON_TERAPIA"
+        else:
+            content = "Dai documenti disponibili risultano controlli regolari. (risposta di benchmark)"
+        return SimpleNamespace(message=SimpleNamespace(content=content))
+
+
+def install_offline_llm(latency_s: float = 0.0) -> StubChat:
+    """Sostituisce le chiamate Ollama (che passano tutte dallo scheduler LLM) con lo stub."""
+    from app.services.llm_scheduler import scheduler
+
+    stub = StubChat(latency_s)
+    scheduler.chat_fn = stub
+    return stub
@@ -0,0 +1,68 @@
+import streamlit as st
+from app.config import TRACE_DEBUG_PANEL
+from app.services.llm_scheduler import scheduler
+from app.services.memory_budget import memory
+from app.services.prewarm import prewarmer
+from app.services.tracing import tracer
+
+
+def debug_enabled() -> bool:
+    """Il pannello è attivo da configurazione oppure con ?debug=1 nell'URL."""
+    return TRACE_DEBUG_PANEL or st.query_params.get("debug") == "1"
+
+
+def debug_panel(trace_key: str, pipeline: str):
+    """Mostra i tempi dell'ultimo turno e gli istogrammi cumulativi della pipeline."""
+    if not debug_enabled():
+        return
+
+    with st.expander("🛠️ Debug – tempi per stadio"):
+        last = st.session_state.get(trace_key)
+        last = last.to_dict() if last is not None else None
+        if last and last["total"] is not None:
+            st.markdown(f"**Ultimo turno:** {last['total']:.3f}s")
+            st.table([{"Stadio": s["stage"], "Secondi": f"{s['seconds']:.3f}"} for s in last["stages"]])
+        else:
+            st.info("Nessun turno tracciato in questa sessione.")
+
+        stages = tracer.snapshot().get(pipeline, {})
+        if stages:
+            st.markdown("**Storico del processo:**")
+            st.table([
+                {"Stadio": name, "N": h["count"], "p50 (s)": f"{h['p50']:.3f}",
+                 "p95 (s)": f"{h['p95']:.3f}", "max (s)": f"{h['max']:.3f}"}
+                for name, h in stages.items()
+            ])
+
+        warm = prewarmer.status()
+        if warm:
+            st.markdown(f"**Prewarm** (keep-alive: {prewarmer.policy}):")
+            st.table([
+                {"Componente": name, "Stato": info.get("state"),
+                 "Secondi": f"{info['seconds']:.3f}" if info.get("seconds") is not None else "-",
+                 "Errore": info.get("error") or ""}
+                for name, info in warm.items()
+            ])
+
+        queues = scheduler.metrics()
+        if queues:
+            st.markdown("**Code LLM:**")
+            st.table([
+                {"Modello": model, "Limite": m["limit"], "In esecuzione": m["running"],
+                 "In coda": " / ".join(f"{p}: {n}" for p, n in m["waiting"].items()),
+                 "Picco coda": m["max_waiting"], "Richieste": m["requests"], "Unite": m["coalesced"],
+                 "Errori": m["errors"]}
+                for model, m in queues.items()
+            ])
+
+        footprint = memory.snapshot()
+        budget = f"{footprint['budget_bytes'] / 2**20:.0f} MB" if footprint["budget_bytes"] else "nessun limite"
+        st.markdown(f"**Memoria:** {footprint['total_bytes'] / 2**20:.0f} MB stimati su {budget} "
+                    f"(RSS del processo {footprint['process_rss_bytes'] / 2**20:.0f} MB, "
+                    f"scaricamenti: {footprint['evictions']})")
+        if footprint["components"]:
+            st.table([
+                {"Componente": c["name"], "Tipo": c["kind"], "MB": f"{c['bytes'] / 2**20:.1f}",
+                 "Inattivo da (s)": f"{c['idle_s']:.0f}"}
+                for c in footprint["components"]
+            ])
@@ -1,5 +1,6 @@
 import streamlit as st
 import os, time
+from app.services.session_store import session_store
 def sidebar(user):
 # Percorso del file CSS
     css_path = os.path.join("app", "page_styles", "sidebar.css")
@@ -41,11 +42,14 @@ def sidebar(user):
 
         st.markdown('<div class="sidebar-sep"></div>', unsafe_allow_html=True)
         if st.button("🚪 Logout", use_container_width=True):
+            session_store.revoke(st.session_state.get("session_token"))
+            st.session_state.session_token = None
             st.session_state.logged_in = False
             st.session_state.user = None
             st.session_state.show_register = False
             st.query_params.clear()
             st.session_state.chat_history = []
+            st.session_state.chat_history_owner = None
             st.success("Logout effettuato con successo!")
             time.sleep(1)
             st.rerun()
\ No newline at end of file
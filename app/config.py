@@ -0,0 +1,151 @@
+import os
+
+# --- Tracing delle latenze ---
+# File JSON su cui esportare gli istogrammi dopo ogni turno (vuoto = disabilitato)
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "")
+# Porta locale per l'endpoint /metrics in formato Prometheus (0 = disabilitato)
+TRACE_METRICS_PORT = int(os.getenv("TRACE_METRICS_PORT", "0"))
+# Mostra il pannello di debug con i tempi per stadio nelle pagine
+TRACE_DEBUG_PANEL = os.getenv("TRACE_DEBUG_PANEL", "0") == "1"
+
+# --- Validazione documenti ---
+# Interrompe la lettura del PDF al primo controllo fallito (l'esito è comunque un rifiuto)
+VALIDATION_FAIL_FAST = os.getenv("VALIDATION_FAIL_FAST", "1") == "1"
+# Classificazione LLM a campione dei chunk invece che di tutti i chunk
+CLASSIFICATION_SAMPLING = os.getenv("CLASSIFICATION_SAMPLING", "1") == "1"
+# Chunk minimi da valutare prima di fermarsi sull'intervallo di confidenza
+CLASSIFICATION_MIN_CHUNKS = int(os.getenv("CLASSIFICATION_MIN_CHUNKS", "3"))
+# Quantile normale dell'intervallo di Wilson (1.96 = 95%)
+CLASSIFICATION_CONFIDENCE_Z = float(os.getenv("CLASSIFICATION_CONFIDENCE_Z", "1.96"))
+
+# --- Embedding ---
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "intfloat/multilingual-e5-large")
+# hf = sentence-transformers fp32, int8 = quantizzazione dinamica PyTorch, onnx = ONNX Runtime
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hf")
+# Cartella di un modello ONNX già esportato (vuoto = esporta al primo avvio)
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+# Thread di calcolo totali (0 = tutti i core) e batch codificati in parallelo
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+# Cache su disco degli embedding dei chunk (vuoto = disabilitata) e sua dimensione massima
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "1024"))
+
+# --- Indicizzazione ---
+CHROMA_ROOT = os.getenv("CHROMA_ROOT", "chroma_db")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "0"))
+# Backend delle nuove collection: chroma (duckdb+parquet) o sqlite (SQLite + indice HNSW, persistenza incrementale)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Backend sqlite: modifiche dopo le quali persist() riscrive il file dell'indice HNSW
+VECTOR_INDEX_SAVE_EVERY = int(os.getenv("VECTOR_INDEX_SAVE_EVERY", "1000"))
+# Parametri HNSW delle collection nuove (ognuna conserva i propri: vedi reindex --index-param)
+VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "16"))
+VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "200"))
+VECTOR_HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "64"))
+# Collection fino a questo numero di chunk: ricerca esatta (brute force) invece dell'indice HNSW
+VECTOR_EXACT_THRESHOLD = int(os.getenv("VECTOR_EXACT_THRESHOLD", "2000"))
+# Backend sqlite, vettori delle collection nuove: float32, float16 (metà spazio su disco) o pq (quantizzazione prodotto)
+VECTOR_ENCODING = os.getenv("VECTOR_ENCODING", "float32")
+# Quantizzazione prodotto: blocchi (byte in memoria) per chunk e candidati riordinati a piena precisione per risultato
+VECTOR_PQ_SUBVECTORS = int(os.getenv("VECTOR_PQ_SUBVECTORS", "64"))
+VECTOR_PQ_RERANK = int(os.getenv("VECTOR_PQ_RERANK", "10"))
+# Pazienti ricostruiti in parallelo dal re-index
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "2"))
+
+# --- Modelli Ollama ---
+CHAT_MODEL = os.getenv("CHAT_MODEL", "mistral")
+THERAPY_MODEL = os.getenv("THERAPY_MODEL", "medllama2")
+GUARD_MODEL = os.getenv("GUARD_MODEL", "llama-guard3:1b")
+DOC_CLASSIFIER_MODEL = os.getenv("DOC_CLASSIFIER_MODEL", "medllama2")
+
+# --- Prewarm e keep-alive ---
+# Carica in background, subito dopo l'avvio, i componenti indicati (embeddings, analyzer, ollama)
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+PREWARM_COMPONENTS = os.getenv("PREWARM_COMPONENTS", "embeddings,analyzer,ollama")
+# off = nessun ping, always = sempre, hours = solo nella fascia KEEPALIVE_HOURS,
+# activity = solo se ci sono state richieste negli ultimi KEEPALIVE_IDLE_S secondi
+KEEPALIVE_POLICY = os.getenv("KEEPALIVE_POLICY", "hours")
+KEEPALIVE_INTERVAL_S = int(os.getenv("KEEPALIVE_INTERVAL_S", "240"))
+KEEPALIVE_HOURS = os.getenv("KEEPALIVE_HOURS", "7-20")
+KEEPALIVE_IDLE_S = int(os.getenv("KEEPALIVE_IDLE_S", "1800"))
+# Per quanto Ollama tiene il modello in memoria dopo ogni ping
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "10m")
+
+# --- Sessioni ---
+# Chiave HMAC dei token di sessione (vuota = casuale a ogni avvio)
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+# Scadenza per inattività della sessione e validità della copia dell'utente in cache
+SESSION_TTL_S = int(os.getenv("SESSION_TTL_S", "28800"))
+SESSION_USER_TTL_S = int(os.getenv("SESSION_USER_TTL_S", "600"))
+
+# --- Cronologia chat ---
+# Messaggi mostrati all'apertura della chat e caricati a ogni "messaggi precedenti"
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "20"))
+CHAT_HISTORY_PAGE = int(os.getenv("CHAT_HISTORY_PAGE", "20"))
+# Messaggi recenti passati testualmente al prompt; i precedenti confluiscono nel riassunto
+CHAT_CONTEXT_RECENT = int(os.getenv("CHAT_CONTEXT_RECENT", "4"))
+# Il riassunto si aggiorna quando ci sono almeno questi messaggi ancora da riassumere
+CHAT_SUMMARY_BATCH = int(os.getenv("CHAT_SUMMARY_BATCH", "6"))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "1200"))
+
+# --- Sintesi clinica dei pazienti ---
+# Sintesi per paziente aggiornata a ogni upload e usata per le domande di riepilogo
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "1") == "1"
+# direct = la risposta è la sintesi stessa, context = la sintesi è il contesto del prompt al posto dei chunk
+DIGEST_ANSWER_MODE = os.getenv("DIGEST_ANSWER_MODE", "direct")
+DIGEST_MAX_CHARS = int(os.getenv("DIGEST_MAX_CHARS", "2000"))
+# Testo massimo di un documento passato al modello per aggiornare la sintesi
+DIGEST_DOC_MAX_CHARS = int(os.getenv("DIGEST_DOC_MAX_CHARS", "8000"))
+
+# --- Valori di laboratorio ---
+# Estrazione dei valori numerici dei referti nella tabella lab_values all'upload
+LAB_EXTRACTION_ENABLED = os.getenv("LAB_EXTRACTION_ENABLED", "1") == "1"
+# Misure riportate al massimo nelle risposte sull'andamento
+LAB_TREND_LIMIT = int(os.getenv("LAB_TREND_LIMIT", "10"))
+
+# --- Scheduler delle richieste LLM ---
+# Richieste contemporanee per modello verso Ollama, con eccezioni per modello ("mistral=2,medllama2=1")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "1"))
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")
+# Posti di ogni modello riservati alle richieste interattive (se il limite è maggiore di 1)
+LLM_RESERVED_INTERACTIVE = int(os.getenv("LLM_RESERVED_INTERACTIVE", "1"))
+
+# --- Servizio RAG locale ---
+# URL del servizio (es. http://127.0.0.1:8765); vuoto = pipeline eseguita nel processo Streamlit
+RAG_SERVICE_URL = os.getenv("RAG_SERVICE_URL", "")
+RAG_SERVICE_HOST = os.getenv("RAG_SERVICE_HOST", "127.0.0.1")
+RAG_SERVICE_PORT = int(os.getenv("RAG_SERVICE_PORT", "8765"))
+# Pipeline eseguite in parallelo dal servizio e richieste in attesa oltre le quali risponde 503
+RAG_SERVICE_WORKERS = int(os.getenv("RAG_SERVICE_WORKERS", "4"))
+RAG_SERVICE_MAX_QUEUE = int(os.getenv("RAG_SERVICE_MAX_QUEUE", "32"))
+RAG_SERVICE_TIMEOUT_S = int(os.getenv("RAG_SERVICE_TIMEOUT_S", "300"))
+# Segreto condiviso tra pagine e servizio (header X-RAG-Token); obbligatorio per avviare il servizio
+RAG_SERVICE_TOKEN = os.getenv("RAG_SERVICE_TOKEN", "")
+# Se il servizio non risponde, la pipeline viene eseguita nel processo Streamlit
+RAG_SERVICE_FALLBACK = os.getenv("RAG_SERVICE_FALLBACK", "1") == "1"
+# Micro-batching delle query di embedding nel servizio: attesa massima per riempire un batch
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+# --- Budget di memoria ---
+# Memoria massima dei componenti caricati (embedding, analyzer, vectorstore, modelli Ollama); 0 = nessun limite
+MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", "0"))
+# Componenti inutilizzati da più di questi secondi vengono scaricati anche sotto budget; 0 = mai
+MEMORY_IDLE_EVICT_S = int(os.getenv("MEMORY_IDLE_EVICT_S", "0"))
+MEMORY_CHECK_INTERVAL_S = int(os.getenv("MEMORY_CHECK_INTERVAL_S", "30"))
+# Conta nel budget anche i modelli caricati nel server Ollama (sulla stessa macchina)
+MEMORY_INCLUDE_OLLAMA = os.getenv("MEMORY_INCLUDE_OLLAMA", "1") == "1"
+
+# --- Audit log ---
+# Registro di turni di chat e upload (verdetto, pazienti, chunk, terapia, tempi); 0 = disattivato
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "1") == "1"
+# Eventi in attesa di scrittura al massimo: oltre, chi registra attende (contropressione)
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "1000"))
+# Righe per INSERT e intervallo massimo tra due scritture
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "50"))
+AUDIT_FLUSH_INTERVAL_S = float(os.getenv("AUDIT_FLUSH_INTERVAL_S", "2"))
+# Attesa massima di chi registra con la coda piena, poi l'evento va nel file di riserva
+AUDIT_ENQUEUE_TIMEOUT_MS = float(os.getenv("AUDIT_ENQUEUE_TIMEOUT_MS", "50"))
+# File JSONL di riserva per gli eventi non scritti (coda piena o database non disponibile); vuoto = scartati
+AUDIT_SPILL_PATH = os.getenv("AUDIT_SPILL_PATH", "audit_spill.jsonl")
@@ -1,11 +1,15 @@
 import streamlit as st
 from app.pages_custom.login import login_page
-from app.pages_custom.area_personale import area_personale
-from app.pages_custom.show_pazienti import show_pazienti
-from app.pages_custom.upload_docs import upload_docs
-from app.pages_custom.show_docs import show_docs
-from app.pages_custom.ask_chatbot import ask_chatbot
+from app.pages_custom.registry import DEFAULT_PAGE, PAGES, render_page
 from app.database.postgres import SessionLocal, engine, Base
+# i modelli vanno registrati su Base prima di create_all, anche se le pagine che li usano non sono ancora importate
+import app.models.audit, app.models.chat, app.models.clinical_event, app.models.digest  # noqa: F401
+import app.models.doc, app.models.lab, app.models.user  # noqa: F401
+from app.services.audit import start_audit_log
+from app.services.memory_budget import start_memory_manager
+from app.services.prewarm import prewarmer, start_prewarm
+from app.services.session_store import session_store
+from app.services.tracing import start_metrics_exporter
 
 # --- Creazione tabelle se non esistono ---
 Base.metadata.create_all(bind=engine)
@@ -13,6 +17,18 @@ Base.metadata.create_all(bind=engine)
 # --- Configurazione pagina ---
 st.set_page_config(page_title="MyNurseAI", layout="centered")
 
+# --- Endpoint metriche (Prometheus), se configurato ---
+start_metrics_exporter()
+
+# --- Prewarm dei modelli in background (il login non aspetta) ---
+start_prewarm()
+
+# --- Budget di memoria: scaricamento dei componenti meno usati ---
+start_memory_manager()
+
+# --- Registro di audit: scrittura a lotti in background ---
+start_audit_log()
+
 # --- Gestore database ---
 def get_db():
     db = SessionLocal()
@@ -33,26 +49,24 @@ if "logged_in" not in st.session_state:
 if "user" not in st.session_state:
     st.session_state.user = None
 
+# --- Utente dalla sessione lato server: lettura in memoria, il DB solo se il profilo è cambiato ---
+if st.session_state.logged_in:
+    st.session_state.user = session_store.resolve(st.session_state.get("session_token"), db)
+    if st.session_state.user is None:
+        # sessione scaduta o revocata
+        st.session_state.logged_in = False
+        st.query_params.pop("session", None)
+
 # --- Controllo login ---
 if st.session_state.logged_in and st.session_state.user is not None:
     user = st.session_state.user
+    prewarmer.mark_activity()
 
-    # Navigazione tra pagine
-    if st.session_state.current_page == "area_personale":
-        area_personale(user,db)
-    elif st.session_state.current_page == "show_pazienti":
-        # Passa la mail del medico loggato alla funzione show_pazienti
-        show_pazienti(db, user)
-    elif st.session_state.current_page == "upload_docs":
-        upload_docs(db, user)
-    elif st.session_state.current_page == "show_docs":
-        show_docs(db,user)
-    elif st.session_state.current_page == "ask_chatbot":
-        ask_chatbot(db,user)
-    else:
+    # Navigazione tra pagine (il modulo della pagina viene importato alla prima visita)
+    if st.session_state.current_page not in PAGES:
         # Se current_page contiene un valore non valido, torna all'area personale
-        st.session_state.current_page = "area_personale"
-        area_personale(user,db)
+        st.session_state.current_page = DEFAULT_PAGE
+    render_page(st.session_state.current_page, db, user)
 else:
     # Se non loggato, mostra la pagina di login
     login_page(db)
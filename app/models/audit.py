@@ -0,0 +1,32 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, Float, JSON, Index
+from app.database.postgres import Base
+
+class AuditEvent(Base):
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # momento dell'evento, non della scrittura (che avviene a lotti)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    kind = Column(String, nullable=False)  # "chat" o "upload"
+    user_email = Column(String, nullable=False)
+    # email dei pazienti coinvolti
+    pazienti = Column(JSON, nullable=False, default=list)
+    # chat: "ok", "warning" o "error"; upload: "accepted" o "rejected"
+    verdict = Column(String, nullable=False)
+    # chat: chunk recuperati ("<doc_id>-<chunk>")
+    retrieved_ids = Column(JSON, nullable=False, default=list)
+    contains_therapy = Column(Boolean, nullable=True)
+    # upload
+    filename = Column(String, nullable=True)
+    doc_id = Column(Integer, nullable=True)
+    chunks = Column(Integer, nullable=True)
+    message = Column(Text, nullable=True)
+    # tempi del turno: [{"stage", "seconds"}] e totale
+    stages = Column(JSON, nullable=False, default=list)
+    total_s = Column(Float, nullable=True)
+
+    __table_args__ = (
+        Index("ix_audit_events_user_created", "user_email", "created_at"),
+        Index("ix_audit_events_kind_created", "kind", "created_at"),
+    )
@@ -0,0 +1,24 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from app.database.postgres import Base
+
+class ChatMessage(Base):
+    __tablename__ = "chat_messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_email = Column(String, nullable=False)
+    role = Column(String, nullable=False)  # "user" o "bot"
+    content = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_chat_messages_user_email_id", "user_email", "id"),)
+
+
+class ChatSummary(Base):
+    __tablename__ = "chat_summaries"
+
+    user_email = Column(String, primary_key=True)
+    summary = Column(Text, nullable=False, default="")
+    # ultimo messaggio già incluso nel riassunto
+    last_message_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
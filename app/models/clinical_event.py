@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, Index
+from app.database.postgres import Base
+
+class ClinicalEvent(Base):
+    __tablename__ = "clinical_events"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    paziente_email = Column(String, nullable=False)
+    doc_id = Column(Integer, nullable=False, index=True)
+    event = Column(String, nullable=False)
+    # chunk del documento che citano l'evento (0 = documento analizzato, evento assente)
+    chunks = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_clinical_events_patient_event", "paziente_email", "event"),)
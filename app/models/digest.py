@@ -0,0 +1,12 @@
+from datetime import datetime
+from sqlalchemy import Column, String, Text, DateTime
+from app.database.postgres import Base
+
+class PatientDigest(Base):
+    __tablename__ = "patient_digests"
+
+    paziente_email = Column(String, primary_key=True)
+    digest = Column(Text, nullable=False, default="")
+    # id dei documenti già inclusi nella sintesi, separati da virgola
+    doc_ids = Column(Text, nullable=False, default="")
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
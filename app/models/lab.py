@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, Float, Date, Index
+from app.database.postgres import Base
+
+class LabValue(Base):
+    __tablename__ = "lab_values"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    paziente_email = Column(String, nullable=False)
+    doc_id = Column(Integer, nullable=False, index=True)
+    analyte = Column(String, nullable=False)  # nome canonico, es. "emoglobina"
+    value = Column(Float, nullable=False)
+    unit = Column(String, nullable=False)
+    measured_on = Column(Date, nullable=True)  # data del referto, se presente nel testo
+    source = Column(String, nullable=False)  # frammento di testo da cui è stato estratto
+
+    __table_args__ = (Index("ix_lab_values_patient_analyte", "paziente_email", "analyte", "measured_on"),)
@@ -2,6 +2,7 @@ import time
 import streamlit as st
 from app.models.user import User
 from app.services.auth_service import verify_password
+from app.services.session_store import session_store
 from app.pages_custom.registrazione import register_page
 from app.pages_custom.area_personale import area_personale
 
@@ -14,17 +15,18 @@ def login_page(db):
     if "user" not in st.session_state:
         st.session_state.user = None
 
-    # --- 🔹 Rileggi email dai parametri URL (nuova sintassi) ---
-    query_params = st.query_params  # ✅ nuovo metodo
-    if "email" in query_params and not st.session_state.logged_in:
-        email_param = query_params["email"]
-        if isinstance(email_param, list):
-            email_param = email_param[0]
-        user = db.query(User).filter(User.email == email_param).first()
+    # --- 🔹 Ripristina la sessione dal token nell'URL (es. dopo un refresh) ---
+    token = st.query_params.get("session")
+    if token and not st.session_state.logged_in:
+        user = session_store.resolve(token, db)
         if user:
             st.session_state.logged_in = True
             st.session_state.user = user
+            st.session_state.session_token = token
             st.rerun()
+        else:
+            # token scaduto o non valido
+            del st.query_params["session"]
 
     # --- Se loggato, mostra area personale ---
     if st.session_state.logged_in and st.session_state.user:
@@ -69,11 +71,13 @@ def login_page(db):
             return
 
         # ✅ Login riuscito
+        token = session_store.create(user)
         st.session_state.logged_in = True
-        st.session_state.user = user
+        st.session_state.user = session_store.resolve(token)
+        st.session_state.session_token = token
 
-        # ✅ Nuovo modo per impostare i query params
-        st.query_params["email"] = user.email
+        # ✅ Token opaco nell'URL al posto dell'email
+        st.query_params["session"] = token
 
         st.success("✅ Accesso effettuato con successo!")
         time.sleep(1)
@@ -0,0 +1,48 @@
+"""
+Registro delle pagine dell'app.
+
+I moduli delle pagine vengono importati alla prima navigazione invece che
+all'avvio di main.py: il login non paga l'import di LangChain, Chroma, Presidio
+e del client Ollama, che servono solo a chat e caricamento documenti.
+"""
+import importlib
+import sys
+import time
+from dataclasses import dataclass
+
+from app.services.tracing import tracer
+
+
+@dataclass(frozen=True)
+class PageSpec:
+    module: str
+    function: str
+    # area_personale riceve (user, db), le altre pagine (db, user)
+    user_first: bool = False
+
+
+PAGES = {
+    "area_personale": PageSpec("app.pages_custom.area_personale", "area_personale", user_first=True),
+    "show_pazienti": PageSpec("app.pages_custom.show_pazienti", "show_pazienti"),
+    "upload_docs": PageSpec("app.pages_custom.upload_docs", "upload_docs"),
+    "show_docs": PageSpec("app.pages_custom.show_docs", "show_docs"),
+    "ask_chatbot": PageSpec("app.pages_custom.ask_chatbot", "ask_chatbot"),
+}
+DEFAULT_PAGE = "area_personale"
+
+
+def load_page(name: str):
+    """Importa (solo la prima volta) il modulo della pagina e ne restituisce la funzione."""
+    spec = PAGES[name]
+    module = sys.modules.get(spec.module)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(spec.module)
+        tracer.observe("navigation", f"import_{name}", time.perf_counter() - start)
+    return getattr(module, spec.function)
+
+
+def render_page(name: str, db, user):
+    spec = PAGES[name]
+    page = load_page(name)
+    return page(user, db) if spec.user_first else page(db, user)
@@ -2,6 +2,7 @@ import streamlit as st
 
 from app.components.sidebar import sidebar
 from app.models.user import User
+from app.services import patient_import
 
 def show_pazienti(db, user):
     sidebar(user)
@@ -9,6 +10,20 @@ def show_pazienti(db, user):
     st.title("🧍‍♂️ Pazienti associati")
     st.markdown(f"### Lista dei pazienti associati a: **{user.username}**")
 
+    # --- IMPORTAZIONE DA CSV ---
+    with st.expander("📥 Importa pazienti da CSV"):
+        st.caption("Colonne: " + ", ".join(patient_import.COLUMNS)
+                   + ". Separatore virgola o punto e virgola, data di nascita AAAA-MM-GG o GG/MM/AAAA.")
+        roster = st.file_uploader("Elenco pazienti", type=["csv"], key="roster_csv")
+        atomic = st.checkbox("Importa solo se tutte le righe sono valide")
+        if roster is not None and st.button("Importa", key="roster_import"):
+            with st.spinner("Importazione in corso..."):
+                result = patient_import.import_patients(db, user.email, roster.getvalue(), atomic=atomic)
+            (st.success if result.imported else st.warning)(result.message)
+            if result.errors:
+                st.error(f"{len(result.errors)} errori nel file:")
+                st.dataframe([e.__dict__ for e in result.errors], use_container_width=True, hide_index=True)
+
     pazienti = db.query(User).filter(
         User.medicoAssociato == user.email,
         User.role == "Paziente"
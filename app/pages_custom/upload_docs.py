@@ -1,13 +1,12 @@
 import streamlit as st
 from app.components.sidebar import sidebar
-import io
-import os
-from PyPDF2 import PdfReader
 from app.models.doc import Doc
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.vectorstores import Chroma
-from langchain.embeddings import HuggingFaceEmbeddings
+from app.services import rag_client
+from app.services.audit import audit, upload_event
+from app.services.documents import delete_document, replace_document
 from app.security_components.doc_validation import validate_pdf_content
+from app.components.debug_panel import debug_panel
+from app.services.tracing import tracer
 
 def upload_docs(db, user):
     sidebar(user)
@@ -24,22 +23,6 @@ def upload_docs(db, user):
     if patient_flag_key not in st.session_state:
         st.session_state[patient_flag_key] = False
 
-    # --- Cartella paziente per ChromaDB ---
-    persist_dir = os.path.join("chroma_db", p.email)
-    os.makedirs(persist_dir, exist_ok=True)
-
-    # --- Carica o crea vectorstore ---
-    embeddings = HuggingFaceEmbeddings(
-        model_name="intfloat/multilingual-e5-large",
-        encode_kwargs={"normalize_embeddings": True}
-    )
-
-    vectorstore = Chroma(
-        persist_directory=persist_dir,
-        embedding_function=embeddings,
-        collection_name="docs"
-    )
-
     # --- Upload PDF ---
     uploaded_file = st.file_uploader("Carica un nuovo documento", type=["pdf"])
     if uploaded_file is not None:
@@ -54,49 +37,32 @@ def upload_docs(db, user):
         else:
             # imposta lock
             st.session_state[processing_key] = True
-            try:
-                file_bytes = uploaded_file.read()
-
-                # --- VALIDAZIONE PDF ---
-
-
-                valid, message = validate_pdf_content(file_bytes)
-
-                if not valid:
-                    st.error(f"Upload rifiutato: {message}")
-                    # rimuovi il lock e non impostare flag permanente
+            result, error = None, ""
+            with tracer.turn("upload") as trace:
+                st.session_state.last_upload_trace = trace
+                try:
+                    file_bytes = uploaded_file.read()
+                    result = rag_client.ingest_document(db, p.email, uploaded_file.name, file_bytes)
+
+                    if not result.valid:
+                        st.error(f"Upload rifiutato: {result.message}")
+                    else:
+                        st.success(f"Documento '{uploaded_file.name}' caricato con successo!")
+                        if result.index_error:
+                            st.error(f"Errore durante il salvataggio su ChromaDB: {result.index_error}")
+                        else:
+                            st.success(f"Documento '{uploaded_file.name}' indicizzato su ChromaDB!")
+                    # rimuovi il lock
                     st.session_state[processing_key] = False
-                else:
-                    #Salva su PostgreSQL
-                    new_doc = Doc(
-                        filename=uploaded_file.name,
-                        paziente_email=p.email,
-                        file_data=file_bytes
-                    )
-                    db.add(new_doc)
-                    db.commit()
-                    st.success(f"Documento '{uploaded_file.name}' caricato con successo!")
-
-                    #Salva su ChromaDB
-                    try:
-                        reader = PdfReader(io.BytesIO(file_bytes))
-                        text = "".join([page.extract_text() or "" for page in reader.pages])
 
-                        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-                        chunks = text_splitter.split_text(text)
-
-                        vectorstore.add_texts(chunks)
-                        vectorstore.persist()
-                        st.success(f"Documento '{uploaded_file.name}' indicizzato su ChromaDB!")
-                    except Exception as e:
-                        st.error(f"Errore durante il salvataggio su ChromaDB: {e}")
-                    finally:
-                        # rimuovi il lock
-                        st.session_state[processing_key] = False
+                except Exception as e:
+                    error = str(e)
+                    st.error(f"Errore durante l'upload: {e}")
+                    st.session_state[processing_key] = False
+            # solo accodamento: la scrittura avviene in background
+            audit.record(upload_event(user, p.email, uploaded_file.name, result, trace, error))
 
-            except Exception as e:
-                st.error(f"Errore durante l'upload: {e}")
-                st.session_state[processing_key] = False
+    debug_panel("last_upload_trace", "upload")
 
     # --- Lista documenti ---
     docs = db.query(Doc).filter(Doc.paziente_email == p.email).all()
@@ -107,7 +73,7 @@ def upload_docs(db, user):
     st.markdown("### Documenti caricati:")
 
     for d in docs:
-        cols = st.columns([3, 1])
+        cols = st.columns([3, 1, 1, 1])
         with cols[0]:
             st.markdown(f"**{d.filename}**")
         with cols[1]:
@@ -118,5 +84,30 @@ def upload_docs(db, user):
                 mime="application/pdf",
                 key=f"download_{d.id}"
             )
+        with cols[2]:
+            with st.popover("🔁 Sostituisci"):
+                new_file = st.file_uploader("Nuova versione", type=["pdf"], key=f"replace_{d.id}")
+                if new_file is not None and st.button("Conferma", key=f"replace_confirm_{d.id}"):
+                    new_bytes = new_file.read()
+                    valid, message = validate_pdf_content(new_bytes)
+                    if not valid:
+                        st.error(f"Sostituzione rifiutata: {message}")
+                    else:
+                        try:
+                            replace_document(db, d, new_file.name, new_bytes)
+                            st.success(f"Documento sostituito con '{new_file.name}'")
+                            st.rerun()
+                        except Exception as e:
+                            db.rollback()
+                            st.error(f"Errore durante la sostituzione: {e}")
+        with cols[3]:
+            if st.button("🗑️ Elimina", key=f"delete_{d.id}"):
+                try:
+                    delete_document(db, d)
+                    st.success(f"Documento '{d.filename}' eliminato")
+                    st.rerun()
+                except Exception as e:
+                    db.rollback()
+                    st.error(f"Errore durante l'eliminazione: {e}")
         st.markdown("<div style='margin:2px 0;border-bottom:1px solid #ddd;'></div>", unsafe_allow_html=True)
 
@@ -1,10 +1,25 @@
 import re
 import math, json
+import hashlib
 import io
+import random
 import subprocess
 from PyPDF2 import PdfReader
+from dataclasses import dataclass, field
 from typing import Tuple, List
 from statistics import mean
+from app.config import (
+    CLASSIFICATION_CONFIDENCE_Z,
+    CLASSIFICATION_MIN_CHUNKS,
+    CLASSIFICATION_SAMPLING,
+    DOC_CLASSIFIER_MODEL,
+    VALIDATION_FAIL_FAST,
+)
+from app.security_components import fast_scan
+from app.services.llm_scheduler import scheduler
+from app.services.tracing import tracer
+
+_EMBEDDED_CODE_RE = re.compile(r"(?i)(<script|javascript:|eval\(|base64,|import )")
 
 def chunk_text(text: str, max_chunk_length: int = 1500) -> List[str]:
     """Divide il testo in chunk di lunghezza max_chunk_length (in parole)"""
@@ -29,8 +44,13 @@ def classify_chunk_with_ollama(text_chunk: str) -> Tuple[bool, str, float, str]:
         {text_chunk}
         """
     try:
-        result = subprocess.run(
-            ["ollama", "run", "medllama2"],
+        # priorità "background": una validazione lunga non deve rallentare la chat
+        result = scheduler.run(
+            DOC_CLASSIFIER_MODEL,
+            subprocess.run,
+            ["ollama", "run", DOC_CLASSIFIER_MODEL],
+            priority="background",
+            key=("ollama-run", DOC_CLASSIFIER_MODEL, prompt),
             input=prompt.encode("utf-8"),
             capture_output=True,
             timeout=60
@@ -98,6 +118,74 @@ def classify_with_chunks(text: str, chunk_size: int = 1500) -> Tuple[bool, str,
         print(f"\n=== DOCUMENTO FINALE ===\nClassificato come NON_MEDICO, confidence media: {conf:.2f}")
         return False, "non medico", conf
 
+def wilson_interval(successes: int, n: int, z: float = 1.96) -> Tuple[float, float]:
+    """Intervallo di confidenza di Wilson per una proporzione."""
+    if n == 0:
+        return 0.0, 1.0
+    p = successes / n
+    denom = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denom
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return center - margin, center + margin
+
+
+def stratified_chunk_order(n_chunks: int, rng: random.Random) -> List[int]:
+    """Ordine di valutazione: primo chunk, ultimo chunk, poi i centrali in ordine casuale."""
+    if n_chunks <= 2:
+        return list(range(n_chunks))
+    middle = list(range(1, n_chunks - 1))
+    rng.shuffle(middle)
+    return [0, n_chunks - 1] + middle
+
+
+def classify_sampled(text: str, chunk_size: int = 1500,
+                     min_chunks: int = CLASSIFICATION_MIN_CHUNKS,
+                     z: float = CLASSIFICATION_CONFIDENCE_Z) -> Tuple[bool, str, float, int]:
+    """
+    Come classify_with_chunks, ma valuta un campione stratificato dei chunk
+    (primo, ultimo, centrali casuali) e si ferma appena il voto è deciso:
+    quando l'intervallo di Wilson della quota MEDICO esclude 0.5 oppure
+    quando i chunk rimanenti non possono più ribaltare la maggioranza.
+    Ritorna anche il numero di chunk effettivamente classificati.
+    """
+    chunks = chunk_text(text, max_chunk_length=chunk_size)
+    # seed derivato dal testo: lo stesso documento produce sempre lo stesso campione
+    rng = random.Random(hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest())
+    order = stratified_chunk_order(len(chunks), rng)
+    results = []
+
+    print(f"\nDocumento diviso in {len(chunks)} chunk (classificazione a campione)")
+
+    for evaluated, idx in enumerate(order, start=1):
+        print(f"\n=== Chunk {idx + 1} ===")
+        is_medical, label, confidence, reason = classify_chunk_with_ollama(chunks[idx])
+        results.append((is_medical, confidence))
+
+        medico_count = sum(1 for r in results if r[0])
+        non_medico_count = evaluated - medico_count
+        remaining = len(chunks) - evaluated
+
+        # maggioranza già certa (a parità vince MEDICO, come nel voto completo)
+        if medico_count >= non_medico_count + remaining or non_medico_count > medico_count + remaining:
+            break
+        if evaluated >= min_chunks:
+            low, high = wilson_interval(medico_count, evaluated, z)
+            if low > 0.5 or high < 0.5:
+                break
+
+    medico_count = sum(1 for r in results if r[0])
+    non_medico_count = len(results) - medico_count
+    if medico_count >= non_medico_count:
+        conf = sum(r[1] for r in results if r[0]) / max(medico_count, 1)
+        print(f"\n=== DOCUMENTO FINALE ===\nClassificato come MEDICO ({len(results)}/{len(chunks)} chunk), "
+              f"confidence media: {conf:.2f}")
+        return True, "medico", conf, len(results)
+    conf = sum(r[1] for r in results if not r[0]) / max(non_medico_count, 1)
+    print(f"\n=== DOCUMENTO FINALE ===\nClassificato come NON_MEDICO ({len(results)}/{len(chunks)} chunk), "
+          f"confidence media: {conf:.2f}")
+    return False, "non medico", conf, len(results)
+
+
 def shannon_entropy(s: str) -> float:
     """Calcola entropia per identificare testo codificato o nascosto."""
     if not s:
@@ -112,73 +200,41 @@ def check_pdf_structure(pdf_bytes: bytes) -> tuple[bool, str]:
         reader = PdfReader(io.BytesIO(pdf_bytes))
         for page in reader.pages:
             raw = page.extract_text() or ""
-            if re.search(r"(?i)(<script|javascript:|eval\(|base64,|import )", raw):
+            if _EMBEDDED_CODE_RE.search(raw):
                 return False, "Trovato contenuto sospetto o codice embedded nel PDF."
         return True, ""
     except Exception as e:
         return False, f"Errore nella lettura del PDF: {e}"
 
 
-def validate_pdf_content(pdf_bytes: bytes) -> tuple[bool, str]:
-    """
-    Analizza il contenuto del PDF per individuare testo sospetto o codificato.
-    """
-    def alpha_ratio(s: str) -> float:
-        """Percentuale di lettere in una stringa."""
-        if not s:
-            return 0.0
-        letters = len(re.findall(r"[A-Za-z]", s))
-        return letters / max(1, len(s))
-
-    errors = []
-    suspicion_score = 0.0
-    SCORE_THRESHOLD = 2.2
+def alpha_ratio(s: str) -> float:
+    """Percentuale di lettere in una stringa."""
+    if not s:
+        return 0.0
+    letters = len(re.findall(r"[A-Za-z]", s))
+    return letters / max(1, len(s))
 
-    # --- estrazione testo grezzo ---
-    reader = PdfReader(io.BytesIO(pdf_bytes))
-    pages_texts = [page.extract_text() or "" for page in reader.pages]
-    text = "\n".join(pages_texts)
 
-    # --- controllo base sulla lunghezza ---
-    if len(text.strip()) < 300:
-        errors.append("Documento troppo breve o privo di testo leggibile.\n")
-        suspicion_score += 0.6
+def detect_base64(text: str) -> bool:
+    """True se il testo contiene sequenze compatibili con Base64 ad alta entropia."""
+    alnum = re.sub(r"[^A-Za-z0-9+/=]", "", text)
+    for m in re.finditer(r"(?:[A-Za-z0-9+/]{80,}={0,2})", alnum):
+        if shannon_entropy(m.group(0)) > 4.5:
+            return True
+    return False
 
-    # --- controllo struttura ---
-    struct_ok, struct_msg = check_pdf_structure(pdf_bytes)
-    if not struct_ok:
-        errors.append(struct_msg)
-        suspicion_score += 0.9
 
-    # --- normalizzazione ---
-    alnum = re.sub(r"[^A-Za-z0-9+/=]", "", text)
+def entropy_stats(text: str) -> Tuple[float, float]:
+    """Entropia media delle finestre da 200 caratteri ed entropia del testo senza spazi."""
+    chunks = [text[i:i+200] for i in range(0, len(text), 200)]
+    entropy_vals = [shannon_entropy(c) for c in chunks if len(c) > 50]
+    avg_entropy = mean(entropy_vals) if entropy_vals else 0
+    entropy_total = shannon_entropy(re.sub(r"\s+", "", text)) if text.strip() else 0
+    return avg_entropy, entropy_total
 
-    # --- rilevamento Base64 ---
-    base64_matches = list(re.finditer(r"(?:[A-Za-z0-9+/]{80,}={0,2})", alnum))
-    base64_flag = False
-    for m in base64_matches:
-        chunk = m.group(0)
-        if shannon_entropy(chunk) > 4.5:
-            base64_flag = True
-            break
-    if base64_flag:
-        errors.append("Pattern compatibile con Base64 o testo codificato rilevato.\n")
-        suspicion_score += 1.0
 
-    # --- entropia ---
-    try:
-        chunks = [text[i:i+200] for i in range(0, len(text), 200)]
-        entropy_vals = [shannon_entropy(c) for c in chunks if len(c) > 50]
-        avg_entropy = mean(entropy_vals) if entropy_vals else 0
-        entropy_total = shannon_entropy(re.sub(r"\s+", "", text)) if text.strip() else 0
-    except Exception:
-        avg_entropy = entropy_total = 0
-
-    if avg_entropy > 5.5 or entropy_total > 5.5:
-        errors.append("Entropia elevata: possibile testo codificato o anomalo.\n")
-        suspicion_score += 1.0
-
-    # --- rilevamento linee di codice ---
+def count_code_like_lines(text: str) -> int:
+    """Conta le righe che combinano più pattern tipici del codice sorgente."""
     code_like_lines = 0
     for line in text.splitlines():
         line_stripped = line.strip()
@@ -203,29 +259,117 @@ def validate_pdf_content(pdf_bytes: bytes) -> tuple[bool, str]:
 
         if symbol_count >= 3 or keyword_hits >= 1:
             code_like_lines += 1
+    return code_like_lines
 
-    # aumenta la soglia per ridurre falsi positivi
-    if code_like_lines > 15:
-        errors.append(f"Rilevate {code_like_lines} righe con pattern simili a codice.\n")
-        suspicion_score += 0.5
-
-    # --- controllo LLM ---
-    if suspicion_score < 1.6:
-        valid, label, conf = classify_with_chunks(text)
-        if not valid:
-            errors.append("Il documento non appare medico.")
-            suspicion_score += 0.6
-    else:
+
+@dataclass
+class ValidationReport:
+    valid: bool
+    message: str
+    suspicion_score: float
+    pages_read: int
+    total_pages: int
+    llm_skipped: bool
+    chunks_classified: int = 0
+    errors: List[str] = field(default_factory=list)
+
+
+# ordine con cui gli errori compaiono nel messaggio finale
+_ERROR_ORDER = ("length", "structure", "base64", "entropy", "code", "llm")
+_SCORE = {"length": 0.6, "structure": 0.9, "base64": 1.0, "entropy": 1.0, "code": 0.5}
+SCORE_THRESHOLD = 2.2
+
+
+def validate_pdf_stream(pdf_bytes: bytes, fail_fast: bool = VALIDATION_FAIL_FAST) -> ValidationReport:
+    """
+    Valida il PDF pagina per pagina accumulando il punteggio di sospetto.
+    La lettura si interrompe appena il punteggio supera la soglia oppure, con
+    `fail_fast`, al primo errore (qualsiasi errore porta comunque al rifiuto).
+    La classificazione LLM viene eseguita solo se l'esito non è già deciso.
+    """
+    errors = {}
+    suspicion_score = 0.0
+
+    def flag(category: str, message: str):
+        nonlocal suspicion_score
+        if category not in errors:
+            errors[category] = message
+            suspicion_score += _SCORE[category]
+
+    def decided() -> bool:
+        return suspicion_score >= SCORE_THRESHOLD or (fail_fast and bool(errors))
+
+    scan = fast_scan.IncrementalTextScan()
+    page_texts = []
+    total_pages = 0
+
+    # --- lettura incrementale con controlli per pagina ---
+    with tracer.stage("validation_scan"):
         try:
-            valid, label, conf = classify_with_chunks(text)
-            if not valid:
-                errors.append("Il documento non appare medico.")
-                suspicion_score += 0.4
-        except Exception:
-            errors.append("Errore durante la classification LLM.")
+            reader = PdfReader(io.BytesIO(pdf_bytes))
+            total_pages = len(reader.pages)
+            for page in reader.pages:
+                raw = page.extract_text() or ""
+                page_texts.append(raw)
+
+                if _EMBEDDED_CODE_RE.search(raw):
+                    flag("structure", "Trovato contenuto sospetto o codice embedded nel PDF.")
+
+                scan.feed(raw)
+                if scan.base64_found:
+                    flag("base64", "Pattern compatibile con Base64 o testo codificato rilevato.\n")
+                if scan.code_like_lines > 15:
+                    flag("code", f"Rilevate {scan.code_like_lines} righe con pattern simili a codice.\n")
+                if decided():
+                    break
+        except Exception as e:
+            flag("structure", f"Errore nella lettura del PDF: {e}")
+
+        # --- controlli che richiedono il testo completo ---
+        if not decided():
+            avg_entropy, entropy_total = scan.finish()
+            if scan.base64_found:
+                flag("base64", "Pattern compatibile con Base64 o testo codificato rilevato.\n")
+            if not scan.long_enough:
+                flag("length", "Documento troppo breve o privo di testo leggibile.\n")
+            if avg_entropy > 5.5 or entropy_total > 5.5:
+                flag("entropy", "Entropia elevata: possibile testo codificato o anomalo.\n")
+
+    # --- controllo LLM, solo se l'esito non è già un rifiuto ---
+    llm_skipped = bool(errors) or suspicion_score >= SCORE_THRESHOLD
+    chunks_classified = 0
+    if not llm_skipped:
+        with tracer.stage("llm_classification"):
+            try:
+                text = "\n".join(page_texts)
+                if CLASSIFICATION_SAMPLING:
+                    valid, label, conf, chunks_classified = classify_sampled(text)
+                else:
+                    valid, label, conf = classify_with_chunks(text)
+                    chunks_classified = len(chunk_text(text))
+                if not valid:
+                    errors["llm"] = "Il documento non appare medico."
+                    suspicion_score += 0.6
+            except Exception:
+                errors["llm"] = "Errore durante la classification LLM."
+
+    ordered = [errors[c] for c in _ERROR_ORDER if c in errors]
+    rejected = suspicion_score >= SCORE_THRESHOLD or bool(ordered)
+    return ValidationReport(
+        valid=not rejected,
+        message=("; ".join(ordered) if ordered else "Documento sospetto.") if rejected else "",
+        suspicion_score=suspicion_score,
+        pages_read=len(page_texts),
+        total_pages=total_pages,
+        llm_skipped=llm_skipped,
+        chunks_classified=chunks_classified,
+        errors=ordered,
+    )
 
-    # --- decisione finale ---
-    if suspicion_score >= SCORE_THRESHOLD or errors:
-        return False, "; ".join(errors) if errors else "Documento sospetto."
-    return True, ""
 
+def validate_pdf_content(pdf_bytes: bytes) -> tuple[bool, str]:
+    """
+    Analizza il contenuto del PDF per individuare testo sospetto o codificato.
+    """
+    report = validate_pdf_stream(pdf_bytes)
+    return report.valid, report.message
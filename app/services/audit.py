@@ -0,0 +1,219 @@
+"""
+Registro di audit dei turni di chat e degli upload.
+
+Per ogni domanda in chat si registrano verdetto del sanitizer, pazienti
+coinvolti, chunk recuperati, presenza di indicazioni terapeutiche e tempi
+degli stadi; per ogni upload l'esito della validazione, il documento creato
+e i tempi. La pagina non scrive su Postgres: record() mette l'evento in una
+coda limitata in memoria e ritorna, un thread in background lo scrive con un
+INSERT multi-riga insieme agli altri eventi del lotto (AUDIT_BATCH_SIZE
+righe o al più ogni AUDIT_FLUSH_INTERVAL_S secondi).
+
+Contropressione: con la coda piena chi registra attende fino a
+AUDIT_ENQUEUE_TIMEOUT_MS; se la coda è ancora piena l'evento viene
+accodato in AUDIT_SPILL_PATH (JSONL), come i lotti che il database rifiuta.
+Alla chiusura del processo (atexit) la coda viene svuotata sul database.
+
+Code, righe scritte ed eventi finiti nel file di riserva sono su /metrics.
+"""
+import atexit
+import datetime
+import json
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from sqlalchemy import insert
+
+from app.config import (
+    AUDIT_BATCH_SIZE,
+    AUDIT_ENABLED,
+    AUDIT_ENQUEUE_TIMEOUT_MS,
+    AUDIT_FLUSH_INTERVAL_S,
+    AUDIT_QUEUE_SIZE,
+    AUDIT_SPILL_PATH,
+)
+from app.database.postgres import SessionLocal
+from app.models.audit import AuditEvent
+from app.services.tracing import tracer
+
+SHUTDOWN_TIMEOUT_S = 10
+_STOP = object()
+
+
+# --- Eventi ---
+def _timing(trace) -> dict:
+    data = trace.to_dict()
+    return {"stages": data["stages"], "total_s": data["total"]}
+
+
+def chat_event(user, turn, trace) -> dict:
+    """Evento di audit di un turno di chat (ChatTurnResult e TurnTrace del turno)."""
+    return {
+        "created_at": datetime.datetime.utcnow(),
+        "kind": "chat",
+        "user_email": user.email,
+        "pazienti": [p.email for p in turn.pazienti],
+        "verdict": turn.sanitizer_verdict,
+        "retrieved_ids": list(turn.retrieved_ids),
+        "contains_therapy": turn.contains_therapy,
+        **_timing(trace),
+    }
+
+
+def upload_event(user, paziente_email: str, filename: str, result, trace, error: str = "") -> dict:
+    """Evento di audit di un upload: `result` è l'IngestResult, None se l'upload è fallito con `error`."""
+    accepted = result is not None and result.valid
+    return {
+        "created_at": datetime.datetime.utcnow(),
+        "kind": "upload",
+        "user_email": user.email,
+        "pazienti": [paziente_email],
+        "verdict": "accepted" if accepted else "rejected",
+        "filename": filename,
+        "doc_id": result.doc_id if result is not None else None,
+        "chunks": result.chunks if result is not None else None,
+        "message": error or (result.index_error or result.message if result is not None else ""),
+        **_timing(trace),
+    }
+
+
+# --- Scrittura ---
+class AuditLog:
+    def __init__(self, enabled: bool = AUDIT_ENABLED, queue_size: int = AUDIT_QUEUE_SIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE, flush_interval_s: float = AUDIT_FLUSH_INTERVAL_S,
+                 enqueue_timeout_ms: float = AUDIT_ENQUEUE_TIMEOUT_MS, spill_path: str = AUDIT_SPILL_PATH,
+                 session_factory=SessionLocal):
+        self.enabled = enabled
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_s = flush_interval_s
+        self.enqueue_timeout_s = enqueue_timeout_ms / 1000
+        self.spill_path = spill_path
+        self.session_factory = session_factory
+        self.written = 0
+        self.spilled = 0
+        self.dropped = 0
+        self.batches = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, event: dict) -> bool:
+        """Accoda un evento; False se la coda è rimasta piena (evento nel file di riserva o scartato)."""
+        if not self.enabled:
+            return False
+        self.start()
+        try:
+            self._queue.put(event, timeout=self.enqueue_timeout_s)
+            return True
+        except queue.Full:
+            self._spill([event], "coda piena")
+            return False
+
+    def _write(self, batch: List[dict]):
+        db = self.session_factory()
+        try:
+            with tracer.stage("audit_write", pipeline="audit"):
+                db.execute(insert(AuditEvent), batch)
+                db.commit()
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+        except Exception as e:
+            db.rollback()
+            self._spill(batch, f"scrittura fallita: {e}")
+        finally:
+            db.close()
+
+    def _spill(self, events: List[dict], reason: str):
+        if not self.spill_path:
+            with self._lock:
+                self.dropped += len(events)
+            print(f"⚠️ Audit: {len(events)} eventi scartati ({reason})")
+            return
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event, default=str, ensure_ascii=False) + "\n")
+            with self._lock:
+                self.spilled += len(events)
+            print(f"⚠️ Audit: {len(events)} eventi salvati in {self.spill_path} ({reason})")
+        except OSError as e:
+            with self._lock:
+                self.dropped += len(events)
+            print(f"⚠️ Audit: {len(events)} eventi scartati ({reason}; file di riserva: {e})")
+
+    def _loop(self):
+        batch: List[dict] = []
+        deadline = time.monotonic() + self.flush_interval_s
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                if batch:
+                    self._write(batch)
+                return
+            if item is not None:
+                batch.append(item)
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval_s
+
+    # --- Avvio e chiusura ---
+    def start(self):
+        """Avvia il thread di scrittura (una sola volta per processo) e la chiusura ordinata all'uscita."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self, timeout: float = SHUTDOWN_TIMEOUT_S):
+        """Scrive gli eventi ancora in coda e ferma il thread; quelli rimasti oltre `timeout` vanno nel file di riserva."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        # la coda può essere piena: il segnale di stop attende il suo posto come un evento
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        thread.join(timeout)
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        if remaining:
+            self._spill(remaining, "chiusura")
+
+    # --- Diagnostica ---
+    def gauges(self):
+        """Eventi in coda, scritti, nel file di riserva e scartati, per /metrics."""
+        with self._lock:
+            counters = {"written": self.written, "spilled": self.spilled, "dropped": self.dropped,
+                        "batches": self.batches}
+        rows = [("mynurseai_audit_queue_depth", {}, self._queue.qsize())]
+        rows += [(f"mynurseai_audit_{name}", {}, value) for name, value in counters.items()]
+        return rows
+
+
+audit = AuditLog()
+tracer.add_gauge_source(audit.gauges)
+
+
+def start_audit_log():
+    """Avvia il thread di scrittura del registro di audit, se attivo."""
+    if AUDIT_ENABLED:
+        audit.start()
@@ -0,0 +1,162 @@
+"""
+Cronologia della chat salvata su Postgres e memoria della conversazione.
+
+- Ogni turno (domanda e risposta, già mascherate) viene salvato in
+  chat_messages, così la cronologia sopravvive a logout e riavvii.
+- La pagina mostra solo gli ultimi messaggi e carica i precedenti a richiesta.
+- I messaggi più vecchi confluiscono in un riassunto incrementale
+  (chat_summaries), aggiornato in background a blocchi di
+  CHAT_SUMMARY_BATCH messaggi: il contesto passato al prompt RAG è il
+  riassunto più gli ultimi messaggi, quindi ha dimensione limitata.
+"""
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from ollama import ChatResponse
+from sqlalchemy.orm import Session
+
+from app.config import (
+    CHAT_CONTEXT_RECENT,
+    CHAT_MODEL,
+    CHAT_SUMMARY_BATCH,
+    CHAT_SUMMARY_MAX_CHARS,
+)
+from app.database.postgres import SessionLocal
+from app.models.chat import ChatMessage, ChatSummary
+from app.services import prompts
+from app.services.llm_scheduler import scheduler
+
+MESSAGE_EXCERPT_CHARS = 300
+
+
+# --- Messaggi ---
+def append_turn(db: Session, email: str, user_message: str, response: str) -> List[ChatMessage]:
+    messages = [
+        ChatMessage(user_email=email, role="user", content=user_message),
+        ChatMessage(user_email=email, role="bot", content=response),
+    ]
+    db.add_all(messages)
+    db.commit()
+    return messages
+
+
+def load_messages(db: Session, email: str, limit: int, before_id: Optional[int] = None) -> List[ChatMessage]:
+    """Gli ultimi `limit` messaggi (precedenti a `before_id`, se indicato) in ordine cronologico."""
+    query = db.query(ChatMessage).filter(ChatMessage.user_email == email)
+    if before_id is not None:
+        query = query.filter(ChatMessage.id < before_id)
+    return list(reversed(query.order_by(ChatMessage.id.desc()).limit(limit).all()))
+
+
+def has_older(db: Session, email: str, before_id: int) -> bool:
+    return db.query(ChatMessage.id).filter(
+        ChatMessage.user_email == email, ChatMessage.id < before_id
+    ).first() is not None
+
+
+# --- Memoria della conversazione ---
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else "…" + text[-(limit - 1):]
+
+
+def _transcript(messages: List[ChatMessage]) -> str:
+    return "\n".join(
+        f"{'Utente' if m.role == 'user' else 'MyNurseAI'}: {_clip(m.content, MESSAGE_EXCERPT_CHARS)}"
+        for m in messages
+    )
+
+
+def conversation_context(db: Session, email: str) -> str:
+    """
+    Riassunto dei turni precedenti più i messaggi non ancora riassunti (al più
+    CHAT_SUMMARY_BATCH + CHAT_CONTEXT_RECENT, ciascuno troncato).
+    """
+    summary = db.query(ChatSummary).filter(ChatSummary.user_email == email).first()
+    last_id = summary.last_message_id if summary else 0
+    pending = (
+        db.query(ChatMessage)
+        .filter(ChatMessage.user_email == email, ChatMessage.id > last_id)
+        .order_by(ChatMessage.id.desc())
+        .limit(CHAT_SUMMARY_BATCH + CHAT_CONTEXT_RECENT)
+        .all()
+    )
+    parts = []
+    if summary and summary.summary:
+        parts.append(f"Riassunto: {summary.summary}")
+    if pending:
+        parts.append(_transcript(list(reversed(pending))))
+    return "\n".join(parts)
+
+
+def summarize_with_llm(previous: str, messages: List[ChatMessage]) -> str:
+    response: ChatResponse = scheduler.chat(
+        CHAT_MODEL,
+        prompts.render("chat_summary", max_chars=CHAT_SUMMARY_MAX_CHARS, previous=previous or "(vuoto)",
+                       messages=_transcript(messages)),
+        priority="background"
+    )
+    return response.message.content.strip()
+
+
+def summarize_extractive(previous: str, messages: List[ChatMessage]) -> str:
+    """Ripiego senza LLM: accoda le domande dell'utente al riassunto esistente."""
+    questions = "; ".join(_clip(m.content, 150) for m in messages if m.role == "user")
+    return f"{previous} {questions}".strip() if previous else questions
+
+
+def update_summary(db: Session, email: str, summarizer=summarize_with_llm) -> bool:
+    """
+    Fa confluire nel riassunto i messaggi non riassunti più vecchi degli ultimi
+    CHAT_CONTEXT_RECENT, se sono almeno CHAT_SUMMARY_BATCH. Restituisce True se aggiornato.
+    """
+    summary = db.query(ChatSummary).filter(ChatSummary.user_email == email).first()
+    if summary is None:
+        summary = ChatSummary(user_email=email, summary="", last_message_id=0)
+        db.add(summary)
+    pending = (
+        db.query(ChatMessage)
+        .filter(ChatMessage.user_email == email, ChatMessage.id > summary.last_message_id)
+        .order_by(ChatMessage.id)
+        .all()
+    )
+    to_fold = pending[:-CHAT_CONTEXT_RECENT] if CHAT_CONTEXT_RECENT else pending
+    if len(to_fold) < CHAT_SUMMARY_BATCH:
+        db.rollback()
+        return False
+
+    try:
+        text = summarizer(summary.summary, to_fold)
+    except Exception as e:
+        print("⚠️ Riassunto della conversazione con LLM fallito, uso il riassunto estrattivo:", e)
+        text = summarize_extractive(summary.summary, to_fold)
+    summary.summary = _clip(text, CHAT_SUMMARY_MAX_CHARS)
+    summary.last_message_id = to_fold[-1].id
+    summary.updated_at = datetime.utcnow()
+    db.commit()
+    return True
+
+
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+def schedule_summary_update(email: str):
+    """Aggiorna il riassunto in un thread separato (al più uno per utente)."""
+    with _in_flight_lock:
+        if email in _in_flight:
+            return
+        _in_flight.add(email)
+
+    def job():
+        db = SessionLocal()
+        try:
+            update_summary(db, email)
+        except Exception as e:
+            print("⚠️ Aggiornamento del riassunto della conversazione fallito:", e)
+        finally:
+            db.close()
+            with _in_flight_lock:
+                _in_flight.discard(email)
+
+    threading.Thread(target=job, name="chat-summary", daemon=True).start()
@@ -0,0 +1,369 @@
+"""
+Pipeline di un turno di chat (sanitizzazione, retrieval, classificazione,
+generazione, mascheramento), indipendente dall'interfaccia Streamlit.
+"""
+import difflib
+from dataclasses import dataclass, field
+from typing import List, Optional
+from ollama import ChatResponse
+from sqlalchemy.orm import Session
+from app.config import DIGEST_ANSWER_MODE, DIGEST_ENABLED, LAB_EXTRACTION_ENABLED
+from app.models.user import User
+from app.security_components.check_therapy import is_therapy_related
+from app.security_components.PII_obfuscation import obscure_pii
+from app.security_components.prompt_sanitizer import sanitize_user_prompt
+from app.services import clinical_events, indexing, prompts
+from app.services.lab_values import answer_lab_query, parse_lab_query
+from app.services.llm_scheduler import scheduler
+from app.services.patient_digest import get_digest, is_overview_question
+from app.services.tracing import tracer
+
+RETRIEVAL_K = 3
+
+
+# --- Wrapper Ollama ---
+class OllamaWrapper:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def __call__(self, prompt):
+        # un prompt testuale diventa un unico messaggio utente; una lista di messaggi viene passata così com'è
+        messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+        response: ChatResponse = scheduler.chat(
+            self.model_name,
+            messages,
+            priority="interactive"
+        )
+        return [{"generated_text": response.message.content}]
+
+    def reset(self):
+        pass
+
+
+@dataclass
+class ChatTurnResult:
+    """Esito di un turno: cosa mostrare in cronologia e i dati utili a tracing e benchmark."""
+    user_message: str
+    response: str
+    sanitizer_verdict: str = "ok"
+    pazienti: List[User] = field(default_factory=list)
+    retrieved_texts: List[str] = field(default_factory=list)
+    # id dei chunk recuperati ("<doc_id>-<chunk>", come in indexing.chunk_ids)
+    retrieved_ids: List[str] = field(default_factory=list)
+    contains_therapy: Optional[bool] = None
+    prompt: str = ""
+    # messaggio bloccato dal sanitizer: non va salvato né riusato come memoria
+    blocked: bool = False
+
+
+def load_vectorstore(email_paziente, embeddings=None):
+    # versione attiva della collection: durante un re-index resta quella precedente
+    persist_dir = indexing.current_collection_dir(email_paziente)
+    if persist_dir is None:
+        return None
+    return indexing.cached_vectorstore(persist_dir, embeddings)
+
+
+def get_pazienti_del_medico(email_medico: str, db: Session):
+    return db.query(User).filter(User.medicoAssociato == email_medico).all()
+
+
+def build_rag_messages(query, retrieved_docs, pazienti_coinvolti=None, contains_therapy: bool = False,
+                       conversation: str = "") -> List[dict]:
+    """Messaggi del template "rag_answer": istruzioni fisse nel messaggio di sistema, il resto in quello utente."""
+    context = "\n\n".join(retrieved_docs) if retrieved_docs else "(Nessun documento rilevante trovato.)"
+    patient_info = f"Pazienti coinvolti: {pazienti_coinvolti}." if pazienti_coinvolti else ""
+    # memoria della conversazione (dimensione limitata, vedi chat_history.conversation_context)
+    history = f"Conversazione precedente:\n{conversation}\n" if conversation else ""
+    therapy_instruction = prompts.RAG_THERAPY_PRESENT if contains_therapy else prompts.RAG_THERAPY_ABSENT
+    return prompts.render("rag_answer", therapy_instruction=therapy_instruction, patient_info=patient_info,
+                          history=history, context=context, query=query)
+
+
+def identify_multiple_pazienti_in_query(query, pazienti):
+    query_lower = query.lower()
+    found = []
+
+    for p in pazienti:
+        fullname = f"{p.nome.lower()} {p.cognome.lower()}"
+        if fullname in query_lower:
+            found.append(p)
+
+    # Fuzzy search aggiuntiva
+    if not found:
+        names = [f"{p.nome.lower()} {p.cognome.lower()}" for p in pazienti]
+        match = difflib.get_close_matches(query_lower, names, n=2, cutoff=0.6)
+        for m in match:
+            for p in pazienti:
+                if f"{p.nome.lower()} {p.cognome.lower()}" == m:
+                    found.append(p)
+
+    return list(set(found))
+
+
+def extract_clinical_event(query: str):
+    """
+    Estrae gli eventi clinici principali dalla query, invece di tutta la frase.
+    Restituisce una lista di eventi (nomi canonici di clinical_events.EVENTS) o None.
+    """
+    return clinical_events.query_events(query)
+
+
+def event_chunk_counts(db: Session, events, pazienti) -> dict:
+    """
+    Per ogni paziente, i chunk che citano almeno uno degli eventi secondo
+    l'indice invertito (None se l'indice non copre tutti i suoi documenti).
+    """
+    if db is None or not events:
+        return {}
+    counts = {}
+    with tracer.stage("event_lookup"):
+        for p in pazienti:
+            per_event = clinical_events.patient_event_chunks(db, p.email)
+            counts[p.email] = None if per_event is None else sum(per_event[e] for e in events)
+    return counts
+
+
+def retrieve(vectorstore, query: str, events=None, n_event_chunks: Optional[int] = None):
+    """Top-k del vectorstore, limitato ai chunk che citano gli eventi se l'indice ne conosce il numero."""
+    search_kwargs = {"k": RETRIEVAL_K}
+    if events and n_event_chunks:
+        search_kwargs = {"k": min(RETRIEVAL_K, n_event_chunks), "filter": clinical_events.retrieval_filter(events)}
+    with tracer.stage("retrieval"):
+        return vectorstore.as_retriever(search_kwargs=search_kwargs).get_relevant_documents(query)
+
+
+def chunk_id(doc) -> str:
+    return f"{doc.metadata.get('doc_id')}-{doc.metadata.get('chunk')}"
+
+
+def mentions_events(texts, events) -> bool:
+    return any(set(events) & clinical_events.events_in(t) for t in texts)
+
+
+def lookup_lab_values(db: Session, query: str, pazienti) -> Optional[str]:
+    """Risposta dalla tabella lab_values per le domande su ultimo valore o andamento di un analita."""
+    if db is None or not LAB_EXTRACTION_ENABLED:
+        return None
+    parsed = parse_lab_query(query)
+    if parsed is None:
+        return None
+    with tracer.stage("lab_query"):
+        return answer_lab_query(db, pazienti, *parsed)
+
+
+def lookup_digests(db: Session, query: str, pazienti) -> Optional[dict]:
+    """
+    Sintesi precalcolate dei pazienti se la domanda è un riepilogo generale e
+    tutte le sintesi sono aggiornate; altrimenti None e si procede col RAG.
+    """
+    if db is None or not DIGEST_ENABLED or not is_overview_question(query, extract_clinical_event(query)):
+        return None
+    with tracer.stage("digest_lookup"):
+        digests = {p.email: get_digest(db, p.email) for p in pazienti}
+    return digests if all(digests.values()) else None
+
+
+def answer_from_digests(result: ChatTurnResult, query: str, pazienti, digests: dict, chatbot,
+                        conversation: str = "") -> ChatTurnResult:
+    result.pazienti = list(pazienti)
+    result.retrieved_texts = [f"Sintesi dei documenti di {p.nome} {p.cognome}:\n{digests[p.email]}"
+                              for p in pazienti]
+
+    if DIGEST_ANSWER_MODE != "context":
+        with tracer.stage("output_masking"):
+            result.response = obscure_pii("\n\n".join(result.retrieved_texts))
+        return result
+
+    # la sintesi sostituisce i chunk come contesto compatto del prompt
+    with tracer.stage("therapy_classification"):
+        contains_therapy = is_therapy_related("\n\n".join(result.retrieved_texts))
+    result.contains_therapy = contains_therapy
+    pazienti_nomi = ", ".join([f"{p.nome} {p.cognome}" for p in pazienti])
+    rag_messages = build_rag_messages(query, result.retrieved_texts, pazienti_coinvolti=pazienti_nomi,
+                                      contains_therapy=contains_therapy, conversation=conversation)
+    result.prompt = prompts.to_text(rag_messages)
+    with tracer.stage("generation"):
+        raw_response = chatbot(rag_messages)[0]["generated_text"]
+    with tracer.stage("output_masking"):
+        result.response = obscure_pii(raw_response)
+    return result
+
+
+def run_chat_turn(user, pazienti, user_input: str, chatbot, embeddings=None,
+                  conversation: str = "", db: Session = None) -> ChatTurnResult:
+    """
+    Esegue un turno completo della chat per `user` (Medico o Paziente).
+    `pazienti` sono i pazienti consultabili dall'utente; `embeddings` permette di
+    riusare una funzione di embedding già caricata; `conversation` è la memoria
+    dei turni precedenti da includere nel prompt. Con `db` le domande sui valori
+    di laboratorio sono servite dalla tabella lab_values e quelle di riepilogo
+    dalle sintesi precalcolate (patient_digest).
+    """
+    with tracer.stage("pii_masking"):
+        processed_input = obscure_pii(user_input)
+    sanitized_input = sanitize_user_prompt(processed_input)
+    verdict = sanitized_input if sanitized_input in ("error", "warning") else "ok"
+
+    if user.role == "Paziente":
+        if sanitized_input == "error":
+            response = "⚠️ Il messaggio contiene istruzioni non consentite o sospette. Riformula la domanda."
+            # solo il testo mascherato: la pagina non salva né riusa i turni bloccati
+            return ChatTurnResult(processed_input, response, sanitizer_verdict=verdict, blocked=True)
+
+    # continua con la generazione della risposta usando sanitized_input
+    result = ChatTurnResult(processed_input, "", sanitizer_verdict=verdict)
+
+    if user.role == "Medico":
+        selected_pazienti = identify_multiple_pazienti_in_query(processed_input, pazienti)
+
+        if not selected_pazienti:
+            result.response = (
+                "Non ho trovato riferimenti chiari a pazienti tra i tuoi assistiti. "
+                "Specificami il nome completo del paziente o dei pazienti a cui ti riferisci."
+            )
+            return result
+
+        lab_answer = lookup_lab_values(db, processed_input, selected_pazienti)
+        if lab_answer:
+            result.pazienti = selected_pazienti
+            result.response = lab_answer
+            return result
+
+        digests = lookup_digests(db, processed_input, selected_pazienti)
+        if digests:
+            return answer_from_digests(result, processed_input, selected_pazienti, digests, chatbot, conversation)
+
+        # indice degli eventi clinici: se nessun documento cita l'evento si risponde prima del retrieval
+        event_requested = extract_clinical_event(processed_input)
+        event_chunks = event_chunk_counts(db, event_requested, selected_pazienti)
+        if event_chunks and all(n == 0 for n in event_chunks.values()):
+            result.response = (
+                f"📄 Nei documenti disponibili non risultano informazioni relative a '{event_requested}'. "
+                "Non posso fornirti dettagli su questo evento clinico."
+            )
+            return result
+
+        all_docs = []
+        pazienti_con_vectorstore = []
+
+        for p in selected_pazienti:
+            if event_chunks.get(p.email) == 0:
+                continue
+            with tracer.stage("vectorstore_load"):
+                vs = load_vectorstore(p.email, embeddings)
+            if vs is None:
+                continue
+
+            pazienti_con_vectorstore.append(p)
+            all_docs.extend(retrieve(vs, sanitized_input, event_requested, event_chunks.get(p.email)))
+
+        result.pazienti = pazienti_con_vectorstore
+        if not pazienti_con_vectorstore:
+            result.response = "Non ho trovato documenti clinici per nessuno dei pazienti menzionati."
+            return result
+
+        retrieved_texts = [d.page_content for d in all_docs]
+        result.retrieved_texts = retrieved_texts
+        result.retrieved_ids = [chunk_id(d) for d in all_docs]
+        context = "\n\n".join(retrieved_texts)
+
+        if event_requested and not mentions_events(retrieved_texts, event_requested):
+            result.response = (
+                f"📄 Nei documenti disponibili non risultano informazioni relative a '{event_requested}'. "
+                "Non posso fornirti dettagli su questo evento clinico."
+            )
+            return result
+
+        with tracer.stage("therapy_classification"):
+            contains_therapy = is_therapy_related(context)
+        result.contains_therapy = contains_therapy
+
+        pazienti_nomi = ", ".join([f"{p.nome} {p.cognome}" for p in pazienti_con_vectorstore])
+        rag_messages = build_rag_messages(processed_input,
+                                          retrieved_texts,
+                                          pazienti_coinvolti=pazienti_nomi,
+                                          contains_therapy=contains_therapy,
+                                          conversation=conversation)
+        result.prompt = prompts.to_text(rag_messages)
+
+        with tracer.stage("generation"):
+            raw_response = chatbot(rag_messages)[0]["generated_text"]
+        with tracer.stage("output_masking"):
+            response = obscure_pii(raw_response)
+
+        with tracer.stage("therapy_classification"):
+            query_is_therapy = is_therapy_related(sanitized_input)
+
+        if query_is_therapy and not contains_therapy:
+            response = (
+                "⚠️ Nei documenti recuperati non sono presenti indicazioni terapeutiche. "
+                "Posso fornirti solo informazioni cliniche generali, non terapie."
+            )
+        result.response = response
+        return result
+
+    # --- Paziente ---
+    lab_answer = lookup_lab_values(db, processed_input, [user])
+    if lab_answer:
+        result.pazienti = [user]
+        result.response = lab_answer
+        return result
+
+    digests = lookup_digests(db, processed_input, [user])
+    if digests:
+        return answer_from_digests(result, processed_input, [user], digests, chatbot, conversation)
+
+    event_requested = extract_clinical_event(processed_input)
+    no_event_response = (
+        f"📄 Nei documenti presenti non risultano informazioni relative a '{event_requested}'. "
+        "Non posso fornirti dettagli su questo evento clinico."
+    )
+    n_event_chunks = event_chunk_counts(db, event_requested, [user]).get(user.email)
+    if n_event_chunks == 0:
+        result.response = no_event_response
+        return result
+
+    with tracer.stage("vectorstore_load"):
+        vectorstore = load_vectorstore(user.email, embeddings)
+
+    if vectorstore is None:
+        result.response = "Non ho trovato informazioni nei tuoi documenti."
+        return result
+
+    result.pazienti = [user]
+    docs = retrieve(vectorstore, processed_input, event_requested, n_event_chunks)
+    retrieved_texts = [d.page_content for d in docs]
+    result.retrieved_texts = retrieved_texts
+    result.retrieved_ids = [chunk_id(d) for d in docs]
+    context = "\n\n".join(retrieved_texts)
+
+    if event_requested and not mentions_events(retrieved_texts, event_requested):
+        result.response = no_event_response
+        return result
+
+    with tracer.stage("therapy_classification"):
+        contains_therapy = is_therapy_related(context)
+    result.contains_therapy = contains_therapy
+
+    if not retrieved_texts:
+        result.response = "Non ho trovato informazioni utili nei tuoi documenti per rispondere alla domanda."
+        return result
+
+    rag_messages = build_rag_messages(processed_input, retrieved_texts, contains_therapy=contains_therapy,
+                                      conversation=conversation)
+    result.prompt = prompts.to_text(rag_messages)
+    with tracer.stage("generation"):
+        raw_response = chatbot(rag_messages)[0]["generated_text"]
+    with tracer.stage("output_masking"):
+        response = obscure_pii(raw_response)
+    with tracer.stage("therapy_classification"):
+        query_is_therapy = is_therapy_related(processed_input)
+    if query_is_therapy and not contains_therapy:
+        response = (
+            "⚠️ Nei documenti consultati non sono presenti indicazioni terapeutiche. "
+            "Posso riportare solo informazioni cliniche generali relative al caso, "
+            "ma non dettagli su trattamenti o farmaci."
+        )
+    result.response = response
+    return result
@@ -0,0 +1,91 @@
+"""
+Indice invertito degli eventi clinici per paziente (tabella clinical_events).
+
+All'indicizzazione di un documento ogni chunk viene analizzato per gli
+eventi clinici (visita, ecografia, terapia, ...) riconosciuti tramite termini
+e sinonimi: il chunk riceve un metadato "ev_<evento>" = 1 in ChromaDB e la
+tabella registra, per documento ed evento, quanti chunk lo citano (anche 0,
+così si sa che il documento è stato analizzato).
+
+In chat, se la domanda chiede un evento che nessun documento del paziente
+cita, si risponde subito senza embedding né LLM; altrimenti il retrieval
+viene limitato ai chunk che citano l'evento. L'indice è usato solo se copre
+tutti i documenti del paziente: i documenti caricati prima si aggiungono con
+un re-index (python -m app.services.reindex --restart).
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.models.clinical_event import ClinicalEvent
+from app.models.doc import Doc
+
+# evento canonico -> espressione con i termini e i sinonimi che lo indicano
+EVENTS = {
+    "visita": r"visit[aeo]|visitat[oa]|ambulatorial[ei]",
+    "controllo": r"controll[oi]|follow[- ]?up",
+    "referto": r"referto|referti|refertat[oa]",
+    "esame": r"esame|esami|ematochimic[io]|emocromo",
+    "ecografia": r"ecografi[ae]|ecografic[oaeh]+|ecograficamente|eco[- ]?doppler",
+    "analisi": r"analisi|laboratorio",
+    "terapia": r"terapi[ae]|terapeutic[oaeh]+|trattament[oi]",
+    "farmaco": r"farmac[oi]|farmacologic[oaeh]+|posologia",
+}
+_EVENT_RES = {name: re.compile(rf"(?i)\b(?:{pattern})\b") for name, pattern in EVENTS.items()}
+
+
+def events_in(text: str) -> Set[str]:
+    return {name for name, rx in _EVENT_RES.items() if rx.search(text)}
+
+
+def query_events(query: str) -> Optional[List[str]]:
+    """Eventi clinici citati nella domanda, nell'ordine di EVENTS, o None."""
+    found = events_in(query)
+    return [name for name in EVENTS if name in found] or None
+
+
+def chunk_metadata(text: str) -> Dict[str, int]:
+    return {f"ev_{name}": 1 for name in events_in(text)}
+
+
+def retrieval_filter(events) -> dict:
+    """Filtro `where` di Chroma sui chunk che citano almeno uno degli eventi."""
+    clauses = [{f"ev_{name}": 1} for name in events]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+# --- Tabella ---
+def store_document_events(db: Session, email: str, doc_id: int, text: str):
+    """Registra gli eventi citati dai chunk del documento (stesso chunking del vectorstore)."""
+    from app.services.indexing import split_text
+
+    counts = Counter(name for chunk in split_text(text) for name in events_in(chunk))
+    db.query(ClinicalEvent).filter(ClinicalEvent.doc_id == doc_id).delete(synchronize_session=False)
+    db.add_all(ClinicalEvent(paziente_email=email, doc_id=doc_id, event=name, chunks=counts.get(name, 0))
+               for name in EVENTS)
+    db.commit()
+
+
+def delete_document_events(db: Session, doc_id: int):
+    db.query(ClinicalEvent).filter(ClinicalEvent.doc_id == doc_id).delete(synchronize_session=False)
+    db.commit()
+
+
+def patient_event_chunks(db: Session, email: str) -> Optional[Counter]:
+    """
+    Chunk che citano ciascun evento nei documenti del paziente, o None se
+    qualche documento non è ancora nell'indice (in quel caso non lo si usa).
+    """
+    docs = {doc_id for (doc_id,) in db.query(Doc.id).filter(Doc.paziente_email == email)}
+    rows = db.query(ClinicalEvent.doc_id, ClinicalEvent.event, ClinicalEvent.chunks).filter(
+        ClinicalEvent.paziente_email == email
+    ).all()
+    if not docs <= {doc_id for doc_id, _, _ in rows}:
+        return None
+    counts = Counter()
+    for doc_id, event, chunks in rows:
+        if doc_id in docs and event in EVENTS:
+            counts[event] += chunks
+    return counts
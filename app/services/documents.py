@@ -0,0 +1,144 @@
+"""
+Caricamento, eliminazione e sostituzione dei documenti dei pazienti,
+mantenendo allineati la tabella `docs` (riga e PDF) e i chunk nella
+collection ChromaDB attiva.
+
+ingest_document è la pipeline di upload (validazione, salvataggio,
+estrazione, chunking, embedding, persistenza), eseguita nel processo
+Streamlit o nel servizio RAG (app.services.rag_server).
+
+I chunk di un documento si riconoscono dal metadato doc_id e hanno id
+"<doc.id>-<n>". Lo spazio liberato nella collection viene recuperato dalla
+compattazione (python -m app.services.reindex --compact).
+
+Entrambe le operazioni aggiornano i valori di laboratorio estratti e azzerano
+la sintesi clinica del paziente, che viene ricostruita in background dai
+documenti rimasti.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+from app.config import DIGEST_ENABLED, LAB_EXTRACTION_ENABLED
+from app.models.doc import Doc
+from app.security_components.doc_validation import validate_pdf_content
+from app.services import clinical_events, indexing, lab_values, patient_digest
+from app.services.tracing import tracer
+
+
+@dataclass
+class IngestResult:
+    valid: bool
+    message: str = ""
+    doc_id: Optional[int] = None
+    chunks: int = 0
+    # errore dell'indicizzazione: il documento è salvato ma non ancora ricercabile
+    index_error: str = ""
+
+
+def ingest_document(db, email: str, filename: str, file_bytes: bytes, embeddings=None) -> IngestResult:
+    """
+    Valida il PDF, lo salva nella tabella docs e lo indicizza nella collection
+    attiva del paziente (con valori di laboratorio ed eventi clinici).
+    Gli stadi sono cronometrati nel turno di tracing corrente.
+    """
+    with tracer.stage("pdf_validation"):
+        valid, message = validate_pdf_content(file_bytes)
+    if not valid:
+        return IngestResult(False, message)
+
+    doc = Doc(filename=filename, paziente_email=email, file_data=file_bytes)
+    with tracer.stage("db_persist"):
+        db.add(doc)
+        db.commit()
+    result = IngestResult(True, message, doc_id=doc.id)
+
+    try:
+        # versione attiva risolta adesso: un re-index può averla appena cambiata
+        with tracer.stage("vectorstore_load"):
+            persist_dir = indexing.current_collection_dir(email, create=True)
+            # handle condiviso con il retrieval: la collection non viene riletta a ogni upload
+            vectorstore = indexing.cached_vectorstore(persist_dir, embeddings)
+
+        with tracer.stage("text_extraction"):
+            text = indexing.extract_text(file_bytes)
+
+        if LAB_EXTRACTION_ENABLED:
+            with tracer.stage("lab_extraction"):
+                lab_values.store_lab_values(db, email, doc.id, text)
+
+        with tracer.stage("embedding_indexing"):
+            result.chunks = indexing.index_document(vectorstore, doc.id, text)
+            clinical_events.store_document_events(db, email, doc.id, text)
+        with tracer.stage("vectorstore_persist"):
+            vectorstore.persist()
+            indexing.mark_written(persist_dir, vectorstore, embeddings)
+    except Exception as e:
+        db.rollback()
+        result.index_error = str(e)
+        return result
+
+    if DIGEST_ENABLED:
+        patient_digest.schedule_digest_update(email)
+    return result
+
+
+def delete_document(db, doc: Doc) -> int:
+    """Elimina riga, PDF e chunk del documento; restituisce i chunk rimossi."""
+    removed = 0
+    email = doc.paziente_email
+    persist_dir = indexing.current_collection_dir(email)
+    # prima i chunk: se il commit fallisse il documento resterebbe senza chunk,
+    # e la compattazione lo reindicizza; l'ordine inverso lascerebbe chunk orfani in query
+    if persist_dir is not None:
+        with tracer.stage("vectorstore_delete", pipeline="documents"):
+            vectorstore = indexing.cached_vectorstore(persist_dir)
+            removed = indexing.delete_document_chunks(vectorstore, doc.id)
+            if removed:
+                vectorstore.persist()
+                indexing.mark_written(persist_dir, vectorstore)
+    doc_id = doc.id
+    with tracer.stage("db_persist", pipeline="documents"):
+        db.delete(doc)
+        db.commit()
+    clinical_events.delete_document_events(db, doc_id)
+    if LAB_EXTRACTION_ENABLED:
+        lab_values.delete_lab_values(db, doc_id)
+    _refresh_digest(db, email)
+    return removed
+
+
+def replace_document(db, doc: Doc, filename: str, file_bytes: bytes) -> int:
+    """
+    Sostituisce il PDF del documento mantenendone l'id: i vecchi chunk vengono
+    rimossi e il nuovo testo indicizzato. Il PDF va validato prima della chiamata.
+    Restituisce il numero di nuovi chunk.
+    """
+    persist_dir = indexing.current_collection_dir(doc.paziente_email, create=True)
+    vectorstore = indexing.cached_vectorstore(persist_dir)
+    with tracer.stage("vectorstore_delete", pipeline="documents"):
+        indexing.delete_document_chunks(vectorstore, doc.id)
+
+    with tracer.stage("db_persist", pipeline="documents"):
+        doc.filename = filename
+        doc.file_data = file_bytes
+        db.commit()
+
+    with tracer.stage("text_extraction", pipeline="documents"):
+        text = indexing.extract_text(file_bytes)
+    if LAB_EXTRACTION_ENABLED:
+        with tracer.stage("lab_extraction", pipeline="documents"):
+            lab_values.store_lab_values(db, doc.paziente_email, doc.id, text)
+    with tracer.stage("embedding_indexing", pipeline="documents"):
+        chunks = indexing.index_document(vectorstore, doc.id, text)
+        clinical_events.store_document_events(db, doc.paziente_email, doc.id, text)
+    with tracer.stage("vectorstore_persist", pipeline="documents"):
+        vectorstore.persist()
+        indexing.mark_written(persist_dir, vectorstore)
+    _refresh_digest(db, doc.paziente_email)
+    return chunks
+
+
+def _refresh_digest(db, email: str):
+    if DIGEST_ENABLED:
+        patient_digest.reset_digest(db, email)
+        patient_digest.schedule_digest_update(email)
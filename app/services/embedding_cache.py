@@ -0,0 +1,295 @@
+"""
+Cache su disco degli embedding dei chunk.
+
+Ogni vettore è indicizzato da (modello, sha256 del testo normalizzato), così un
+chunk già visto non viene ricalcolato dopo un re-upload, una ricostruzione di
+chroma_db o un cambio di layout dello storage.
+
+Layout di una cache (una cartella per modello/backend):
+- vectors.f32: matrice float32 (slot x dimensione) letta e scritta via np.memmap;
+- index.db:    SQLite con chiave -> slot e istante dell'ultimo utilizzo.
+
+La dimensione è limitata da EMBEDDING_CACHE_MAX_MB: a cache piena gli slot
+usati meno di recente (LRU) vengono riassegnati ai nuovi vettori.
+
+La stessa cartella è condivisa da più processi (Streamlit, reindex,
+rag_server); index.db è in modalità WAL, quindi le letture non attendono le
+scritture. Una scrittura:
+1. in una transazione BEGIN IMMEDIATE rilegge next_slot, sceglie gli slot
+   (liberi o LRU), elimina le voci degli slot riusati incrementando epoch e
+   inserisce le nuove voci come "in scrittura" (last_used negativo, ignorate
+   dalle letture);
+2. scrive i vettori negli slot;
+3. rende visibili le nuove voci.
+Una lettura copia i vettori dentro una transazione di sola lettura e
+confronta epoch prima e dopo: se nel frattempo uno slot è stato riusato, la
+ricerca vale come mancata. Il file dei vettori cresce soltanto e ogni
+processo lo rimappa quando un altro lo ha ingrandito. L'ultimo utilizzo
+delle voci lette (LRU) viene scritto a blocchi.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+_SQL_BATCH = 500
+_MIN_GROWTH = 1024
+_BUSY_TIMEOUT_S = 30
+# aggiornamenti di last_used accumulati prima di scriverli
+_TOUCH_BATCH = 256
+_TOUCH_FLUSH_S = 30
+# voci rimaste "in scrittura" più a lungo (processo terminato a metà) tornano riusabili
+_PENDING_TIMEOUT_S = 300
+
+
+def normalize_chunk(text: str) -> str:
+    return " ".join(text.split())
+
+
+def chunk_key(text: str) -> str:
+    return hashlib.sha256(normalize_chunk(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache persistente e thread-safe degli embedding di un singolo modello."""
+
+    def __init__(self, root: str, model_id: str, max_bytes: int):
+        self.model_id = model_id
+        self.max_bytes = max_bytes
+        self.path = os.path.join(root, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id))
+        os.makedirs(self.path, exist_ok=True)
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.path, "index.db"), timeout=_BUSY_TIMEOUT_S,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used);
+        """)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dim = None
+        self.max_entries = 0
+        self._vectors = None
+        self._touched: Dict[str, float] = {}
+        self._touched_at = time.time()
+        with self._lock, self._transaction():
+            self._refresh()
+
+    # --- Metadati ---
+    def _meta(self, key: str):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _epoch(self) -> int:
+        return int(self._meta("epoch") or 0)
+
+    @contextmanager
+    def _transaction(self, mode: str = "IMMEDIATE"):
+        """Transazione su index.db: IMMEDIATE prende subito il lock di scrittura, DEFERRED è una lettura."""
+        self._db.execute(f"BEGIN {mode}")
+        try:
+            yield
+        except BaseException:
+            self._db.rollback()
+            raise
+        self._db.commit()
+
+    # --- File dei vettori ---
+    def _open(self, dim: int):
+        self.dim = dim
+        self.max_entries = max(1, self.max_bytes // (dim * 4))
+        if int(self._meta("next_slot") or 0) > self.max_entries:
+            # limite ridotto dalla configurazione: si scartano gli slot in eccesso (il file resta com'è)
+            self._db.execute("DELETE FROM entries WHERE slot >= ?", (self.max_entries,))
+            self._set_meta("next_slot", self.max_entries)
+
+    def _file_capacity(self) -> int:
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        return size // (self.dim * 4)
+
+    def _map(self, capacity: int):
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        # il file non si accorcia mai: un altro processo può averlo mappato più grande
+        if self._file_capacity() < capacity:
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(capacity, self.dim)) if capacity else None
+
+    def _capacity(self) -> int:
+        return self._vectors.shape[0] if self._vectors is not None else 0
+
+    def _refresh(self):
+        """Allinea dimensione e mappatura a quanto scritto da altri processi (dentro una transazione)."""
+        if self.dim is None:
+            dim = self._meta("dim")
+            if dim is None:
+                return
+            self._open(int(dim))
+        capacity = min(self._file_capacity(), self.max_entries)
+        if capacity > self._capacity():
+            self._map(capacity)
+
+    def _ensure_capacity(self, slots: int):
+        if slots <= self._capacity():
+            return
+        self._map(min(self.max_entries, max(slots, self._capacity() * 2, _MIN_GROWTH)))
+
+    # --- Lettura e scrittura ---
+    def _flush_touched(self):
+        """Scrive l'ultimo utilizzo delle voci lette (dentro una transazione di scrittura)."""
+        if self._touched:
+            self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ? AND last_used >= 0",
+                                 [(t, k) for k, t in self._touched.items()])
+            self._touched = {}
+        self._touched_at = time.time()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            with self._transaction("DEFERRED"):
+                self._refresh()
+                epoch = self._epoch()
+                slots = {}
+                if self._vectors is not None:
+                    for i in range(0, len(keys), _SQL_BATCH):
+                        batch = keys[i:i + _SQL_BATCH]
+                        placeholders = ",".join("?" * len(batch))
+                        slots.update(self._db.execute(
+                            f"SELECT key, slot FROM entries WHERE key IN ({placeholders}) AND last_used >= 0",
+                            batch).fetchall())
+                for key, slot in slots.items():
+                    found[key] = np.array(self._vectors[slot])
+            # uno slot riusato durante la copia può contenere il vettore di un'altra voce
+            if found and self._epoch() != epoch:
+                found = {}
+            now = time.time()
+            self._touched.update((k, now) for k in found)
+            if len(self._touched) >= _TOUCH_BATCH or (self._touched and now - self._touched_at > _TOUCH_FLUSH_S):
+                with self._transaction():
+                    self._flush_touched()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        if not items:
+            return
+        with self._lock:
+            with self._transaction():
+                self._refresh()
+                if self.dim is None:
+                    dim = len(next(iter(items.values())))
+                    self._set_meta("dim", dim)
+                    self._set_meta("model", self.model_id)
+                    self._open(dim)
+                self._flush_touched()
+
+                # anche le voci "in scrittura" di altri processi contano come presenti
+                existing = set()
+                keys = list(items)
+                for i in range(0, len(keys), _SQL_BATCH):
+                    batch = keys[i:i + _SQL_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    existing.update(k for (k,) in self._db.execute(
+                        f"SELECT key FROM entries WHERE key IN ({placeholders})", batch))
+                new_keys = [k for k in keys if k not in existing][-self.max_entries:]
+                if not new_keys:
+                    return
+
+                # slot liberi in coda al file, poi riuso degli slot meno usati di recente
+                now = time.time()
+                next_slot = int(self._meta("next_slot") or 0)
+                free = min(len(new_keys), self.max_entries - next_slot)
+                slots = list(range(next_slot, next_slot + free))
+                missing = len(new_keys) - free
+                if missing:
+                    victims = self._db.execute(
+                        "SELECT key, slot FROM entries WHERE last_used >= 0 OR last_used > ? "
+                        "ORDER BY last_used LIMIT ?", (_PENDING_TIMEOUT_S - now, missing)).fetchall()
+                    self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+                    slots.extend(slot for _, slot in victims)
+                    self.evictions += len(victims)
+                    self._set_meta("epoch", self._epoch() + 1)
+                    new_keys = new_keys[:len(slots)]
+                self._db.executemany("INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)",
+                                     [(k, s, -now) for k, s in zip(new_keys, slots)])
+                self._set_meta("next_slot", next_slot + free)
+                self._ensure_capacity(next_slot + free)
+
+            self._vectors[slots] = np.asarray([items[k] for k in new_keys], dtype=np.float32)
+            # i vettori arrivano su disco prima che l'indice li renda visibili
+            self._vectors.flush()
+            with self._transaction():
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ? AND slot = ?",
+                                     [(now, k, s) for k, s in zip(new_keys, slots)])
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "model": self.model_id,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Funzione di embedding che consulta la cache prima di invocare il modello."""
+
+    def __init__(self, inner: Embeddings, cache: EmbeddingCache):
+        self.inner = inner
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        keys = [chunk_key(t) for t in texts]
+        found = self.cache.get_many(keys)
+
+        # i testi mancanti (anche ripetuti) vengono calcolati una sola volta
+        todo = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in todo:
+                todo[key] = text
+        if todo:
+            vectors = self.inner.embed_documents(list(todo.values()))
+            computed = dict(zip(todo, vectors))
+            self.cache.put_many(computed)
+            found.update({k: np.asarray(v, dtype=np.float32) for k, v in computed.items()})
+
+        return [found[k].tolist() for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = chunk_key(text)
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key].tolist()
+        vector = self.inner.embed_query(text)
+        self.cache.put_many({key: vector})
+        return vector
@@ -0,0 +1,257 @@
+"""
+Costruzione della funzione di embedding usata da indicizzazione e retrieval.
+
+Backend disponibili (EMBEDDING_BACKEND):
+- "hf":   HuggingFaceEmbeddings (sentence-transformers, PyTorch fp32), il default storico;
+- "int8": stesso modello con quantizzazione dinamica int8 dei layer lineari (PyTorch);
+- "onnx": modello esportato ed eseguito con ONNX Runtime (richiede `optimum[onnxruntime]`).
+
+I backend "int8" e "onnx" codificano a batch raggruppati per lunghezza del testo
+(meno padding) e possono eseguire più batch in parallelo.
+
+get_embeddings() avvolge il backend nella cache persistente su disco
+(app.services.embedding_cache), consultata prima di ogni calcolo.
+MicroBatchEmbeddings raccoglie le query concorrenti (servizio RAG) in un
+unico batch. Il modello caricato è registrato nel budget di memoria
+(app.services.memory_budget) e può essere scaricato quando non serve.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from app.config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_WAIT_MS,
+    EMBEDDING_CACHE_DIR,
+    EMBEDDING_CACHE_MAX_MB,
+    EMBEDDING_MODEL,
+    EMBEDDING_ONNX_PATH,
+    EMBEDDING_THREADS,
+    EMBEDDING_WORKERS,
+)
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache
+from app.services.memory_budget import memory, process_rss
+
+BACKENDS = ("hf", "int8", "onnx")
+
+
+class QuantizedE5Embeddings(Embeddings):
+    """
+    Encoder e5 su CPU con runtime ottimizzato. Produce gli stessi embedding
+    di sentence-transformers (mean pooling + normalizzazione L2), a meno
+    dell'errore di quantizzazione.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, runtime: str = "int8",
+                 batch_size: int = EMBEDDING_BATCH_SIZE, num_threads: int = EMBEDDING_THREADS,
+                 workers: int = EMBEDDING_WORKERS, max_length: int = 512):
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.runtime = runtime
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.workers = max(1, workers)
+        num_threads = num_threads or os.cpu_count() or 1
+        # i thread intra-op vengono ripartiti tra i batch eseguiti in parallelo
+        threads_per_worker = max(1, num_threads // self.workers)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if runtime == "int8":
+            import torch
+            from transformers import AutoModel
+
+            torch.set_num_threads(threads_per_worker)
+            model = AutoModel.from_pretrained(model_name).eval()
+            self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._tensor_type = "pt"
+        elif runtime == "onnx":
+            try:
+                import onnxruntime as ort
+                from optimum.onnxruntime import ORTModelForFeatureExtraction
+            except ImportError as e:
+                raise RuntimeError(
+                    "Il backend 'onnx' richiede il pacchetto optimum[onnxruntime]."
+                ) from e
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = threads_per_worker
+            source = EMBEDDING_ONNX_PATH or model_name
+            self.model = ORTModelForFeatureExtraction.from_pretrained(
+                source, export=not EMBEDDING_ONNX_PATH, session_options=options
+            )
+            self._tensor_type = "np"
+        else:
+            raise ValueError(f"Runtime di embedding non supportato: {runtime}")
+
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embed") \
+            if self.workers > 1 else None
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                return_tensors=self._tensor_type)
+        if self.runtime == "int8":
+            import torch
+
+            with torch.inference_mode():
+                hidden = self.model(**tokens).last_hidden_state.float().numpy()
+            mask = tokens["attention_mask"].numpy()
+        else:
+            hidden = np.asarray(self.model(**tokens).last_hidden_state, dtype=np.float32)
+            mask = tokens["attention_mask"]
+
+        # mean pooling sui token reali, poi normalizzazione L2
+        mask = mask[..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        # batch per lunghezza simile: riduce il padding e quindi il calcolo sprecato
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+
+        def run(batch):
+            return batch, self._encode_batch([texts[i] for i in batch])
+
+        results = self._pool.map(run, batches) if self._pool else map(run, batches)
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        for batch, vectors in results:
+            if out.shape[1] == 0:
+                out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            out[batch] = vectors
+        return out.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def build_embeddings(backend: str = EMBEDDING_BACKEND, model_name: str = EMBEDDING_MODEL) -> Embeddings:
+    """Crea una nuova funzione di embedding per il backend richiesto."""
+    if backend == "hf":
+        from langchain.embeddings import HuggingFaceEmbeddings
+
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            encode_kwargs={"normalize_embeddings": True}
+        )
+    if backend in ("int8", "onnx"):
+        return QuantizedE5Embeddings(model_name=model_name, runtime=backend)
+    raise ValueError(f"EMBEDDING_BACKEND non valido: {backend} (valori ammessi: {', '.join(BACKENDS)})")
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_embeddings(backend: str = EMBEDDING_BACKEND, cached: bool = True) -> Embeddings:
+    """
+    Funzione di embedding condivisa dal processo: il modello viene caricato una
+    sola volta. Con `cached` (e EMBEDDING_CACHE_DIR impostata) i vettori passano
+    dalla cache su disco; i backend quantizzati hanno una cache separata perché
+    producono vettori leggermente diversi da quelli fp32.
+    """
+    name = f"embeddings:{backend}"
+    loaded = False
+    with _instances_lock:
+        if backend not in _instances:
+            rss = process_rss()
+            _instances[backend] = build_embeddings(backend)
+            memory.register(name, "embeddings", process_rss() - rss, lambda: unload_embeddings(backend))
+            loaded = True
+        else:
+            memory.touch(name)
+        model = _instances[backend]
+        if cached and EMBEDDING_CACHE_DIR:
+            key = (backend, "cached")
+            if key not in _instances:
+                cache = EmbeddingCache(EMBEDDING_CACHE_DIR, f"{EMBEDDING_MODEL}@{backend}",
+                                       EMBEDDING_CACHE_MAX_MB * 1024 * 1024)
+                _instances[key] = CachedEmbeddings(model, cache)
+            model = _instances[key]
+    if loaded:
+        memory.enforce(keep=name)
+    return model
+
+
+def unload_embeddings(backend: str):
+    """Rilascia il modello (chiamata dal budget di memoria): verrà ricaricato al prossimo get_embeddings."""
+    with _instances_lock:
+        _instances.pop(backend, None)
+        _instances.pop((backend, "cached"), None)
+
+
+class SharedEmbeddings(Embeddings):
+    """
+    Rimanda a get_embeddings() a ogni chiamata, così chi la conserva (vectorstore
+    aperti, servizio RAG) non trattiene il modello dopo uno scaricamento.
+    """
+
+    def __init__(self, backend: str = EMBEDDING_BACKEND, cached: bool = True):
+        self.backend = backend
+        self.cached = cached
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return get_embeddings(self.backend, self.cached).embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return get_embeddings(self.backend, self.cached).embed_query(text)
+
+
+class MicroBatchEmbeddings(Embeddings):
+    """
+    Raccoglie le embed_query di thread diversi e le codifica insieme con una
+    sola embed_documents (fino a `max_batch` testi, attendendo al più
+    `max_wait_ms` dopo la prima richiesta). Per e5 la query è codificata come
+    un documento, quindi i vettori non cambiano. embed_documents passa diretto.
+    """
+
+    def __init__(self, inner: Embeddings, max_batch: int = EMBEDDING_BATCH_SIZE,
+                 max_wait_ms: float = EMBEDDING_BATCH_WAIT_MS):
+        self.inner = inner
+        self.max_batch = max(1, max_batch)
+        self.max_wait_s = max_wait_ms / 1000
+        self._requests = queue.Queue()
+        threading.Thread(target=self._loop, name="embedding-batcher", daemon=True).start()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        request = {"text": text, "done": threading.Event(), "vector": None, "error": None}
+        self._requests.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["vector"]
+
+    def _loop(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.perf_counter() + self.max_wait_s
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                vectors = self.inner.embed_documents([r["text"] for r in batch])
+                for request, vector in zip(batch, vectors):
+                    request["vector"] = vector
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+            for request in batch:
+                request["done"].set()
+
@@ -0,0 +1,464 @@
+"""
+Indicizzazione dei documenti dei pazienti su ChromaDB.
+
+Estrazione del testo, chunking e inserimento nel vectorstore sono condivisi
+da upload_docs e dal re-index (app.services.reindex), così le due strade
+producono collection identiche.
+
+Layout su disco, con collection versionate:
+
+    chroma_db/<email>/CURRENT     -> contiene il nome della versione attiva (es. "v2")
+    chroma_db/<email>/v1/, v2/... -> una collection Chroma completa per versione
+
+Il puntatore CURRENT viene sostituito in modo atomico (os.replace), quindi chi
+legge vede sempre una versione completa. I pazienti indicizzati prima delle
+versioni hanno la collection direttamente in chroma_db/<email>/ ("legacy"),
+che resta in uso finché un re-index non crea la prima versione.
+
+Ogni versione usa il backend con cui è stata creata: Chroma duckdb+parquet
+oppure SQLite + HNSW (app.services.vector_store), scelto per le collection
+nuove con VECTOR_BACKEND. I parametri dell'indice (m, ef_construction,
+ef_search, exact_threshold) sono salvati con la collection: Chroma li tiene nei
+metadati della collection (hnsw:*), SQLite nella tabella meta.
+"""
+import io
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+from PyPDF2 import PdfReader
+from langchain.schema import Document
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.vectorstores import Chroma
+
+from app.config import CHROMA_ROOT, CHUNK_OVERLAP, CHUNK_SIZE, VECTOR_BACKEND, VECTOR_EXACT_THRESHOLD
+from app.services import vector_store
+from app.services.clinical_events import chunk_metadata
+from app.services.embeddings import SharedEmbeddings
+from app.services.memory_budget import memory
+
+COLLECTION_NAME = "docs"
+POINTER_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+_VERSION_RE = re.compile(r"^v(\d+)$")
+_LEGACY_ENTRIES = ("chroma-collections.parquet", "chroma-embeddings.parquet", "index")
+VECTOR_BACKENDS = ("chroma", "sqlite")
+# parametri dell'indice -> chiavi dei metadati della collection lette da Chroma
+_CHROMA_PARAM_KEYS = {"m": "hnsw:M", "ef_construction": "hnsw:construction_ef", "ef_search": "hnsw:search_ef",
+                      "exact_threshold": "exact_threshold"}
+# valori usati da Chroma per le collection create senza parametri
+_CHROMA_DEFAULT_PARAMS = {"m": 16, "ef_construction": 100, "ef_search": 10, "exact_threshold": VECTOR_EXACT_THRESHOLD,
+                          "encoding": "float32"}
+
+
+# --- Testo e chunk ---
+def extract_text(pdf_bytes: bytes) -> str:
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    return "".join([page.extract_text() or "" for page in reader.pages])
+
+
+def split_text(text: str, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[str]:
+    return CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_text(text)
+
+
+def chunk_ids(doc_id: int, n_chunks: int) -> List[str]:
+    return [f"{doc_id}-{i}" for i in range(n_chunks)]
+
+
+def index_document(vectorstore, doc_id: int, text: str, chunk_size: int = CHUNK_SIZE,
+                   chunk_overlap: int = CHUNK_OVERLAP) -> int:
+    """
+    Aggiunge i chunk di un documento al vectorstore; restituisce il numero di chunk.
+    Ogni chunk porta i metadati ev_<evento> degli eventi clinici che cita (vedi clinical_events).
+    """
+    chunks = split_text(text, chunk_size, chunk_overlap)
+    if chunks:
+        metadatas = [{"doc_id": doc_id, "chunk": i, **chunk_metadata(c)} for i, c in enumerate(chunks)]
+        vectorstore.add_texts(chunks, metadatas=metadatas, ids=chunk_ids(doc_id, len(chunks)))
+    return len(chunks)
+
+
+def is_document_indexed(vectorstore, doc_id: int) -> bool:
+    found = vectorstore.get(where={"doc_id": doc_id}, limit=1, include=["metadatas"])
+    return bool(found["ids"])
+
+
+def delete_document_chunks(vectorstore, doc_id: int) -> int:
+    """Rimuove dal vectorstore tutti e soli i chunk del documento; restituisce quanti erano."""
+    ids = vectorstore.get(where={"doc_id": doc_id}, include=["metadatas"])["ids"]
+    if ids:
+        vectorstore.delete(ids=ids)
+    return len(ids)
+
+
+def stale_chunk_ids(vectorstore, valid_doc_ids) -> List[str]:
+    """Chunk di documenti non più presenti nella tabella docs (senza doc_id non si possono attribuire)."""
+    valid = set(valid_doc_ids)
+    found = vectorstore.get(include=["metadatas"])
+    return [chunk_id for chunk_id, meta in zip(found["ids"], found["metadatas"])
+            if meta and "doc_id" in meta and meta["doc_id"] not in valid]
+
+
+# --- Versioni ---
+def patient_dir(email: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or CHROMA_ROOT, email)
+
+
+def list_versions(email: str, root: Optional[str] = None) -> List[int]:
+    base = patient_dir(email, root)
+    if not os.path.isdir(base):
+        return []
+    return sorted(int(m.group(1)) for m in map(_VERSION_RE.match, os.listdir(base)) if m)
+
+
+def current_version(email: str, root: Optional[str] = None) -> Optional[int]:
+    try:
+        with open(os.path.join(patient_dir(email, root), POINTER_FILE), encoding="utf-8") as f:
+            m = _VERSION_RE.match(f.read().strip())
+    except FileNotFoundError:
+        return None
+    return int(m.group(1)) if m else None
+
+
+def version_dir(email: str, version: int, root: Optional[str] = None) -> str:
+    return os.path.join(patient_dir(email, root), f"v{version}")
+
+
+def has_legacy_collection(email: str, root: Optional[str] = None) -> bool:
+    base = patient_dir(email, root)
+    return any(os.path.exists(os.path.join(base, entry)) for entry in _LEGACY_ENTRIES)
+
+
+def current_collection_dir(email: str, root: Optional[str] = None, create: bool = False) -> Optional[str]:
+    """
+    Cartella della collection attiva del paziente: la versione puntata da
+    CURRENT oppure, se assente, la collection legacy. Con `create` un paziente
+    senza collection riceve direttamente la versione v1.
+    """
+    version = current_version(email, root)
+    if version is not None:
+        return version_dir(email, version, root)
+    base = patient_dir(email, root)
+    if has_legacy_collection(email, root) or (os.path.isdir(base) and not create):
+        return base
+    if not create:
+        return None
+    path = version_dir(email, 1, root)
+    os.makedirs(path, exist_ok=True)
+    set_current_version(email, 1, root)
+    return path
+
+
+def set_current_version(email: str, version: int, root: Optional[str] = None):
+    """Sposta in modo atomico il puntatore CURRENT sulla versione indicata."""
+    base = patient_dir(email, root)
+    tmp = os.path.join(base, f".{POINTER_FILE}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(f"v{version}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(base, POINTER_FILE))
+
+
+def write_manifest(path: str, **info):
+    with open(os.path.join(path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), **info}, f, indent=2)
+
+
+def read_manifest(path: str) -> dict:
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def prune_versions(email: str, keep: int = 1, root: Optional[str] = None) -> List[str]:
+    """
+    Elimina le versioni più vecchie di quella attiva, tenendone `keep` per un
+    eventuale rollback, e le versioni più recenti non attivate (re-index
+    interrotti). Da chiamare solo quando nessun re-index del paziente è in corso.
+    """
+    current = current_version(email, root)
+    if current is None:
+        return []
+    base = patient_dir(email, root)
+    older = [v for v in list_versions(email, root) if v < current]
+    kept = set(older[-keep:]) if keep > 0 else set()
+    removed = []
+    for v in list_versions(email, root):
+        if v == current or v in kept:
+            continue
+        drop_vectorstore(version_dir(email, v, root))
+        shutil.rmtree(version_dir(email, v, root), ignore_errors=True)
+        removed.append(f"v{v}")
+    # la collection legacy conta come la versione più vecchia di tutte
+    if has_legacy_collection(email, root) and len(older) >= keep:
+        drop_vectorstore(base)
+        for entry in _LEGACY_ENTRIES:
+            path = os.path.join(base, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        removed.append("legacy")
+    return removed
+
+
+# --- Vectorstore ---
+def detect_backend(persist_dir: str) -> Optional[str]:
+    """Backend della collection in `persist_dir` dai file presenti, None se è ancora vuota."""
+    if os.path.exists(os.path.join(persist_dir, vector_store.DB_FILE)):
+        return "sqlite"
+    if any(os.path.exists(os.path.join(persist_dir, entry)) for entry in _LEGACY_ENTRIES):
+        return "chroma"
+    return None
+
+
+def _chroma_metadata(index_params: Optional[dict]) -> dict:
+    """Metadati della collection Chroma; i vettori compressi sono disponibili solo con il backend sqlite."""
+    requested = vector_store.validate_index_params(index_params or {})
+    if requested.get("encoding", "float32") != "float32":
+        raise ValueError(f"encoding={requested['encoding']} richiede il backend sqlite")
+    params = {**vector_store.default_index_params(), **requested}
+    return {name: params[key] for key, name in _CHROMA_PARAM_KEYS.items()}
+
+
+def _chroma_params(metadata: Optional[dict]) -> dict:
+    metadata = metadata or {}
+    return {key: metadata[name] for key, name in _CHROMA_PARAM_KEYS.items() if name in metadata}
+
+
+class ChromaCollection(Chroma):
+    """
+    Collection Chroma con i parametri dell'indice nei metadati della
+    collection: Chroma legge hnsw:* quando carica l'indice, exact_threshold
+    attiva la ricerca esatta per le collection piccole. Per la ricerca esatta
+    embedding, testi e metadati restano in memoria finché il numero di chunk
+    non cambia.
+    """
+
+    _exact_cache = None
+
+    def index_params(self) -> dict:
+        return {**_CHROMA_DEFAULT_PARAMS, **_chroma_params(self._collection.metadata)}
+
+    def set_index_params(self, **changes) -> dict:
+        """Aggiorna ef_search ed exact_threshold; m ed ef_construction richiedono di riscrivere la collection."""
+        changes = vector_store.validate_index_params(changes)
+        params = {**self.index_params(), **changes}
+        graph = [key for key in vector_store.GRAPH_PARAMS if params[key] != self.index_params()[key]]
+        if graph and self._collection.count():
+            raise ValueError(f"{', '.join(graph)} si applicano solo riscrivendo la collection "
+                             f"(python -m app.services.reindex --compact --force --index-param ...)")
+        self._collection.modify(metadata=_chroma_metadata(params))
+        return params
+
+    # l'handle può essere condiviso tra retrieval e scritture: una sostituzione
+    # lascia invariato il numero di chunk, quindi la copia va azzerata
+    def add_texts(self, *args, **kwargs):
+        self._exact_cache = None
+        return super().add_texts(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        self._exact_cache = None
+        return super().delete(*args, **kwargs)
+
+    def _exact_data(self):
+        count = self._collection.count()
+        cached = self._exact_cache
+        if cached is None or cached[0] != count:
+            data = self._collection.get(include=["embeddings", "documents", "metadatas"])
+            cached = self._exact_cache = (count, np.asarray(data["embeddings"], dtype=np.float32),
+                                          data["documents"], [m or {} for m in data["metadatas"]])
+        return cached[1:]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs):
+        count = self._collection.count()
+        if not count or count > self.index_params()["exact_threshold"]:
+            return super().similarity_search_with_score(query, k, filter=filter, **kwargs)
+        vectors, documents, metadatas = self._exact_data()
+        positions = [i for i, meta in enumerate(metadatas) if vector_store.matches(meta, filter)]
+        if not positions:
+            return []
+        query_vector = np.asarray(self._embedding_function.embed_query(query), dtype=np.float32)
+        best, distances = vector_store.exact_knn(query_vector, vectors[positions], k)
+        return [(Document(page_content=documents[positions[i]], metadata=metadatas[positions[i]]), float(d))
+                for i, d in zip(best, distances)]
+
+
+def open_vectorstore(persist_dir: str, embeddings=None, backend: Optional[str] = None,
+                     index_params: Optional[dict] = None):
+    """
+    Apre la collection con il backend con cui è stata scritta; una collection
+    nuova usa `backend` o, in mancanza, VECTOR_BACKEND, e i parametri
+    dell'indice `index_params` (i mancanti da VECTOR_HNSW_* e VECTOR_EXACT_THRESHOLD).
+    """
+    detected = detect_backend(persist_dir)
+    backend = detected or backend or VECTOR_BACKEND
+    embeddings = embeddings or SharedEmbeddings()
+    if backend == "sqlite":
+        return vector_store.SQLiteHNSWStore(persist_dir, embeddings, index_params=index_params)
+    if backend != "chroma":
+        raise ValueError(f"VECTOR_BACKEND non valido: {backend} (valori ammessi: {', '.join(VECTOR_BACKENDS)})")
+    return ChromaCollection(
+        persist_directory=persist_dir,
+        embedding_function=embeddings,
+        collection_name=COLLECTION_NAME,
+        # su una collection esistente i metadati passati sostituirebbero quelli salvati
+        collection_metadata=_chroma_metadata(index_params) if detected is None else None,
+    )
+
+
+def saved_index_params(persist_dir: str) -> dict:
+    """Parametri dell'indice salvati con la collection (vuoto se non ne ha, es. collection Chroma legacy)."""
+    backend = detect_backend(persist_dir)
+    if backend == "sqlite":
+        store = vector_store.SQLiteHNSWStore(persist_dir)
+        try:
+            return store.index_params()
+        finally:
+            store.close()
+    if backend is None:
+        return {}
+    from app.database.chromadb import get_chroma_client
+
+    client = get_chroma_client(persist_dir)
+    if COLLECTION_NAME not in [c.name for c in client.list_collections()]:
+        return {}
+    return _chroma_params(client.get_collection(COLLECTION_NAME).metadata)
+
+
+def read_collection(persist_dir: str) -> dict:
+    """Tutti i chunk della collection con id, embedding, testi e metadati, senza ricalcolare nulla."""
+    empty = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    backend = detect_backend(persist_dir)
+    if backend == "sqlite":
+        store = vector_store.SQLiteHNSWStore(persist_dir)
+        try:
+            return store.get(include=["embeddings", "documents", "metadatas"])
+        finally:
+            store.close()
+    if backend is None:
+        return empty
+    from app.database.chromadb import get_chroma_client
+
+    client = get_chroma_client(persist_dir)
+    if COLLECTION_NAME not in [c.name for c in client.list_collections()]:
+        return empty
+    return client.get_collection(COLLECTION_NAME).get(include=["embeddings", "documents", "metadatas"])
+
+
+def write_collection(persist_dir: str, data: dict, positions: Optional[List[int]] = None,
+                     backend: Optional[str] = None, batch_size: int = 500, index_params: Optional[dict] = None):
+    """Scrive in una collection nuova i chunk di `data` (tutti o quelli in `positions`) con i loro embedding."""
+    backend = backend or VECTOR_BACKEND
+    positions = list(range(len(data["ids"]))) if positions is None else list(positions)
+    batches = [
+        {key: [data[key][j] for j in positions[i:i + batch_size]]
+         for key in ("ids", "embeddings", "documents", "metadatas")}
+        for i in range(0, len(positions), batch_size)
+    ]
+    if backend == "sqlite":
+        store = vector_store.SQLiteHNSWStore(persist_dir, index_params=index_params)
+        for b in batches:
+            store.add_embeddings(b["ids"], b["embeddings"], b["documents"], b["metadatas"])
+        store.save_index()
+        store.close()
+        return
+    from app.database.chromadb import get_chroma_client
+
+    client = get_chroma_client(persist_dir)
+    collection = client.get_or_create_collection(COLLECTION_NAME, metadata=_chroma_metadata(index_params))
+    for b in batches:
+        collection.add(**b)
+    client.persist()
+
+
+# Handle condivisi, uno per collection, per il retrieval e per le scritture
+# delle pagine (upload, eliminazione, sostituzione): duckdb+parquet carica
+# l'intera collection all'apertura e SQLiteHNSWStore legge metadati e indice,
+# quindi riaprire la collection a ogni domanda o upload costerebbe quanto la
+# sua dimensione. L'handle viene riaperto se i file dei dati sono cambiati
+# per una scrittura da un altro handle o da un altro processo (quelle fatte
+# sull'handle stesso sono registrate da mark_written) e può essere scaricato
+# dal budget di memoria. L'handle sostituito o scaricato non viene chiuso
+# qui: un'altra domanda può starlo ancora usando, e viene liberato (connessione
+# e indice) quando anche l'ultimo riferimento è rilasciato.
+_handles = {}
+_handles_lock = threading.Lock()
+# file riscritti da ogni modifica dei dati: parquet di Chroma, database SQLite e il suo WAL
+_STAMP_FILES = ("chroma-collections.parquet", "chroma-embeddings.parquet",
+                vector_store.DB_FILE, vector_store.DB_FILE + "-wal")
+
+
+def _collection_stamp(persist_dir: str):
+    """(ultima modifica, dimensione in byte) dei file dei dati della collection."""
+    mtime = size = 0
+    for name in _STAMP_FILES:
+        try:
+            st = os.stat(os.path.join(persist_dir, name))
+        except OSError:
+            continue
+        mtime = max(mtime, st.st_mtime_ns)
+        size += st.st_size
+    return mtime, size
+
+
+def cached_vectorstore(persist_dir: str, embeddings=None, backend: Optional[str] = None):
+    """
+    Handle condiviso della collection in `persist_dir`. Chi ci scrive chiama
+    mark_written dopo persist(); `backend` vale solo per una collection nuova.
+    """
+    name = f"vectorstore:{persist_dir}"
+    stamp, size = _collection_stamp(persist_dir)
+    with _handles_lock:
+        entry = _handles.get(persist_dir)
+    if entry is not None and entry[1] == stamp and entry[2] is embeddings:
+        memory.touch(name)
+        return entry[0]
+    vectorstore = open_vectorstore(persist_dir, embeddings, backend=backend)
+    if hasattr(vectorstore, "memory_bytes"):
+        size = vectorstore.memory_bytes()  # sqlite: in memoria c'è solo l'indice, non tutta la collection
+    with _handles_lock:
+        current = _handles.get(persist_dir)
+        if current is not None and current[1] == stamp and current[2] is embeddings:
+            # un altro thread ha appena aperto la stessa versione: si usa la sua
+            vectorstore = current[0]
+        else:
+            _handles[persist_dir] = (vectorstore, stamp, embeddings)
+            memory.register(name, "vectorstore", size, lambda: drop_vectorstore(persist_dir))
+    memory.enforce(keep=name)
+    return vectorstore
+
+
+def mark_written(persist_dir: str, vectorstore, embeddings=None):
+    """
+    Dopo una scrittura sull'handle condiviso: l'handle è già aggiornato, quindi
+    il nuovo stato dei file non deve farlo riaprire. Le modifiche arrivate nel
+    frattempo da altri processi vengono lette con refresh() (backend sqlite);
+    Chroma non sa farlo e l'handle viene riaperto alla prossima domanda.
+    """
+    refresh = getattr(vectorstore, "refresh", None)
+    if refresh is None:
+        return
+    stamp, _ = _collection_stamp(persist_dir)
+    refresh()
+    with _handles_lock:
+        entry = _handles.get(persist_dir)
+        if entry is None or entry[0] is not vectorstore:
+            return  # handle scaricato o sostituito nel frattempo
+        _handles[persist_dir] = (vectorstore, stamp, entry[2])
+    memory.resize(f"vectorstore:{persist_dir}", vectorstore.memory_bytes())
+
+
+def drop_vectorstore(persist_dir: str):
+    """Rilascia l'handle condiviso della collection (scaricata o eliminata)."""
+    with _handles_lock:
+        _handles.pop(persist_dir, None)
+    memory.forget(f"vectorstore:{persist_dir}")
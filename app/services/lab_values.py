@@ -0,0 +1,196 @@
+"""
+Estrazione strutturata dei valori di laboratorio dai referti (tabella lab_values).
+
+All'upload il testo del documento viene analizzato con espressioni regolari:
+per ogni "analita valore unità" (es. "emoglobina 13,2 g/dl") si salva una riga
+con il nome canonico dell'analita, il valore numerico, l'unità e la data del
+referto più vicina che precede il valore. Le domande come "ultimo valore di
+emoglobina di Mario Rossi" o "andamento glicemia" vengono poi servite da una
+query SQL, senza retrieval né LLM.
+
+Per estrarre i valori dei documenti già caricati:
+    python -m app.services.lab_values
+"""
+import argparse
+import datetime
+import re
+import sys
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.config import LAB_TREND_LIMIT
+from app.database.postgres import SessionLocal
+from app.models.doc import Doc
+from app.models.lab import LabValue
+
+# nome canonico -> sinonimi usati nei referti e nelle domande
+ANALYTES = {
+    "emoglobina": ["emoglobina", "hb", "hgb"],
+    "emoglobina glicata": ["emoglobina glicata", "hba1c"],
+    "glicemia": ["glicemia", "glucosio"],
+    "creatinina": ["creatinina"],
+    "azotemia": ["azotemia", "urea"],
+    "colesterolo totale": ["colesterolo totale", "colesterolo"],
+    "colesterolo hdl": ["colesterolo hdl", "hdl"],
+    "colesterolo ldl": ["colesterolo ldl", "ldl"],
+    "trigliceridi": ["trigliceridi"],
+    "potassio": ["potassio"],
+    "sodio": ["sodio"],
+    "alt": ["alt", "gpt"],
+    "ast": ["ast", "got"],
+    "ggt": ["ggt", "gamma gt"],
+    "bilirubina": ["bilirubina totale", "bilirubina"],
+    "ferritina": ["ferritina"],
+    "pcr": ["pcr", "proteina c reattiva"],
+    "tsh": ["tsh"],
+}
+UNITS = ["g/dl", "mg/dl", "mmol/l", "µmol/l", "umol/l", "meq/l", "u/l", "ui/l", "mui/l", "ng/ml", "mg/l", "g/l", "%"]
+
+_SYNONYMS = sorted(((s, name) for name, syns in ANALYTES.items() for s in syns), key=lambda x: -len(x[0]))
+_CANONICAL = dict(_SYNONYMS)
+_ANALYTE_RE = "|".join(re.escape(s) for s, _ in _SYNONYMS)
+_UNIT_RE = "|".join(re.escape(u) for u in sorted(UNITS, key=len, reverse=True))
+
+_VALUE_RE = re.compile(
+    rf"(?i)\b(?P<analyte>{_ANALYTE_RE})\b[^\d\n]{{0,15}}?(?P<value>\d+(?:[.,]\d+)?)\s*(?P<unit>{_UNIT_RE})(?![\w/])"
+)
+_DATE_RE = re.compile(r"\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})\b")
+# date di nascita: non sono la data del referto
+_BIRTH_RE = re.compile(r"(?i)nat[oa]\s+(?:il\s+)?$")
+_QUERY_ANALYTE_RE = re.compile(rf"(?i)\b({_ANALYTE_RE})\b")
+
+TREND_KEYWORDS = ["andamento", "storico", "trend", "evoluzione", "nel tempo"]
+LAST_KEYWORDS = ["ultimo", "ultima", "più recente", "attuale", "che valore", "quanto è", "quanto ha"]
+
+
+# --- Estrazione ---
+def _report_dates(text: str) -> List[Tuple[int, datetime.date]]:
+    dates = []
+    for m in _DATE_RE.finditer(text):
+        if _BIRTH_RE.search(text[max(0, m.start() - 12):m.start()]):
+            continue
+        try:
+            dates.append((m.start(), datetime.date(int(m.group(3)), int(m.group(2)), int(m.group(1)))))
+        except ValueError:
+            continue
+    return dates
+
+
+def extract_lab_values(text: str) -> List[dict]:
+    """Valori di laboratorio presenti nel testo, ciascuno con la data del referto che lo precede."""
+    dates = _report_dates(text)
+    values = []
+    for m in _VALUE_RE.finditer(text):
+        preceding = [d for pos, d in dates if pos < m.start()]
+        values.append({
+            "analyte": _CANONICAL[m.group("analyte").lower()],
+            "value": float(m.group("value").replace(",", ".")),
+            "unit": m.group("unit").lower(),
+            "measured_on": preceding[-1] if preceding else (dates[0][1] if dates else None),
+            "source": m.group(0)[:120],
+        })
+    return values
+
+
+def store_lab_values(db: Session, email: str, doc_id: int, text: str) -> int:
+    """Sostituisce i valori estratti dal documento `doc_id`; restituisce quanti ne ha salvati."""
+    values = extract_lab_values(text)
+    db.query(LabValue).filter(LabValue.doc_id == doc_id).delete(synchronize_session=False)
+    db.add_all(LabValue(paziente_email=email, doc_id=doc_id, **v) for v in values)
+    db.commit()
+    return len(values)
+
+
+def delete_lab_values(db: Session, doc_id: int):
+    db.query(LabValue).filter(LabValue.doc_id == doc_id).delete(synchronize_session=False)
+    db.commit()
+
+
+# --- Domande ---
+def parse_lab_query(query: str) -> Optional[Tuple[str, str]]:
+    """(analita, "last" | "trend") se la domanda chiede un valore di laboratorio, altrimenti None."""
+    m = _QUERY_ANALYTE_RE.search(query)
+    if m is None:
+        return None
+    q = query.lower()
+    if any(k in q for k in TREND_KEYWORDS):
+        return _CANONICAL[m.group(1).lower()], "trend"
+    if any(k in q for k in LAST_KEYWORDS):
+        return _CANONICAL[m.group(1).lower()], "last"
+    return None
+
+
+def _fmt_value(value: float, unit: str) -> str:
+    return f"{value:g}".replace(".", ",") + f" {unit}"
+
+
+def _fmt_date(day: Optional[datetime.date]) -> str:
+    return day.strftime("%d/%m/%Y") if day else "data non indicata"
+
+
+def lab_history(db: Session, email: str, analyte: str, limit: int) -> List[LabValue]:
+    """Ultime `limit` misure dell'analita, dalla più recente."""
+    return (
+        db.query(LabValue)
+        .filter(LabValue.paziente_email == email, LabValue.analyte == analyte)
+        .order_by(LabValue.measured_on.desc().nullslast(), LabValue.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
+def answer_lab_query(db: Session, pazienti, analyte: str, mode: str) -> Optional[str]:
+    """Risposta testuale dalla tabella lab_values, o None se nessun paziente ha misure dell'analita."""
+    limit = 1 if mode == "last" else LAB_TREND_LIMIT
+    histories = {p.email: lab_history(db, p.email, analyte, limit) for p in pazienti}
+    if not any(histories.values()):
+        return None
+
+    doc_ids = {v.doc_id for rows in histories.values() for v in rows}
+    filenames = dict(db.query(Doc.id, Doc.filename).filter(Doc.id.in_(doc_ids)).all())
+    parts = []
+    for p in pazienti:
+        rows = histories[p.email]
+        name = f"{p.nome} {p.cognome}"
+        if not rows:
+            parts.append(f"🧪 Nei documenti di {name} non risultano valori di {analyte}.")
+        elif mode == "last":
+            v = rows[0]
+            parts.append(f"🧪 Ultimo valore di {analyte} di {name}: **{_fmt_value(v.value, v.unit)}** "
+                         f"({_fmt_date(v.measured_on)}, da {filenames.get(v.doc_id, 'documento')}).")
+        else:
+            rows = list(reversed(rows))
+            lines = [f"- {_fmt_date(v.measured_on)}: {_fmt_value(v.value, v.unit)}" for v in rows]
+            text = f"🧪 Andamento di {analyte} di {name} ({len(rows)} misure):\n" + "\n".join(lines)
+            if len(rows) > 1 and rows[0].unit == rows[-1].unit:
+                delta = rows[-1].value - rows[0].value
+                text += f"\nVariazione: {'+' if delta >= 0 else '-'}{_fmt_value(abs(delta), rows[-1].unit)}"
+            parts.append(text)
+    return "\n\n".join(parts)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estrae i valori di laboratorio dai documenti già caricati")
+    parser.add_argument("--patients", default="", help="email dei pazienti separate da virgola (default: tutti)")
+    args = parser.parse_args(argv)
+
+    from app.services.indexing import extract_text
+
+    emails = [e.strip() for e in args.patients.split(",") if e.strip()]
+    db = SessionLocal()
+    try:
+        query = db.query(Doc)
+        if emails:
+            query = query.filter(Doc.paziente_email.in_(emails))
+        total = 0
+        for doc in query.order_by(Doc.id):
+            total += store_lab_values(db, doc.paziente_email, doc.id, extract_text(doc.file_data))
+        print(f"✅ {total} valori di laboratorio estratti")
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Scheduler centrale delle richieste LLM verso Ollama.
+
+Chat, controlli di llama-guard, classificazione delle terapie, validazione
+dei documenti, sintesi e ping di keep-alive passano tutti da qui:
+
+- classi di priorità: "interactive" (turno di chat), "background" (upload,
+  sintesi, riassunti) e "idle" (keep-alive). Quando un modello ha un posto
+  libero parte la richiesta in attesa con priorità più alta (a parità, la
+  più vecchia); se il limite del modello è maggiore di 1,
+  LLM_RESERVED_INTERACTIVE posti restano riservati alle richieste interattive;
+- limite di richieste contemporanee per modello (LLM_MAX_CONCURRENCY, con
+  eccezioni in LLM_MODEL_CONCURRENCY);
+- metriche: richieste in coda per modello e priorità, in esecuzione, picco
+  della coda, richieste unite, ultimo utilizzo reale (i ping di keep-alive
+  non contano, vedi app.services.memory_budget); l'attesa in coda finisce nel tracer
+  (pipeline "llm_queue") e la profondità della coda su /metrics;
+- singleflight: richieste identiche contemporanee (stesso modello, stessi
+  messaggi e opzioni) condividono un'unica chiamata. Se una richiesta
+  interattiva si unisce a una in coda con priorità più bassa, questa viene
+  promossa.
+
+Le chiamate sono bloccanti e vengono eseguite nel thread del chiamante: lo
+scheduler decide solo quando possono partire.
+"""
+import itertools
+import json
+import threading
+import time
+
+from app.config import LLM_MAX_CONCURRENCY, LLM_MODEL_CONCURRENCY, LLM_RESERVED_INTERACTIVE
+from app.services.tracing import tracer
+
+PRIORITIES = ("interactive", "background", "idle")
+
+
+def parse_limits(spec: str) -> dict:
+    """'mistral=2,medllama2=1' -> {"mistral": 2, "medllama2": 1}."""
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            model, value = item.split("=", 1)
+            limits[model.strip()] = int(value)
+    return limits
+
+
+class _Flight:
+    """Chiamata in corso condivisa da richieste identiche."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.ticket = None  # [rank, seq] finché la chiamata è in coda
+
+
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.running = 0
+        self.running_low = 0  # richieste non interattive in esecuzione
+        self.waiting = []  # ticket [rank, seq]
+        self.max_waiting = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.last_used = None  # ultima richiesta non "idle" partita (per il budget di memoria)
+
+
+class LLMScheduler:
+    def __init__(self, default_limit: int = LLM_MAX_CONCURRENCY, limits: dict = None,
+                 reserved_interactive: int = LLM_RESERVED_INTERACTIVE):
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self.reserved_interactive = reserved_interactive
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._flights = {}
+        self._seq = itertools.count()
+        # sostituibili (es. con lo stub dei benchmark); None = client ollama
+        self.chat_fn = None
+        self.generate_fn = None
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._queues.get(model)
+        if queue is None:
+            queue = self._queues[model] = _ModelQueue(self.limits.get(model, self.default_limit))
+        return queue
+
+    # --- Posti per modello ---
+    def _can_start(self, queue: _ModelQueue, ticket) -> bool:
+        if ticket != min(queue.waiting) or queue.running >= queue.limit:
+            return False
+        if ticket[0] > 0 and queue.limit > 1:
+            return queue.running_low < max(1, queue.limit - self.reserved_interactive)
+        return True
+
+    def _acquire(self, model: str, rank: int, flight: _Flight = None):
+        with self._cond:
+            queue = self._queue(model)
+            ticket = [rank, next(self._seq)]
+            if flight is not None:
+                flight.ticket = ticket
+            queue.waiting.append(ticket)
+            queue.max_waiting = max(queue.max_waiting, len(queue.waiting))
+            while not self._can_start(queue, ticket):
+                self._cond.wait()
+            queue.waiting.remove(ticket)
+            if flight is not None:
+                flight.ticket = None
+            queue.running += 1
+            if ticket[0] > 0:
+                queue.running_low += 1
+            if ticket[0] < len(PRIORITIES) - 1:
+                queue.last_used = time.time()
+            # un'altra richiesta può partire se ci sono ancora posti
+            self._cond.notify_all()
+            return ticket[0]
+
+    def _release(self, model: str, rank: int):
+        with self._cond:
+            queue = self._queue(model)
+            queue.running -= 1
+            if rank > 0:
+                queue.running_low -= 1
+            self._cond.notify_all()
+
+    # --- Esecuzione ---
+    def run(self, model: str, fn, *args, priority: str = "interactive", key=None, **kwargs):
+        """
+        Esegue fn(*args, **kwargs) quando `model` ha un posto libero per la
+        priorità indicata. Con `key` le richieste contemporanee con la stessa
+        chiave condividono la stessa chiamata (e lo stesso risultato o errore).
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Priorità non valida: {priority} (valori ammessi: {', '.join(PRIORITIES)})")
+        rank = PRIORITIES.index(priority)
+
+        flight = shared = None
+        if key is not None:
+            with self._cond:
+                shared = self._flights.get(key)
+                if shared is None:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    queue = self._queue(model)
+                    queue.requests += 1
+                    queue.coalesced += 1
+                    if shared.ticket is not None and rank < shared.ticket[0]:
+                        shared.ticket[0] = rank
+                        self._cond.notify_all()
+            if shared is not None:
+                shared.done.wait()
+                if shared.error is not None:
+                    raise shared.error
+                return shared.result
+
+        with self._cond:
+            self._queue(model).requests += 1
+        start = time.perf_counter()
+        try:
+            held = self._acquire(model, rank, flight)
+            tracer.observe("llm_queue", f"{model}:{priority}", time.perf_counter() - start)
+            try:
+                result = fn(*args, **kwargs)
+            finally:
+                self._release(model, held)
+        except BaseException as e:
+            with self._cond:
+                self._queue(model).errors += 1
+            if flight is not None:
+                flight.error = e
+            raise
+        else:
+            if flight is not None:
+                flight.result = result
+            return result
+        finally:
+            if flight is not None:
+                with self._cond:
+                    self._flights.pop(key, None)
+                flight.done.set()
+
+    def chat(self, model: str, messages, priority: str = "interactive", coalesce: bool = True, **options):
+        """Come ollama.chat (senza streaming), passando dallo scheduler."""
+        key = ("chat", model, json.dumps(messages, sort_keys=True),
+               json.dumps(options, sort_keys=True, default=str)) if coalesce else None
+        return self.run(model, self._chat, model, messages, priority=priority, key=key, **options)
+
+    def generate(self, model: str, prompt: str, priority: str = "interactive", coalesce: bool = True, **options):
+        """Come ollama.generate (senza streaming), passando dallo scheduler."""
+        key = ("generate", model, prompt, json.dumps(options, sort_keys=True, default=str)) if coalesce else None
+        return self.run(model, self._generate, model, prompt, priority=priority, key=key, **options)
+
+    def _chat(self, model, messages, **options):
+        fn = self.chat_fn
+        if fn is None:
+            from ollama import chat as fn
+        return fn(model=model, messages=messages, stream=False, **options)
+
+    def _generate(self, model, prompt, **options):
+        fn = self.generate_fn
+        if fn is None:
+            from ollama import generate as fn
+        return fn(model=model, prompt=prompt, stream=False, **options)
+
+    # --- Metriche ---
+    def metrics(self) -> dict:
+        with self._cond:
+            return {
+                model: {
+                    "limit": q.limit,
+                    "running": q.running,
+                    "waiting": {p: sum(1 for t in q.waiting if t[0] == i) for i, p in enumerate(PRIORITIES)},
+                    "max_waiting": q.max_waiting,
+                    "requests": q.requests,
+                    "coalesced": q.coalesced,
+                    "errors": q.errors,
+                    "last_used": q.last_used,
+                }
+                for model, q in sorted(self._queues.items())
+            }
+
+    def gauges(self):
+        """Profondità delle code e richieste in esecuzione, per /metrics."""
+        rows = []
+        for model, m in self.metrics().items():
+            for priority, n in m["waiting"].items():
+                rows.append(("mynurseai_llm_queue_depth", {"model": model, "priority": priority}, n))
+            rows.append(("mynurseai_llm_running", {"model": model}, m["running"]))
+        return rows
+
+
+scheduler = LLMScheduler(limits=parse_limits(LLM_MODEL_CONCURRENCY))
+tracer.add_gauge_source(scheduler.gauges)
@@ -0,0 +1,280 @@
+"""
+Budget di memoria dei componenti caricati: modello di embedding, analyzer
+Presidio (con spaCy), vectorstore aperti per il retrieval e modelli Ollama.
+
+Ogni componente viene registrato al caricamento con una stima della memoria
+occupata e marcato a ogni utilizzo. Quando il totale supera MEMORY_BUDGET_MB
+vengono scaricati i componenti usati meno di recente; con MEMORY_IDLE_EVICT_S
+vengono scaricati anche quelli inattivi da troppo tempo, a prescindere dal
+budget. Un componente scaricato viene ricaricato al primo utilizzo.
+
+Stime della memoria:
+- embedding e analyzer: crescita della memoria residente (RSS) del processo
+  durante il caricamento;
+- vectorstore: dimensione su disco della collection (duckdb+parquet la carica
+  interamente in memoria); per il backend sqlite la stima dell'indice in
+  memoria (SQLiteHNSWStore.memory_bytes);
+- modelli Ollama: dimensione riportata dal server (ollama ps), aggiornata dal
+  controllo periodico. Vengono scaricati con keep_alive=0 e, finché non
+  tornano a essere usati, il keep-alive del prewarm non li ricarica. I
+  modelli con una richiesta in corso non vengono scaricati.
+
+Lo stato è visibile nel pannello di debug e su /metrics.
+"""
+import gc
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.config import MEMORY_BUDGET_MB, MEMORY_CHECK_INTERVAL_S, MEMORY_IDLE_EVICT_S, MEMORY_INCLUDE_OLLAMA
+from app.services.llm_scheduler import scheduler
+from app.services.tracing import tracer
+
+def process_rss() -> int:
+    """Memoria residente del processo in byte (0 se non disponibile)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return 0
+
+
+def _field(obj, name: str):
+    """Campo di una risposta del client ollama (oggetto o dizionario a seconda della versione)."""
+    value = getattr(obj, name, None)
+    if value is None and isinstance(obj, dict):
+        value = obj.get(name)
+    return value
+
+
+def ollama_loaded_models() -> Dict[str, int]:
+    """Modelli caricati nel server Ollama: {nome: byte}, con i nomi come in configurazione."""
+    from ollama import ps
+
+    loaded = {}
+    for m in _field(ps(), "models") or []:
+        name = _field(m, "model") or _field(m, "name") or ""
+        if name.endswith(":latest"):
+            name = name[:-len(":latest")]
+        loaded[name] = int(_field(m, "size") or 0)
+    return loaded
+
+
+def unload_ollama(model: str):
+    """Chiede a Ollama di liberare il modello (keep_alive=0), in un thread per non attendere la coda del modello."""
+    def job():
+        try:
+            scheduler.generate(model, "", priority="idle", coalesce=False, keep_alive=0)
+        except Exception as e:
+            print(f"⚠️ Scaricamento del modello {model} fallito:", e)
+
+    threading.Thread(target=job, name="ollama-unload", daemon=True).start()
+
+
+class _Component:
+    def __init__(self, name: str, kind: str, size: int, unload: Callable[[], None]):
+        self.name = name
+        self.kind = kind
+        self.size = max(0, int(size))
+        self.unload = unload
+        self.loaded_at = self.last_used = time.time()
+
+
+class MemoryManager:
+    def __init__(self, budget_mb: int = MEMORY_BUDGET_MB, idle_evict_s: int = MEMORY_IDLE_EVICT_S,
+                 interval_s: int = MEMORY_CHECK_INTERVAL_S, include_ollama: bool = MEMORY_INCLUDE_OLLAMA):
+        self.budget = budget_mb * 1024 * 1024
+        self.idle_evict_s = idle_evict_s
+        self.interval_s = interval_s
+        self.include_ollama = include_ollama
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._components: Dict[str, _Component] = {}
+        self._evicted: Dict[str, dict] = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Registrazione ---
+    def register(self, name: str, kind: str, size: int, unload: Callable[[], None]):
+        """
+        Registra un componente appena caricato. Non applica il budget: il
+        chiamante invoca enforce() dopo aver rilasciato i propri lock, perché
+        scaricare un altro componente può richiederli.
+        """
+        with self._lock:
+            self._components[name] = _Component(name, kind, size, unload)
+            self._evicted.pop(name, None)
+
+    def touch(self, name: str):
+        with self._lock:
+            component = self._components.get(name)
+            if component is not None:
+                component.last_used = time.time()
+
+    def resize(self, name: str, size: int):
+        """Aggiorna la stima di un componente già registrato (es. collection cresciuta con un upload)."""
+        with self._lock:
+            component = self._components.get(name)
+            if component is not None:
+                component.size = max(0, int(size))
+                component.last_used = time.time()
+
+    def forget(self, name: str):
+        """Rimuove un componente già scaricato dal chiamante (es. collection eliminata)."""
+        with self._lock:
+            self._components.pop(name, None)
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(c.size for c in self._components.values())
+
+    # --- Scaricamento ---
+    def _busy(self, component: _Component) -> bool:
+        if component.kind != "ollama":
+            return False
+        return scheduler.metrics().get(component.name[len("ollama:"):], {}).get("running", 0) > 0
+
+    def _evict(self, component: _Component, reason: str) -> bool:
+        with self._lock:
+            if self._components.get(component.name) is not component:
+                return False
+            del self._components[component.name]
+            self._evicted[component.name] = {"at": time.time(), "reason": reason, "size": component.size}
+            self.evictions += 1
+        try:
+            component.unload()
+        except Exception as e:
+            print(f"⚠️ Scaricamento di {component.name} fallito:", e)
+        return True
+
+    def _collect(self, victims: List[_Component], reason: str) -> List[str]:
+        evicted = [c.name for c in victims if self._evict(c, reason)]
+        if evicted:
+            gc.collect()
+        return evicted
+
+    def enforce(self, keep: Optional[str] = None) -> List[str]:
+        """Scarica i componenti usati meno di recente finché il totale rientra nel budget."""
+        if not self.budget:
+            return []
+        with self._lock:
+            candidates = sorted(self._components.values(), key=lambda c: c.last_used)
+            total = sum(c.size for c in candidates)
+        victims = []
+        for component in candidates:
+            if total <= self.budget:
+                break
+            if component.name == keep or self._busy(component):
+                continue
+            victims.append(component)
+            total -= component.size
+        return self._collect(victims, "budget")
+
+    def evict_idle(self, now: Optional[float] = None) -> List[str]:
+        """Scarica i componenti inattivi da più di MEMORY_IDLE_EVICT_S secondi."""
+        if not self.idle_evict_s:
+            return []
+        now = now or time.time()
+        with self._lock:
+            idle = [c for c in self._components.values() if now - c.last_used > self.idle_evict_s]
+        return self._collect([c for c in idle if not self._busy(c)], "idle")
+
+    # --- Modelli Ollama ---
+    def refresh_ollama(self):
+        """Allinea i modelli Ollama al server: dimensione, modelli scaduti da soli, ultimo utilizzo dallo scheduler."""
+        if not self.include_ollama:
+            return
+        try:
+            loaded = ollama_loaded_models()
+        except Exception as e:
+            print("⚠️ Lettura dei modelli caricati in Ollama fallita:", e)
+            return
+        usage = scheduler.metrics()
+        with self._lock:
+            for name in [n for n, c in self._components.items() if c.kind == "ollama"]:
+                if name[len("ollama:"):] not in loaded:
+                    del self._components[name]
+            for model, size in loaded.items():
+                name = f"ollama:{model}"
+                component = self._components.get(name)
+                if component is None:
+                    component = self._components[name] = _Component(name, "ollama", size,
+                                                                     lambda m=model: unload_ollama(m))
+                component.size = size
+                last_used = usage.get(model, {}).get("last_used")
+                if last_used:
+                    component.last_used = max(component.last_used, last_used)
+
+    def allows_keep_alive(self, model: str) -> bool:
+        """False se il modello è stato scaricato da qui (budget o inattività) e da allora nessuno lo ha più usato."""
+        with self._lock:
+            evicted = self._evicted.get(f"ollama:{model}")
+        if evicted is None:
+            return True
+        last_used = scheduler.metrics().get(model, {}).get("last_used") or 0
+        return last_used > evicted["at"]
+
+    # --- Controllo periodico ---
+    def check(self) -> List[str]:
+        self.refresh_ollama()
+        return self.evict_idle() + self.enforce()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.check()
+            except Exception as e:
+                print("⚠️ Controllo del budget di memoria fallito:", e)
+
+    def start(self):
+        """Avvia il controllo periodico (una sola volta per processo)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="memory-budget", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    # --- Diagnostica ---
+    def snapshot(self) -> dict:
+        now = time.time()
+        with self._lock:
+            components = [
+                {"name": c.name, "kind": c.kind, "bytes": c.size,
+                 "idle_s": round(now - c.last_used, 1), "loaded_s": round(now - c.loaded_at, 1)}
+                for c in sorted(self._components.values(), key=lambda c: c.last_used, reverse=True)
+            ]
+            evicted = {name: dict(info) for name, info in self._evicted.items()}
+            evictions = self.evictions
+        return {
+            "budget_bytes": self.budget,
+            "total_bytes": sum(c["bytes"] for c in components),
+            "process_rss_bytes": process_rss(),
+            "evictions": evictions,
+            "components": components,
+            "evicted": evicted,
+        }
+
+    def gauges(self):
+        """Memoria per componente, totale e budget, per /metrics."""
+        snapshot = self.snapshot()
+        rows = [("mynurseai_memory_component_bytes", {"component": c["name"], "kind": c["kind"]}, c["bytes"])
+                for c in snapshot["components"]]
+        rows.append(("mynurseai_memory_total_bytes", {}, snapshot["total_bytes"]))
+        rows.append(("mynurseai_memory_budget_bytes", {}, snapshot["budget_bytes"]))
+        rows.append(("mynurseai_memory_process_rss_bytes", {}, snapshot["process_rss_bytes"]))
+        rows.append(("mynurseai_memory_evictions", {}, snapshot["evictions"]))
+        return rows
+
+
+memory = MemoryManager()
+tracer.add_gauge_source(memory.gauges)
+
+
+def start_memory_manager():
+    """Avvia il controllo periodico se è configurato un budget o uno scaricamento per inattività."""
+    if MEMORY_BUDGET_MB or MEMORY_IDLE_EVICT_S:
+        memory.start()
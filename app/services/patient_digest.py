@@ -0,0 +1,187 @@
+"""
+Sintesi clinica precalcolata per paziente (tabella patient_digests).
+
+La sintesi copre tutti i documenti del paziente e viene aggiornata in modo
+incrementale: a ogni upload un thread in background vi fa confluire i
+documenti non ancora inclusi, un documento alla volta (sintesi precedente +
+testo del nuovo documento). Eliminando o sostituendo un documento la sintesi
+viene azzerata e ricostruita dai documenti rimasti.
+
+Le domande di riepilogo ("riassumi la situazione di Mario Rossi") vengono
+servite dalla sintesi invece che da un passaggio RAG completo, purché sia
+allineata ai documenti presenti (vedi get_digest).
+
+Per generare le sintesi dei documenti già caricati:
+    python -m app.services.patient_digest
+    python -m app.services.patient_digest --patients mario.rossi@mail.it --rebuild
+"""
+import argparse
+import sys
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from ollama import ChatResponse
+from sqlalchemy.orm import Session
+
+from app.config import CHAT_MODEL, DIGEST_DOC_MAX_CHARS, DIGEST_MAX_CHARS
+from app.database.postgres import SessionLocal
+from app.models.digest import PatientDigest
+from app.models.doc import Doc
+from app.services import indexing, prompts
+from app.services.llm_scheduler import scheduler
+
+OVERVIEW_KEYWORDS = [
+    "riassum", "riepilog", "sintesi", "situazione", "quadro clinico", "panoramica", "storia clinica",
+]
+
+
+def is_overview_question(query: str, clinical_events=None) -> bool:
+    """Domanda di riepilogo generale: parola chiave di sintesi e nessun evento clinico specifico."""
+    q = query.lower()
+    return not clinical_events and any(k in q for k in OVERVIEW_KEYWORDS)
+
+
+def _parse_ids(value: str) -> List[int]:
+    return [int(x) for x in value.split(",") if x]
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+# --- Generazione ---
+def summarize_with_llm(previous: str, filename: str, text: str) -> str:
+    response: ChatResponse = scheduler.chat(
+        CHAT_MODEL,
+        prompts.render("patient_digest", max_chars=DIGEST_MAX_CHARS, previous=previous or "(vuota)",
+                       filename=filename, text=_clip(text, DIGEST_DOC_MAX_CHARS)),
+        priority="background"
+    )
+    return response.message.content.strip()
+
+
+def summarize_extractive(previous: str, filename: str, text: str) -> str:
+    """Ripiego senza LLM: accoda l'inizio del documento alla sintesi esistente."""
+    excerpt = f"- {filename}: {_clip(' '.join(text.split()), 300)}"
+    return f"{previous}\n{excerpt}" if previous else excerpt
+
+
+def catch_up(db: Session, email: str, summarizer=summarize_with_llm) -> int:
+    """
+    Fa confluire nella sintesi i documenti del paziente non ancora inclusi.
+    Ogni documento viene salvato con un aggiornamento condizionato sulla lista
+    di id letta: se nel frattempo la sintesi è stata azzerata ci si ferma.
+    Restituisce il numero di documenti aggiunti.
+    """
+    digest = db.query(PatientDigest).filter(PatientDigest.paziente_email == email).first()
+    if digest is None:
+        digest = PatientDigest(paziente_email=email, digest="", doc_ids="")
+        db.add(digest)
+        db.commit()
+    text, doc_ids = digest.digest, digest.doc_ids
+    covered = set(_parse_ids(doc_ids))
+
+    added = 0
+    for doc in db.query(Doc).filter(Doc.paziente_email == email).order_by(Doc.id):
+        if doc.id in covered:
+            continue
+        doc_text = indexing.extract_text(doc.file_data)
+        try:
+            new_text = summarizer(text, doc.filename, doc_text)
+        except Exception as e:
+            print("⚠️ Sintesi del documento con LLM fallita, uso la sintesi estrattiva:", e)
+            new_text = summarize_extractive(text, doc.filename, doc_text)
+        new_ids = ",".join(str(i) for i in sorted(covered | {doc.id}))
+        updated = db.query(PatientDigest).filter(
+            PatientDigest.paziente_email == email, PatientDigest.doc_ids == doc_ids
+        ).update({
+            PatientDigest.digest: _clip(new_text, DIGEST_MAX_CHARS),
+            PatientDigest.doc_ids: new_ids,
+            PatientDigest.updated_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        db.commit()
+        if not updated:
+            break
+        text, doc_ids = _clip(new_text, DIGEST_MAX_CHARS), new_ids
+        covered.add(doc.id)
+        added += 1
+    return added
+
+
+def reset_digest(db: Session, email: str):
+    """Azzera la sintesi (documento eliminato o sostituito): verrà ricostruita da catch_up."""
+    db.query(PatientDigest).filter(PatientDigest.paziente_email == email).update({
+        PatientDigest.digest: "",
+        PatientDigest.doc_ids: "",
+        PatientDigest.updated_at: datetime.utcnow(),
+    }, synchronize_session=False)
+    db.commit()
+
+
+# --- Lettura ---
+def get_digest(db: Session, email: str) -> Optional[str]:
+    """Sintesi del paziente, o None se manca o non copre esattamente i documenti presenti."""
+    digest = db.query(PatientDigest).filter(PatientDigest.paziente_email == email).first()
+    if digest is None or not digest.digest:
+        return None
+    current = {doc_id for (doc_id,) in db.query(Doc.id).filter(Doc.paziente_email == email)}
+    return digest.digest if set(_parse_ids(digest.doc_ids)) == current else None
+
+
+# --- Aggiornamento in background ---
+_patient_locks = {}
+_patient_locks_guard = threading.Lock()
+
+
+def _patient_lock(email: str) -> threading.Lock:
+    with _patient_locks_guard:
+        return _patient_locks.setdefault(email, threading.Lock())
+
+
+def schedule_digest_update(email: str):
+    """
+    Aggiorna la sintesi in un thread separato. Gli aggiornamenti dello stesso
+    paziente sono serializzati: chi arriva dopo trova già inclusi i documenti
+    elaborati dal precedente e aggiunge solo i propri.
+    """
+    def job():
+        with _patient_lock(email):
+            db = SessionLocal()
+            try:
+                catch_up(db, email)
+            except Exception as e:
+                print(f"⚠️ Aggiornamento della sintesi di {email} fallito:", e)
+            finally:
+                db.close()
+
+    threading.Thread(target=job, name="patient-digest", daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera le sintesi cliniche dei pazienti")
+    parser.add_argument("--patients", default="", help="email dei pazienti separate da virgola (default: tutti)")
+    parser.add_argument("--rebuild", action="store_true", help="ricostruisce le sintesi da zero")
+    args = parser.parse_args(argv)
+
+    emails = [e.strip() for e in args.patients.split(",") if e.strip()]
+    db = SessionLocal()
+    failed = 0
+    try:
+        todo = emails or [e for (e,) in db.query(Doc.paziente_email).distinct().order_by(Doc.paziente_email)]
+        for email in todo:
+            try:
+                if args.rebuild:
+                    reset_digest(db, email)
+                print(f"   ✅ {email}: {catch_up(db, email)} documenti aggiunti alla sintesi")
+            except Exception as e:
+                db.rollback()
+                failed += 1
+                print(f"   ❌ {email}: {e}")
+    finally:
+        db.close()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+Importazione massiva dei pazienti di un medico da CSV.
+
+La registrazione da pagina crea un paziente alla volta, con le proprie query
+di esistenza e il proprio commit. Qui l'intero elenco viene:
+- letto e validato in memoria, riga per riga, con le stesse regole della
+  registrazione (campi obbligatori, numero civico, CAP, data di nascita,
+  sesso) più il controllo dei duplicati all'interno del file;
+- confrontato con gli utenti esistenti con un'unica query su email e username
+  (senza distinzione tra maiuscole e minuscole, come i duplicati nel file);
+- inserito con un solo INSERT multi-riga in una transazione.
+
+Ogni riga scartata è riportata con numero di riga, campo e motivo. Con
+`atomic` basta una riga non valida per non importare nulla.
+
+Colonne del CSV (intestazione obbligatoria, separatore "," o ";", codifica
+UTF-8 o Windows-1252 come i CSV salvati da Excel):
+    username, email, password, nome, cognome, via, numero_civico, citta, cap,
+    data_nascita (AAAA-MM-GG o GG/MM/AAAA), sesso (Maschio, Femmina, Altro)
+
+Uso da riga di comando:
+    python -m app.services.patient_import elenco.csv --medico medico@mail.it
+    python -m app.services.patient_import elenco.csv --medico medico@mail.it --atomic
+"""
+import argparse
+import csv
+import datetime
+import io
+import re
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database.postgres import SessionLocal
+from app.models.user import User
+from app.services.auth_service import hash_password
+from app.services.tracing import tracer
+
+COLUMNS = ["username", "email", "password", "nome", "cognome", "via", "numero_civico", "citta", "cap",
+           "data_nascita", "sesso"]
+SESSI = ["Maschio", "Femmina", "Altro"]
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y")
+# Excel su Windows in italiano salva i CSV in cp1252
+ENCODINGS = ("utf-8-sig", "cp1252")
+MIN_NASCITA = datetime.date(1900, 1, 1)
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+@dataclass
+class RowError:
+    row: int  # riga del file, intestazione compresa
+    field: str
+    message: str
+
+
+@dataclass
+class ImportResult:
+    total: int = 0
+    imported: int = 0
+    errors: List[RowError] = field(default_factory=list)
+    message: str = ""
+
+
+# --- Lettura ---
+def read_roster(file_bytes: bytes) -> Tuple[List[Tuple[int, Dict[str, str]]], List[RowError]]:
+    """Righe del CSV come (numero di riga, valori per colonna); errore se mancano colonne."""
+    text = None
+    for encoding in ENCODINGS:
+        try:
+            text = file_bytes.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    if text is None:
+        return [], [RowError(1, "file", "codifica non supportata, salva il CSV in UTF-8")]
+    try:
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    header = [h.strip().lower() for h in reader.fieldnames or []]
+    missing = [c for c in COLUMNS if c not in header]
+    if missing:
+        return [], [RowError(1, ", ".join(missing), "colonne mancanti nell'intestazione")]
+    reader.fieldnames = header
+    rows = []
+    for values in reader:
+        if not any((v or "").strip() for v in values.values() if isinstance(v, str)):
+            continue  # riga vuota
+        rows.append((reader.line_num, {c: (values.get(c) or "").strip() for c in COLUMNS}))
+    return rows, []
+
+
+# --- Validazione ---
+def _parse_date(value: str) -> Optional[datetime.date]:
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def validate_row(line: int, values: Dict[str, str]) -> Tuple[Optional[dict], List[RowError]]:
+    """Valori pronti per la tabella users (senza hash né medico) oppure gli errori della riga."""
+    errors = [RowError(line, c, "campo obbligatorio") for c in COLUMNS if not values[c]]
+    if errors:
+        return None, errors
+
+    if not _EMAIL_RE.match(values["email"]):
+        errors.append(RowError(line, "email", "indirizzo email non valido"))
+    numero_civico = values["numero_civico"]
+    if not numero_civico.isdigit() or int(numero_civico) <= 0:
+        errors.append(RowError(line, "numero_civico", "numero civico valido: solo cifre, maggiore di 0"))
+    cap = values["cap"].zfill(5)
+    if not re.fullmatch(r"\d{5}", cap):
+        errors.append(RowError(line, "cap", "il CAP deve contenere esattamente 5 cifre numeriche"))
+    data_nascita = _parse_date(values["data_nascita"])
+    if data_nascita is None:
+        errors.append(RowError(line, "data_nascita", "data non valida (AAAA-MM-GG o GG/MM/AAAA)"))
+    elif not MIN_NASCITA <= data_nascita <= datetime.date.today():
+        errors.append(RowError(line, "data_nascita", "data di nascita fuori intervallo"))
+    sesso = values["sesso"].capitalize()
+    if sesso not in SESSI:
+        errors.append(RowError(line, "sesso", f"valori ammessi: {', '.join(SESSI)}"))
+    if errors:
+        return None, errors
+
+    return {
+        **values,
+        "numero_civico": str(int(numero_civico)),
+        "cap": cap,
+        "data_nascita": data_nascita,
+        "sesso": sesso,
+    }, []
+
+
+def validate_roster(rows) -> Tuple[List[Tuple[int, dict]], List[RowError]]:
+    """Valida tutte le righe e scarta email e username ripetuti nel file (vale la prima occorrenza)."""
+    valid, errors = [], []
+    seen = {"email": {}, "username": {}}
+    for line, values in rows:
+        record, row_errors = validate_row(line, values)
+        if record is not None:
+            for key in ("email", "username"):
+                first = seen[key].setdefault(record[key].lower(), line)
+                if first != line:
+                    label = "email ripetuta" if key == "email" else "username ripetuto"
+                    row_errors.append(RowError(line, key, f"{label} nel file (riga {first})"))
+        if row_errors:
+            errors.extend(row_errors)
+        else:
+            valid.append((line, record))
+    return valid, errors
+
+
+def existing_identities(db: Session, emails, usernames) -> Tuple[set, set]:
+    """Email e username già registrati (in minuscolo), con un'unica query."""
+    if not emails and not usernames:
+        return set(), set()
+    email, username = func.lower(User.email), func.lower(User.username)
+    rows = db.execute(
+        select(email, username).where(or_(email.in_([e.lower() for e in emails]),
+                                          username.in_([u.lower() for u in usernames])))
+    ).all()
+    return {e for e, _ in rows}, {u for _, u in rows}
+
+
+# --- Importazione ---
+def import_patients(db: Session, medico_email: str, file_bytes: bytes, atomic: bool = False) -> ImportResult:
+    with tracer.turn("patient_import"):
+        with tracer.stage("roster_validation"):
+            rows, errors = read_roster(file_bytes)
+            result = ImportResult(total=len(rows), errors=errors)
+            if errors:
+                result.message = "File non valido."
+                return result
+            valid, result.errors = validate_roster(rows)
+
+        with tracer.stage("existence_check"):
+            emails, usernames = existing_identities(db, [r["email"] for _, r in valid],
+                                                    [r["username"] for _, r in valid])
+        new = []
+        for line, record in valid:
+            if record["email"].lower() in emails:
+                result.errors.append(RowError(line, "email", "email già registrata"))
+            elif record["username"].lower() in usernames:
+                result.errors.append(RowError(line, "username", "username già registrato"))
+            else:
+                new.append(record)
+        result.errors.sort(key=lambda e: e.row)
+
+        if atomic and result.errors:
+            result.message = "Nessun paziente importato: correggi le righe segnalate."
+            return result
+        if not new:
+            result.message = "Nessun paziente da importare."
+            return result
+
+        payload = [
+            {**{k: v for k, v in record.items() if k != "password"},
+             "hashed_password": hash_password(record["password"]), "role": "Paziente",
+             "medicoAssociato": medico_email}
+            for record in new
+        ]
+        with tracer.stage("bulk_insert"):
+            try:
+                db.execute(insert(User), payload)
+                db.commit()
+            except IntegrityError:
+                # un utente con la stessa email o username è stato registrato nel frattempo
+                db.rollback()
+                result.message = "Importazione annullata: alcuni utenti sono stati registrati nel frattempo, riprova."
+                return result
+        result.imported = len(payload)
+        result.message = f"{result.imported} pazienti importati su {result.total}."
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importazione dei pazienti di un medico da CSV")
+    parser.add_argument("csv", help="file CSV dei pazienti")
+    parser.add_argument("--medico", required=True, help="email del medico a cui associare i pazienti")
+    parser.add_argument("--atomic", action="store_true", help="non importa nulla se una riga non è valida")
+    args = parser.parse_args(argv)
+
+    with open(args.csv, "rb") as f:
+        file_bytes = f.read()
+    db = SessionLocal()
+    try:
+        medico = db.query(User).filter(User.email == args.medico, User.role == "Medico").first()
+        if medico is None:
+            print(f"❌ Il medico {args.medico} non esiste.")
+            return 2
+        result = import_patients(db, medico.email, file_bytes, args.atomic)
+    finally:
+        db.close()
+    for e in result.errors:
+        print(f"   ❌ riga {e.row}, {e.field}: {e.message}")
+    print(("✅ " if result.imported else "⚠️ ") + result.message)
+    return 1 if result.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
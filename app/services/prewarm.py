@@ -0,0 +1,178 @@
+"""
+Prewarm dei modelli e keep-alive di Ollama.
+
+Subito dopo l'avvio un thread in background carica il modello di embedding,
+l'analyzer Presidio (con spaCy) e i modelli Ollama usati dall'app, così la
+prima domanda non paga il cold start e il login resta veloce. In seguito lo
+stesso thread invia periodicamente un ping ai modelli Ollama (richiesta vuota
+con `keep_alive`) secondo la politica KEEPALIVE_POLICY:
+
+- "off":      nessun ping;
+- "always":   ping ogni KEEPALIVE_INTERVAL_S secondi;
+- "hours":    ping solo nella fascia oraria KEEPALIVE_HOURS (es. "7-20"); al
+              rientro nella fascia i modelli vengono ricaricati, così la prima
+              domanda del mattino li trova già in memoria;
+- "activity": ping solo se ci sono state richieste negli ultimi KEEPALIVE_IDLE_S secondi.
+"""
+import datetime
+import threading
+import time
+
+from app.config import (
+    CHAT_MODEL,
+    DOC_CLASSIFIER_MODEL,
+    GUARD_MODEL,
+    KEEPALIVE_HOURS,
+    KEEPALIVE_IDLE_S,
+    KEEPALIVE_INTERVAL_S,
+    KEEPALIVE_POLICY,
+    OLLAMA_KEEP_ALIVE,
+    PREWARM_COMPONENTS,
+    PREWARM_ENABLED,
+    THERAPY_MODEL,
+)
+from app.services.tracing import tracer
+
+POLICIES = ("off", "always", "hours", "activity")
+
+
+def ollama_models():
+    """Modelli usati da OllamaWrapper, check_therapy, prompt_sanitizer e doc_validation."""
+    return list(dict.fromkeys([CHAT_MODEL, THERAPY_MODEL, GUARD_MODEL, DOC_CLASSIFIER_MODEL]))
+
+
+def parse_hours(spec: str):
+    """'7-20' -> (7, 20): fascia [7:00, 20:00). Una fascia come '22-6' attraversa la mezzanotte."""
+    start, end = (int(x) for x in spec.split("-"))
+    return start, end
+
+
+def in_hours(now: datetime.datetime, spec: str) -> bool:
+    start, end = parse_hours(spec)
+    if start <= end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+# --- Caricamento dei componenti ---
+def warm_embeddings():
+    from app.services.embeddings import get_embeddings
+
+    # senza cache: il vettore di prova deve passare davvero dal modello
+    get_embeddings(cached=False).embed_query("prewarm")
+
+
+def warm_analyzer():
+    from app.security_components.PII_obfuscation import get_analyzer, get_anonymizer
+
+    get_analyzer().analyze(text="Prewarm dell'analyzer", language="en")
+    get_anonymizer()
+
+
+def ping_ollama(model: str):
+    """
+    Carica il modello (se non già in memoria) senza generare testo e ne rinnova
+    il keep_alive, con la priorità più bassa dello scheduler LLM.
+    """
+    from app.services.llm_scheduler import scheduler
+
+    scheduler.generate(model, "", priority="idle", keep_alive=OLLAMA_KEEP_ALIVE)
+
+
+class Prewarmer:
+    def __init__(self, policy: str = KEEPALIVE_POLICY, interval_s: int = KEEPALIVE_INTERVAL_S,
+                 hours: str = KEEPALIVE_HOURS, idle_s: int = KEEPALIVE_IDLE_S):
+        if policy not in POLICIES:
+            raise ValueError(f"KEEPALIVE_POLICY non valida: {policy} (valori ammessi: {', '.join(POLICIES)})")
+        self.policy = policy
+        self.interval_s = interval_s
+        self.hours = hours
+        self.idle_s = idle_s
+        self.last_activity = time.time()
+        self._status = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # --- Stato ---
+    def _set(self, component: str, **info):
+        with self._lock:
+            self._status.setdefault(component, {}).update(info)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self._status.items()}
+
+    def mark_activity(self):
+        self.last_activity = time.time()
+
+    def _run_step(self, component: str, fn, *args):
+        self._set(component, state="loading")
+        start = time.perf_counter()
+        try:
+            fn(*args)
+        except Exception as e:
+            self._set(component, state="error", error=str(e), at=time.time())
+            print(f"⚠️ Prewarm di {component} fallito:", e)
+            return False
+        seconds = time.perf_counter() - start
+        tracer.observe("prewarm", component, seconds)
+        self._set(component, state="ready", seconds=round(seconds, 3), error=None, at=time.time())
+        return True
+
+    # --- Politiche di keep-alive ---
+    def should_ping(self, now: datetime.datetime = None) -> bool:
+        if self.policy == "off":
+            return False
+        if self.policy == "hours":
+            return in_hours(now or datetime.datetime.now(), self.hours)
+        if self.policy == "activity":
+            return time.time() - self.last_activity <= self.idle_s
+        return True
+
+    def ping_all(self):
+        from app.services.memory_budget import memory
+
+        for model in ollama_models():
+            # un modello scaricato dal budget di memoria torna in memoria solo quando serve davvero
+            if not memory.allows_keep_alive(model):
+                self._set(f"ollama:{model}", state="evicted")
+                continue
+            self._run_step(f"ollama:{model}", ping_ollama, model)
+
+    # --- Thread ---
+    def prewarm(self, components=None):
+        components = components or [c.strip() for c in PREWARM_COMPONENTS.split(",") if c.strip()]
+        # prima Ollama: i modelli si caricano nel server mentre qui si caricano embedding e spaCy
+        if "ollama" in components:
+            threading.Thread(target=self.ping_all, name="prewarm-ollama", daemon=True).start()
+        if "embeddings" in components:
+            self._run_step("embeddings", warm_embeddings)
+        if "analyzer" in components:
+            self._run_step("analyzer", warm_analyzer)
+
+    def _loop(self):
+        self.prewarm()
+        while not self._stop.wait(self.interval_s):
+            if self.should_ping():
+                self.ping_all()
+
+    def start(self):
+        """Avvia il thread di prewarm e keep-alive (una sola volta per processo)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name="prewarm", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+prewarmer = Prewarmer()
+
+
+def start_prewarm():
+    """Avvia il prewarm in background se abilitato con PREWARM_ENABLED."""
+    if PREWARM_ENABLED:
+        prewarmer.start()
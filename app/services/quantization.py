@@ -0,0 +1,177 @@
+"""
+Quantizzazione prodotto (PQ) degli embedding per il backend SQLite + HNSW.
+
+Ogni vettore viene diviso in `subvectors` blocchi e ogni blocco è sostituito
+dall'indice (1 byte) del più vicino fra 256 centroidi appresi con k-means sui
+vettori della collection: con multilingual-e5-large (1024 float32, 4 KB) e 64
+blocchi un chunk occupa 64 byte in memoria. Le distanze dalla domanda si
+calcolano sommando le distanze domanda-centroide precalcolate per blocco
+(asymmetric distance computation) e vector_store riordina poi i migliori
+candidati con i vettori completi letti da SQLite.
+
+PQIndex espone la parte dell'interfaccia di hnswlib.Index usata da
+SQLiteHNSWStore, così il resto dello store (salvataggio ammortizzato,
+eliminazioni, sincronizzazione tra handle) resta lo stesso per entrambi.
+"""
+from typing import Callable, List, Optional
+
+import numpy as np
+
+PQ_CENTROIDS = 256
+PQ_TRAIN_MIN = 1024        # vettori raccolti prima del primo addestramento
+PQ_TRAIN_SAMPLE = 10000    # vettori usati al massimo per l'addestramento
+PQ_KMEANS_ITERATIONS = 15
+
+
+def pq_subvectors(dim: int, requested: int) -> int:
+    """Numero di blocchi effettivo: il più grande divisore di `dim` non superiore a `requested`."""
+    return max(d for d in range(1, min(dim, max(requested, 1)) + 1) if dim % d == 0)
+
+
+def _squared_distances(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    return (np.einsum("ij,ij->i", data, data)[:, None] - 2 * data @ centroids.T
+            + np.einsum("ij,ij->i", centroids, centroids)[None, :])
+
+
+def kmeans(data: np.ndarray, k: int, iterations: int = PQ_KMEANS_ITERATIONS, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _squared_distances(data, centroids).argmin(axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # i centroidi rimasti senza punti ripartono da punti a caso
+        centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+    return centroids
+
+
+class ProductQuantizer:
+    def __init__(self, dim: int, subvectors: int):
+        self.dim = dim
+        self.m = pq_subvectors(dim, subvectors)
+        self.dsub = dim // self.m
+        self.codebooks = None  # (m, centroidi, dsub)
+        self.trained_on = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def train(self, vectors: np.ndarray, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.trained_on = len(vectors)
+        if len(vectors) > PQ_TRAIN_SAMPLE:
+            vectors = vectors[rng.choice(len(vectors), size=PQ_TRAIN_SAMPLE, replace=False)]
+        k = min(PQ_CENTROIDS, len(vectors))
+        blocks = vectors.reshape(len(vectors), self.m, self.dsub)
+        self.codebooks = np.stack([kmeans(blocks[:, j], k, seed=seed + j) for j in range(self.m)]).astype(np.float32)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        blocks = vectors.reshape(len(vectors), self.m, self.dsub)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _squared_distances(blocks[:, j], self.codebooks[j]).argmin(axis=1)
+        return codes
+
+    def distances(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Distanze L2 al quadrato approssimate tra la domanda e i vettori codificati."""
+        diff = self.codebooks - query.reshape(self.m, 1, self.dsub)
+        tables = np.einsum("mkd,mkd->mk", diff, diff)
+        return tables[np.arange(self.m), codes].sum(axis=1)
+
+
+class PQIndex:
+    """Ricerca a scansione sui codici PQ; i vettori arrivati prima dell'addestramento restano completi."""
+
+    def __init__(self, dim: int, subvectors: int):
+        self.quantizer = ProductQuantizer(dim, subvectors)
+        self._labels = np.empty(0, dtype=np.int64)
+        self._codes = np.empty((0, self.quantizer.m), dtype=np.uint8)
+        self._deleted = set()
+        self._raw_labels: List[int] = []
+        self._raw: List[np.ndarray] = []
+
+    def _train(self):
+        vectors = np.vstack(self._raw)
+        self.quantizer.train(vectors)
+        self._labels = np.concatenate([self._labels, np.asarray(self._raw_labels, dtype=np.int64)])
+        self._codes = np.concatenate([self._codes, self.quantizer.encode(vectors)])
+        self._raw_labels, self._raw = [], []
+
+    def add_items(self, vectors: np.ndarray, labels: List[int]):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not self.quantizer.trained:
+            self._raw_labels.extend(int(l) for l in labels)
+            self._raw.append(vectors)
+            if len(self._raw_labels) >= PQ_TRAIN_MIN:
+                self._train()
+            return
+        self._labels = np.concatenate([self._labels, np.asarray(labels, dtype=np.int64)])
+        self._codes = np.concatenate([self._codes, self.quantizer.encode(vectors)])
+
+    def _live(self, labels: np.ndarray) -> np.ndarray:
+        if not self._deleted:
+            return np.ones(len(labels), dtype=bool)
+        return ~np.isin(labels, np.fromiter(self._deleted, dtype=np.int64))
+
+    def mark_deleted(self, label: int):
+        label = int(label)
+        if label in self._deleted or (label not in self._raw_labels and not (self._labels == label).any()):
+            raise RuntimeError(f"Etichetta {label} non presente")
+        self._deleted.add(label)
+
+    def get_ids_list(self) -> List[int]:
+        return [l for l in self._labels.tolist() + self._raw_labels if l not in self._deleted]
+
+    def get_current_count(self) -> int:
+        return len(self._labels) + len(self._raw_labels)
+
+    def set_ef(self, ef: int):
+        pass  # la scansione è esaustiva sui codici
+
+    def knn_query(self, queries: np.ndarray, k: int = 1, filter: Optional[Callable[[int], bool]] = None):
+        query = np.asarray(queries, dtype=np.float32).reshape(-1)
+        labels = self._labels
+        distances = self.quantizer.distances(query, self._codes) if len(labels) else np.empty(0, dtype=np.float32)
+        if self._raw:
+            raw = np.vstack(self._raw)
+            labels = np.concatenate([labels, np.asarray(self._raw_labels, dtype=np.int64)])
+            distances = np.concatenate([distances, ((raw - query) ** 2).sum(axis=1)])
+        keep = self._live(labels)
+        if filter is not None:
+            keep &= np.fromiter((filter(l) for l in labels.tolist()), dtype=bool, count=len(labels))
+        labels, distances = labels[keep], distances[keep]
+        if len(labels) < k:
+            raise RuntimeError("Vicini insufficienti per il filtro richiesto")
+        best = np.argpartition(distances, k - 1)[:k] if k < len(labels) else np.arange(len(labels))
+        best = best[np.argsort(distances[best], kind="stable")]
+        return labels[best].reshape(1, -1), distances[best].reshape(1, -1)
+
+    def save_index(self, path: str):
+        if self._raw:
+            self._train()
+        live = self._live(self._labels)
+        self._labels, self._codes = self._labels[live], self._codes[live]
+        self._deleted = set()
+        codebooks = self.quantizer.codebooks
+        if codebooks is None:  # indice vuoto
+            codebooks = np.empty((self.quantizer.m, 0, self.quantizer.dsub), dtype=np.float32)
+        with open(path, "wb") as f:
+            np.savez(f, codebooks=codebooks, labels=self._labels, codes=self._codes,
+                     trained_on=self.quantizer.trained_on)
+
+    def load_index(self, path: str):
+        with np.load(path) as data:
+            codebooks = data["codebooks"]
+            self.quantizer.trained_on = int(data["trained_on"])
+            self._labels, self._codes = data["labels"], data["codes"]
+        self.quantizer.m, centroids, self.quantizer.dsub = codebooks.shape
+        self.quantizer.codebooks = codebooks if centroids else None
+
+    @property
+    def nbytes(self) -> int:
+        codebooks = self.quantizer.codebooks.nbytes if self.quantizer.trained else 0
+        return self._labels.nbytes + self._codes.nbytes + codebooks + sum(v.nbytes for v in self._raw)
@@ -0,0 +1,92 @@
+"""
+Accesso delle pagine Streamlit alle pipeline di chat e di upload.
+
+Se RAG_SERVICE_URL è impostata le richieste vanno al servizio RAG locale
+(app.services.rag_server), che tiene in memoria un solo modello di embedding
+e un solo analyzer per tutti i worker; altrimenti la pipeline è eseguita nel
+processo corrente, come prima. Gli stadi cronometrati dal servizio vengono
+riportati nel turno di tracing della pagina, così il pannello di debug resta
+invariato.
+
+Se il servizio non è raggiungibile e RAG_SERVICE_FALLBACK è attivo si ripiega
+sull'esecuzione locale; un servizio occupato (503) o in errore non attiva il
+ripiego, per non duplicare il lavoro già in corso.
+"""
+import base64
+import json
+import urllib.error
+import urllib.request
+
+from app.config import RAG_SERVICE_FALLBACK, RAG_SERVICE_TIMEOUT_S, RAG_SERVICE_TOKEN, RAG_SERVICE_URL
+from app.services import chat_service, documents
+from app.services.tracing import tracer
+
+
+class RAGServiceError(Exception):
+    pass
+
+
+def _post(path: str, payload: dict) -> dict:
+    """Chiamata al servizio; ConnectionError se non è raggiungibile, RAGServiceError se risponde con un errore."""
+    request = urllib.request.Request(
+        RAG_SERVICE_URL.rstrip("/") + path,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json", "X-RAG-Token": RAG_SERVICE_TOKEN},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=RAG_SERVICE_TIMEOUT_S) as response:
+            body = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", e.reason)
+        except ValueError:
+            message = e.reason
+        raise RAGServiceError(f"Servizio RAG: {message} ({e.code})") from e
+    except TimeoutError as e:
+        raise RAGServiceError("Servizio RAG: tempo scaduto") from e
+    except (urllib.error.URLError, OSError) as e:
+        if isinstance(getattr(e, "reason", None), TimeoutError):
+            raise RAGServiceError("Servizio RAG: tempo scaduto") from e
+        raise ConnectionError(f"Servizio RAG non raggiungibile: {e}") from e
+
+    for stage in body.pop("stages", []):
+        tracer.record(stage["stage"], stage["seconds"])
+    return body
+
+
+def _use_service() -> bool:
+    return bool(RAG_SERVICE_URL)
+
+
+# --- Chat ---
+def run_chat_turn(db, user, pazienti, user_input: str, chatbot, conversation: str = "") -> chat_service.ChatTurnResult:
+    if _use_service():
+        try:
+            body = _post("/chat", {"user_email": user.email, "message": user_input, "conversation": conversation})
+        except ConnectionError as e:
+            if not RAG_SERVICE_FALLBACK:
+                raise
+            print("⚠️", e, "- eseguo il turno nel processo corrente")
+        else:
+            by_email = {p.email: p for p in pazienti}
+            body["pazienti"] = [by_email[e] for e in body["pazienti"] if e in by_email]
+            return chat_service.ChatTurnResult(**body)
+    return chat_service.run_chat_turn(user, pazienti, user_input, chatbot, conversation=conversation, db=db)
+
+
+# --- Upload ---
+def ingest_document(db, email: str, filename: str, file_bytes: bytes) -> documents.IngestResult:
+    if _use_service():
+        try:
+            body = _post("/ingest", {
+                "paziente_email": email,
+                "filename": filename,
+                "file_b64": base64.b64encode(file_bytes).decode("ascii"),
+            })
+        except ConnectionError as e:
+            if not RAG_SERVICE_FALLBACK:
+                raise
+            print("⚠️", e, "- eseguo l'upload nel processo corrente")
+        else:
+            return documents.IngestResult(**body)
+    return documents.ingest_document(db, email, filename, file_bytes)
@@ -0,0 +1,208 @@
+"""
+Servizio RAG locale condiviso dai processi Streamlit.
+
+Con più worker Streamlit ogni processo caricherebbe la propria copia del
+modello di embedding e dell'analyzer PII. Il servizio li carica una volta
+sola e serve via HTTP (solo su localhost) le due pipeline pesanti:
+
+- POST /chat   {user_email, message, conversation} -> turno di chat completo
+               (run_chat_turn), con gli stadi cronometrati dal servizio;
+- POST /ingest {paziente_email, filename, file_b64} -> validazione,
+               salvataggio e indicizzazione di un PDF (ingest_document);
+- GET  /health -> stato e richieste in corso.
+
+Le richieste sono eseguite da RAG_SERVICE_WORKERS thread; oltre
+RAG_SERVICE_MAX_QUEUE richieste in attesa il servizio risponde 503 invece di
+accumulare latenza. Le query di embedding dei turni contemporanei vengono
+codificate insieme (MicroBatchEmbeddings) e le chiamate LLM passano dallo
+scheduler del processo, che applica i limiti per modello a tutti i client.
+
+Le pagine usano il servizio se RAG_SERVICE_URL è impostata (app.services.rag_client).
+Il servizio agisce per conto dell'utente indicato nella richiesta, quindi
+accetta solo chiamate con il segreto condiviso RAG_SERVICE_TOKEN (header
+X-RAG-Token): senza segreto configurato non si avvia.
+
+Avvio:
+    python -m app.services.rag_server
+    python -m app.services.rag_server --host 127.0.0.1 --port 8765 --workers 4
+"""
+import argparse
+import base64
+import hmac
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.config import (
+    CHAT_MODEL,
+    RAG_SERVICE_HOST,
+    RAG_SERVICE_MAX_QUEUE,
+    RAG_SERVICE_PORT,
+    RAG_SERVICE_TIMEOUT_S,
+    RAG_SERVICE_TOKEN,
+    RAG_SERVICE_WORKERS,
+)
+from app.database.postgres import SessionLocal
+from app.models.user import User
+from app.services import chat_service, documents, prewarm
+from app.services.embeddings import MicroBatchEmbeddings, SharedEmbeddings
+from app.services.memory_budget import start_memory_manager
+from app.services.tracing import start_metrics_exporter, tracer
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class RAGService:
+    def __init__(self, workers: int = RAG_SERVICE_WORKERS, max_queue: int = RAG_SERVICE_MAX_QUEUE):
+        self.embeddings = MicroBatchEmbeddings(SharedEmbeddings())
+        self.chatbot = chat_service.OllamaWrapper(model_name=CHAT_MODEL)
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rag-worker")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def prewarm(self):
+        """Carica modello di embedding e analyzer PII prima della prima richiesta."""
+        prewarm.warm_embeddings()
+        prewarm.warm_analyzer()
+
+    def submit(self, fn, *args):
+        """Esegue fn in un worker e ne attende il risultato; ServiceBusy se la coda è piena."""
+        with self._lock:
+            if self._pending >= self.max_queue:
+                raise ServiceBusy()
+            self._pending += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # il posto si libera quando il worker ha finito, non quando il client smette di attendere
+        future.add_done_callback(self._release)
+        return future.result(timeout=RAG_SERVICE_TIMEOUT_S)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    # --- Pipeline ---
+    def chat(self, payload: dict) -> dict:
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.email == payload["user_email"]).first()
+            if user is None:
+                raise KeyError(f"Utente sconosciuto: {payload['user_email']}")
+            if user.role == "Medico":
+                pazienti = chat_service.get_pazienti_del_medico(user.email, db)
+            else:
+                pazienti = [user]
+            with tracer.turn("chat") as trace:
+                turn = chat_service.run_chat_turn(
+                    user, pazienti, payload["message"], self.chatbot, embeddings=self.embeddings,
+                    conversation=payload.get("conversation", ""), db=db
+                )
+            return {
+                "user_message": turn.user_message,
+                "response": turn.response,
+                "sanitizer_verdict": turn.sanitizer_verdict,
+                "pazienti": [p.email for p in turn.pazienti],
+                "retrieved_texts": turn.retrieved_texts,
+                "retrieved_ids": turn.retrieved_ids,
+                "contains_therapy": turn.contains_therapy,
+                "prompt": turn.prompt,
+                "blocked": turn.blocked,
+                "stages": trace.to_dict()["stages"],
+            }
+        finally:
+            db.close()
+
+    def ingest(self, payload: dict) -> dict:
+        db = SessionLocal()
+        try:
+            with tracer.turn("upload") as trace:
+                result = documents.ingest_document(
+                    db, payload["paziente_email"], payload["filename"],
+                    base64.b64decode(payload["file_b64"]), embeddings=self.embeddings
+                )
+            return {**result.__dict__, "stages": trace.to_dict()["stages"]}
+        finally:
+            db.close()
+
+
+def make_handler(service: RAGService, token: str = RAG_SERVICE_TOKEN):
+    routes = {"/chat": service.chat, "/ingest": service.ingest}
+
+    class _RAGHandler(BaseHTTPRequestHandler):
+        def _send(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path.rstrip("/") != "/health":
+                return self._send(404, {"error": "not found"})
+            self._send(200, {"status": "ok", "pending": service.pending()})
+
+        def do_POST(self):
+            fn = routes.get(self.path.rstrip("/"))
+            if fn is None:
+                return self._send(404, {"error": "not found"})
+            if not token or not hmac.compare_digest(self.headers.get("X-RAG-Token", "").encode(), token.encode()):
+                return self._send(403, {"error": "token non valido"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                self._send(200, service.submit(fn, payload))
+            except ServiceBusy:
+                self._send(503, {"error": "servizio occupato"})
+            except (KeyError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            pass
+
+    return _RAGHandler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servizio RAG locale condiviso dai processi Streamlit")
+    parser.add_argument("--host", default=RAG_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=RAG_SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=RAG_SERVICE_WORKERS)
+    parser.add_argument("--no-prewarm", action="store_true", help="carica i modelli alla prima richiesta")
+    args = parser.parse_args(argv)
+
+    if not RAG_SERVICE_TOKEN:
+        print("❌ RAG_SERVICE_TOKEN non impostato: il servizio non si avvia senza segreto condiviso.")
+        return 2
+    service = RAGService(workers=args.workers)
+    if not args.no_prewarm:
+        service.prewarm()
+    start_metrics_exporter()
+    start_memory_manager()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"🚀 Servizio RAG in ascolto su http://{args.host}:{args.port} ({args.workers} worker)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
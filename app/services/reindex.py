@@ -0,0 +1,445 @@
+"""
+Re-index in background delle collection dei pazienti.
+
+Ricostruisce la collection di ogni paziente dai PDF salvati nella tabella
+`docs` in una nuova versione (chroma_db/<email>/vN) con il modello di
+embedding e il chunking configurati, poi sposta il puntatore CURRENT. Fino
+allo switch le query continuano a usare la versione precedente.
+
+- I pazienti vengono elaborati in parallelo da un pool di worker.
+- Un checkpoint (chroma_db/.reindex_checkpoint.json) registra i pazienti
+  completati: rilanciando il comando con la stessa configurazione si riprende
+  da dove ci si era fermati.
+- I documenti caricati durante la ricostruzione vengono recuperati prima e
+  dopo lo switch, così nessun upload va perso.
+
+Con --compact riscrive invece le collection togliendo i chunk dei documenti
+eliminati, senza ricalcolare gli embedding (vedi compact_patient). Con
+--migrate la stessa copia converte le collection nel backend SQLite + HNSW
+(app.services.vector_store), comprese le collection legacy in chroma_db/<email>/;
+le versioni Chroma precedenti restano per il rollback secondo --keep.
+
+Le versioni nuove ereditano i parametri dell'indice della collection attiva;
+--index-param li cambia (es. --index-param m=32 --index-param ef_search=128).
+Con --tune i parametri vengono applicati alle collection attive senza
+riscriverle: ef_search ed exact_threshold sempre, m ed ef_construction solo
+con il backend sqlite (l'indice viene ricostruito dagli embedding salvati).
+
+Uso:
+    python -m app.services.reindex
+    python -m app.services.reindex --workers 4 --patients mario.rossi@mail.it
+    python -m app.services.reindex --status
+    python -m app.services.reindex --compact
+    python -m app.services.reindex --migrate
+    python -m app.services.reindex --compact --backend chroma
+    python -m app.services.reindex --compact --force --index-param m=32 --patients mario.rossi@mail.it
+    python -m app.services.reindex --tune --index-param ef_search=128 --index-param exact_threshold=5000
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.config import (
+    CHROMA_ROOT,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    EMBEDDING_BACKEND,
+    EMBEDDING_MODEL,
+    REINDEX_WORKERS,
+    VECTOR_BACKEND,
+)
+from app.database.postgres import SessionLocal
+from app.models.doc import Doc
+from app.services import clinical_events, indexing, vector_store
+from app.services.tracing import tracer
+
+CHECKPOINT_FILE = ".reindex_checkpoint.json"
+LOCK_FILE = ".reindex.lock"
+COPY_BATCH = 500
+
+
+def index_signature(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> str:
+    """Identifica la configurazione di indicizzazione: cambiandola, il re-index riparte da zero."""
+    return f"{EMBEDDING_MODEL}@{EMBEDDING_BACKEND}|chunk={chunk_size}/{chunk_overlap}"
+
+
+# --- Checkpoint ---
+class Checkpoint:
+    def __init__(self, path: str, signature: str, resume: bool = True):
+        self.path = path
+        self._lock = threading.Lock()
+        data = self._read() if resume else {}
+        if data.get("signature") != signature:
+            data = {"signature": signature, "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "patients": {}}
+        self.data = data
+        self._write()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def is_done(self, email: str) -> bool:
+        return self.data["patients"].get(email, {}).get("status") == "done"
+
+    def record(self, email: str, **info):
+        with self._lock:
+            self.data["patients"][email] = info
+            self._write()
+
+
+def acquire_lock(root: str) -> str:
+    """Impedisce due re-index contemporanei; un lock lasciato da un processo terminato viene ignorato."""
+    path = os.path.join(root, LOCK_FILE)
+    try:
+        with open(path, encoding="utf-8") as f:
+            pid = int(f.read().strip() or 0)
+        os.kill(pid, 0)
+        raise RuntimeError(f"Re-index già in corso (pid {pid}). Se non è così elimina {path}.")
+    except (FileNotFoundError, ValueError, ProcessLookupError):
+        pass
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(str(os.getpid()))
+    return path
+
+
+# --- Ricostruzione di un paziente ---
+def _index_missing(db, vectorstore, email: str, indexed: set, check_store: bool = False) -> int:
+    """Indicizza i documenti del paziente non ancora presenti; restituisce i chunk aggiunti."""
+    chunks = 0
+    ids = [doc_id for (doc_id,) in db.query(Doc.id).filter(Doc.paziente_email == email).order_by(Doc.id)]
+    for doc_id in ids:
+        if doc_id in indexed:
+            continue
+        if check_store and indexing.is_document_indexed(vectorstore, doc_id):
+            indexed.add(doc_id)
+            continue
+        doc = db.query(Doc).filter(Doc.id == doc_id).first()
+        if doc is None:  # eliminato nel frattempo
+            continue
+        with tracer.stage("text_extraction"):
+            text = indexing.extract_text(doc.file_data)
+        with tracer.stage("embedding_indexing"):
+            chunks += indexing.index_document(vectorstore, doc_id, text)
+        clinical_events.store_document_events(db, email, doc_id, text)
+        indexed.add(doc_id)
+        db.expunge(doc)
+    return chunks
+
+
+def _switch_version(db, email: str, version: int, indexed: set, root: str, keep: int):
+    """
+    Attiva la nuova versione e la riallinea con la tabella docs: recupera gli
+    upload finiti sulla versione precedente tra l'ultimo passaggio e lo switch
+    e rimuove i chunk dei documenti eliminati nel frattempo.
+    """
+    indexing.set_current_version(email, version, root)
+
+    vectorstore = indexing.open_vectorstore(indexing.version_dir(email, version, root))
+    late = _index_missing(db, vectorstore, email, indexed, check_store=True)
+    valid = [doc_id for (doc_id,) in db.query(Doc.id).filter(Doc.paziente_email == email)]
+    stale = indexing.stale_chunk_ids(vectorstore, valid)
+    if stale:
+        vectorstore.delete(ids=stale)
+    if late or stale:
+        vectorstore.persist()
+    return late, indexing.prune_versions(email, keep, root)
+
+
+def _next_version(email: str, root: str) -> int:
+    return max(indexing.list_versions(email, root) + [indexing.current_version(email, root) or 0]) + 1
+
+
+def _inherited_params(email: str, root: str, index_params: dict = None) -> dict:
+    """Parametri dell'indice della collection attiva, aggiornati con `index_params`."""
+    source = indexing.current_collection_dir(email, root)
+    return {**(indexing.saved_index_params(source) if source else {}), **(index_params or {})}
+
+
+def reindex_patient(email: str, signature: str, root: str = None, keep: int = 1, backend: str = None,
+                    index_params: dict = None) -> dict:
+    root = root or CHROMA_ROOT
+    index_params = _inherited_params(email, root, index_params)
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        with tracer.turn("reindex"):
+            version = _next_version(email, root)
+            path = indexing.version_dir(email, version, root)
+            os.makedirs(path, exist_ok=True)
+
+            indexed, chunks = set(), 0
+            vectorstore = indexing.open_vectorstore(path, backend=backend, index_params=index_params)
+            # ripete finché non compaiono più documenti caricati durante la ricostruzione
+            while True:
+                added_before = len(indexed)
+                chunks += _index_missing(db, vectorstore, email, indexed)
+                if len(indexed) == added_before:
+                    break
+            with tracer.stage("vectorstore_persist"):
+                vectorstore.persist()
+            indexing.write_manifest(path, signature=signature, backend=indexing.detect_backend(path),
+                                    index_params=vectorstore.index_params(), docs=len(indexed), chunks=chunks)
+            del vectorstore
+
+            late, removed = _switch_version(db, email, version, indexed, root, keep)
+            chunks += late
+    finally:
+        db.close()
+    return {
+        "status": "done",
+        "version": version,
+        "docs": len(indexed),
+        "chunks": chunks,
+        "seconds": round(time.perf_counter() - start, 2),
+        "removed": removed,
+    }
+
+
+def compact_patient(email: str, root: str = None, keep: int = 1, force: bool = False, backend: str = None,
+                    index_params: dict = None) -> dict:
+    """
+    Riscrive la collection attiva del paziente in una nuova versione, con il
+    backend `backend` (default VECTOR_BACKEND), che contiene solo i chunk di
+    documenti ancora presenti, riusando gli embedding già calcolati. Le
+    collection con chunk privi di doc_id (indicizzati prima del tracciamento)
+    non sono attribuibili e vengono ricostruite da zero.
+    """
+    root = root or CHROMA_ROOT
+    backend = backend or VECTOR_BACKEND
+    source = indexing.current_collection_dir(email, root)
+    if source is None:
+        return {"status": "skipped", "reason": "nessuna collection"}
+    source_backend = indexing.detect_backend(source)
+    inherited = _inherited_params(email, root, index_params)
+
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        with tracer.turn("compaction"):
+            valid = {doc_id for (doc_id,) in db.query(Doc.id).filter(Doc.paziente_email == email)}
+            data = indexing.read_collection(source)
+            metadatas = data["metadatas"] = data["metadatas"] or [None] * len(data["ids"])
+
+            if any(not m or "doc_id" not in m for m in metadatas):
+                info = reindex_patient(email, index_signature(), root, keep, backend, index_params)
+                return {**info, "mode": "rebuild"}
+
+            keep_idx = [i for i, m in enumerate(metadatas) if m["doc_id"] in valid]
+            stale = len(data["ids"]) - len(keep_idx)
+            if not stale and not force and not index_params and source_backend in (backend, None):
+                return {"status": "skipped", "reason": "nessun chunk obsoleto", "chunks": len(keep_idx)}
+
+            version = _next_version(email, root)
+            path = indexing.version_dir(email, version, root)
+            os.makedirs(path, exist_ok=True)
+            with tracer.stage("vectorstore_persist"):
+                indexing.write_collection(path, data, keep_idx, backend, COPY_BATCH, inherited)
+            del data
+
+            # documenti mai indicizzati (es. upload con errore su ChromaDB)
+            indexed = {metadatas[j]["doc_id"] for j in keep_idx}
+            vectorstore = indexing.open_vectorstore(path, backend=backend)
+            chunks = len(keep_idx) + _index_missing(db, vectorstore, email, indexed)
+            vectorstore.persist()
+            params = vectorstore.index_params()
+            del vectorstore
+            indexing.write_manifest(path, signature=indexing.read_manifest(source).get("signature"),
+                                    backend=backend, index_params=params, compacted_from=source,
+                                    docs=len(indexed), chunks=chunks, removed_chunks=stale)
+
+            late, removed = _switch_version(db, email, version, indexed, root, keep)
+    finally:
+        db.close()
+    return {
+        "status": "done",
+        "mode": "compaction" if source_backend == backend else f"migration {source_backend} -> {backend}",
+        "version": version,
+        "docs": len(indexed),
+        "chunks": chunks + late,
+        "removed_chunks": stale,
+        "seconds": round(time.perf_counter() - start, 2),
+        "removed": removed,
+    }
+
+
+def list_patients(emails=None):
+    db = SessionLocal()
+    try:
+        found = [e for (e,) in db.query(Doc.paziente_email).distinct().order_by(Doc.paziente_email)]
+    finally:
+        db.close()
+    return [e for e in found if e in emails] if emails else found
+
+
+def list_collections(root: str = None, emails=None):
+    """Pazienti con una collection su disco, anche se non hanno più documenti."""
+    root = root or CHROMA_ROOT
+    found = set(list_patients())
+    if os.path.isdir(root):
+        found.update(e for e in os.listdir(root) if not e.startswith(".") and os.path.isdir(os.path.join(root, e)))
+    return sorted(e for e in found if not emails or e in emails)
+
+
+def run_reindex(emails=None, workers: int = REINDEX_WORKERS, resume: bool = True, keep: int = 1,
+                root: str = None, log=print, index_params: dict = None) -> dict:
+    root = root or CHROMA_ROOT
+    os.makedirs(root, exist_ok=True)
+    lock = acquire_lock(root)
+    try:
+        signature = index_signature()
+        if index_params:
+            signature += "|index=" + ",".join(f"{k}={v}" for k, v in sorted(index_params.items()))
+        checkpoint = Checkpoint(os.path.join(root, CHECKPOINT_FILE), signature, resume)
+        todo = [e for e in list_patients(emails) if not checkpoint.is_done(e)]
+        log(f"▶️  Re-index ({signature}): {len(todo)} pazienti da elaborare con {workers} worker")
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="reindex") as pool:
+            futures = {pool.submit(reindex_patient, email, signature, root, keep, None, index_params): email
+                       for email in todo}
+            for future in as_completed(futures):
+                email = futures[future]
+                try:
+                    info = future.result()
+                    log(f"   ✅ {email}: v{info['version']}, {info['docs']} documenti, "
+                        f"{info['chunks']} chunk in {info['seconds']} s")
+                except Exception as e:
+                    info = {"status": "failed", "error": str(e)}
+                    log(f"   ❌ {email}: {e}")
+                checkpoint.record(email, **info)
+        return checkpoint.data
+    finally:
+        os.remove(lock)
+
+
+def tune_patient(email: str, index_params: dict, root: str = None) -> dict:
+    """Applica i parametri dell'indice alla collection attiva senza crearne una nuova versione."""
+    root = root or CHROMA_ROOT
+    path = indexing.current_collection_dir(email, root)
+    if path is None or indexing.detect_backend(path) is None:
+        return {"status": "skipped", "reason": "nessuna collection"}
+    vectorstore = indexing.open_vectorstore(path)
+    params = vectorstore.set_index_params(**index_params)
+    vectorstore.persist()
+    return {"status": "done", "backend": indexing.detect_backend(path), "index_params": params}
+
+
+def run_tuning(index_params: dict, emails=None, root: str = None, log=print) -> dict:
+    root = root or CHROMA_ROOT
+    lock = acquire_lock(root)
+    results = {}
+    try:
+        todo = list_collections(root, emails)
+        log(f"▶️  Parametri dell'indice {index_params}: {len(todo)} collection")
+        for email in todo:
+            try:
+                info = tune_patient(email, index_params, root)
+                if info["status"] == "done":
+                    log(f"   ✅ {email} ({info['backend']}): {info['index_params']}")
+                else:
+                    log(f"   ⏭️  {email}: {info['reason']}")
+            except Exception as e:
+                info = {"status": "failed", "error": str(e)}
+                log(f"   ❌ {email}: {e}")
+            results[email] = info
+        return results
+    finally:
+        os.remove(lock)
+
+
+def run_compaction(emails=None, workers: int = REINDEX_WORKERS, keep: int = 1, force: bool = False,
+                   root: str = None, log=print, backend: str = None, index_params: dict = None) -> dict:
+    root = root or CHROMA_ROOT
+    os.makedirs(root, exist_ok=True)
+    lock = acquire_lock(root)
+    results = {}
+    try:
+        todo = list_collections(root, emails)
+        log(f"▶️  Compattazione ({backend or VECTOR_BACKEND}): {len(todo)} collection da verificare "
+            f"con {workers} worker")
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="compaction") as pool:
+            futures = {pool.submit(compact_patient, email, root, keep, force, backend, index_params): email
+                       for email in todo}
+            for future in as_completed(futures):
+                email = futures[future]
+                try:
+                    info = future.result()
+                    if info["status"] == "done":
+                        log(f"   ✅ {email}: v{info['version']} ({info['mode']}), {info['chunks']} chunk, "
+                            f"{info.get('removed_chunks', 0)} obsoleti rimossi")
+                    else:
+                        log(f"   ⏭️  {email}: {info['reason']}")
+                except Exception as e:
+                    info = {"status": "failed", "error": str(e)}
+                    log(f"   ❌ {email}: {e}")
+                results[email] = info
+        return results
+    finally:
+        os.remove(lock)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-index delle collection ChromaDB dei pazienti")
+    parser.add_argument("--patients", default="", help="email dei pazienti separate da virgola (default: tutti)")
+    parser.add_argument("--workers", type=int, default=REINDEX_WORKERS)
+    parser.add_argument("--keep", type=int, default=1, help="versioni precedenti da conservare per il rollback")
+    parser.add_argument("--restart", action="store_true", help="ignora il checkpoint e rielabora tutti i pazienti")
+    parser.add_argument("--status", action="store_true", help="mostra il checkpoint corrente ed esce")
+    parser.add_argument("--compact", action="store_true",
+                        help="invece del re-index, riscrive le collection senza i chunk di documenti eliminati")
+    parser.add_argument("--force", action="store_true", help="con --compact, riscrive anche collection già pulite")
+    parser.add_argument("--backend", choices=indexing.VECTOR_BACKENDS, default=None,
+                        help="backend delle collection riscritte (default: VECTOR_BACKEND)")
+    parser.add_argument("--migrate", action="store_true",
+                        help="come --compact --backend sqlite: converte le collection in SQLite + HNSW")
+    parser.add_argument("--index-param", action="append", default=[], metavar="NOME=VALORE",
+                        help="parametro dell'indice delle collection riscritte, ripetibile "
+                             "(m, ef_construction, ef_search, exact_threshold)")
+    parser.add_argument("--tune", action="store_true",
+                        help="applica --index-param alle collection attive senza riscriverle")
+    args = parser.parse_args(argv)
+
+    try:
+        index_params = vector_store.validate_index_params(dict(p.split("=", 1) for p in args.index_param))
+    except ValueError as e:
+        parser.error(f"--index-param: {e}")
+
+    if args.status:
+        path = os.path.join(CHROMA_ROOT, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            print("Nessun re-index registrato.")
+            return 0
+        with open(path, encoding="utf-8") as f:
+            print(f.read())
+        return 0
+
+    emails = [e.strip() for e in args.patients.split(",") if e.strip()] or None
+    if args.tune:
+        if not index_params:
+            parser.error("--tune richiede almeno un --index-param")
+        results = run_tuning(index_params, emails)
+        return 1 if any(info["status"] == "failed" for info in results.values()) else 0
+    if args.compact or args.migrate:
+        backend = "sqlite" if args.migrate else args.backend
+        results = run_compaction(emails, args.workers, args.keep, args.force, backend=backend,
+                                 index_params=index_params)
+        return 1 if any(info["status"] == "failed" for info in results.values()) else 0
+    data = run_reindex(emails, args.workers, resume=not args.restart, keep=args.keep, index_params=index_params)
+    failed = [e for e, info in data["patients"].items() if info.get("status") != "done"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
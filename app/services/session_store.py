@@ -0,0 +1,165 @@
+"""
+Sessioni lato server con token opachi firmati.
+
+Al login si crea una sessione che contiene una copia compatta dell'utente
+(SessionUser, senza hash della password); il token "<id>.<firma HMAC>" viene
+messo nell'URL (?session=...) così che un refresh del browser mantenga il
+login. Ad ogni rerun l'utente si ricava dal token con una lettura in memoria,
+senza interrogare il database.
+
+- Le sessioni scadono dopo SESSION_TTL_S secondi di inattività.
+- La copia dell'utente viene riletta dal database dopo SESSION_USER_TTL_S
+  secondi, oppure subito se il profilo viene modificato (evento after_update
+  di SQLAlchemy); una modifica della password o la cancellazione dell'utente
+  chiudono tutte le sue sessioni.
+
+Lo store vive nel processo Streamlit: al riavvio del server serve un nuovo login.
+"""
+import datetime
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Optional
+
+from sqlalchemy import event, inspect
+
+from app.config import SESSION_SECRET, SESSION_TTL_S, SESSION_USER_TTL_S
+from app.models.user import User
+
+
+@dataclass(frozen=True)
+class SessionUser:
+    """Copia in sola lettura dell'utente, con gli stessi attributi usati dalle pagine."""
+    username: str
+    email: str
+    role: str
+    nome: str
+    cognome: str
+    via: str
+    numero_civico: str
+    citta: str
+    cap: str
+    data_nascita: datetime.date
+    sesso: str
+    medicoAssociato: Optional[str] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "SessionUser":
+        return cls(**{f.name: getattr(user, f.name) for f in fields(cls)})
+
+
+@dataclass
+class _Session:
+    user: Optional[SessionUser]
+    email: str
+    loaded_at: float
+    last_seen: float
+
+
+class SessionStore:
+    def __init__(self, secret: bytes, ttl_s: int = SESSION_TTL_S, user_ttl_s: int = SESSION_USER_TTL_S):
+        self._secret = secret
+        self.ttl_s = ttl_s
+        self.user_ttl_s = user_ttl_s
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # --- Token ---
+    def _sign(self, sid: str) -> str:
+        return hmac.new(self._secret, sid.encode("ascii"), hashlib.sha256).hexdigest()[:32]
+
+    def _session_id(self, token: str) -> Optional[str]:
+        sid, _, signature = (token or "").partition(".")
+        if not sid or not hmac.compare_digest(signature, self._sign(sid)):
+            return None
+        return sid
+
+    # --- Ciclo di vita ---
+    def create(self, user: User) -> str:
+        sid = secrets.token_urlsafe(24)
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._sessions[sid] = _Session(SessionUser.from_user(user), user.email, now, now)
+        return f"{sid}.{self._sign(sid)}"
+
+    def resolve(self, token: str, db=None) -> Optional[SessionUser]:
+        """
+        Utente della sessione, o None se il token non è valido o è scaduto.
+        Il database (`db`) viene usato solo se la copia dell'utente è da rileggere.
+        """
+        sid = self._session_id(token)
+        if sid is None:
+            return None
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(sid)
+            if session is None or now - session.last_seen > self.ttl_s:
+                self._sessions.pop(sid, None)
+                return None
+            session.last_seen = now
+            if session.user is not None and now - session.loaded_at <= self.user_ttl_s:
+                return session.user
+            email = session.email
+
+        if db is None:
+            return None
+        user = db.query(User).filter(User.email == email).first()
+        with self._lock:
+            if user is None:
+                self._sessions.pop(sid, None)
+                return None
+            record = SessionUser.from_user(user)
+            if sid in self._sessions:
+                self._sessions[sid].user = record
+                self._sessions[sid].loaded_at = time.time()
+        return record
+
+    def revoke(self, token: str):
+        sid = self._session_id(token)
+        if sid is not None:
+            with self._lock:
+                self._sessions.pop(sid, None)
+
+    # --- Invalidazione ---
+    def invalidate_user(self, email: str):
+        """Il profilo è cambiato: la copia in cache verrà riletta al prossimo accesso."""
+        with self._lock:
+            for session in self._sessions.values():
+                if session.email == email:
+                    session.user = None
+
+    def revoke_user(self, email: str):
+        with self._lock:
+            for sid in [sid for sid, s in self._sessions.items() if s.email == email]:
+                del self._sessions[sid]
+
+    def _purge(self, now: float):
+        for sid in [sid for sid, s in self._sessions.items() if now - s.last_seen > self.ttl_s]:
+            del self._sessions[sid]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+
+# senza SESSION_SECRET si usa una chiave casuale: le sessioni durano quanto il processo, come lo store
+session_store = SessionStore((SESSION_SECRET or secrets.token_hex(32)).encode("utf-8"))
+
+
+@event.listens_for(User, "after_update")
+def _user_updated(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.hashed_password.history.has_changes() or state.attrs.email.history.has_changes():
+        for email in set(state.attrs.email.history.deleted or []) | {target.email}:
+            session_store.revoke_user(email)
+    else:
+        session_store.invalidate_user(target.email)
+
+
+@event.listens_for(User, "after_delete")
+def _user_deleted(mapper, connection, target):
+    session_store.revoke_user(target.email)
@@ -0,0 +1,229 @@
+"""
+Strumentazione delle latenze per stadio delle pipeline di chat e di upload.
+
+Ogni stadio (mascheramento PII, sanitizzazione, retrieval, generazione, ...)
+viene cronometrato con `tracer.stage(nome)` e registrato in un istogramma
+per (pipeline, stadio). Gli istogrammi possono essere esportati su file JSON
+o esposti in formato testo Prometheus su una porta locale.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config import TRACE_EXPORT_PATH, TRACE_METRICS_PORT
+
+# Limiti superiori dei bucket (secondi): dai millisecondi delle regex
+# ai minuti della classificazione LLM di un documento lungo
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+METRIC_NAME = "mynurseai_stage_duration_seconds"
+
+
+class StageHistogram:
+    """Istogramma cumulativo delle durate di uno stadio."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Stima del quantile per interpolazione lineare sui bucket (come histogram_quantile)."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        lower = 0.0
+        for bound, n in zip(self.buckets, self.bucket_counts):
+            if n and cumulative + n >= rank:
+                return lower + (bound - lower) * (rank - cumulative) / n
+            cumulative += n
+            lower = bound
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "max": round(self.max, 6),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "buckets": dict(zip([str(b) for b in self.buckets], self.bucket_counts)),
+        }
+
+
+class TurnTrace:
+    """Tempi dei singoli stadi di un turno (una domanda in chat o un upload)."""
+
+    def __init__(self, pipeline: str):
+        self.pipeline = pipeline
+        self.stages: List[Tuple[str, float]] = []
+        self.started = time.perf_counter()
+        self.total: Optional[float] = None
+
+    def add(self, stage: str, seconds: float):
+        self.stages.append((stage, seconds))
+
+    def to_dict(self) -> dict:
+        return {
+            "pipeline": self.pipeline,
+            "stages": [{"stage": s, "seconds": round(d, 4)} for s, d in self.stages],
+            "total": round(self.total, 4) if self.total is not None else None,
+        }
+
+
+_current_turn: contextvars.ContextVar = contextvars.ContextVar("current_turn", default=None)
+
+
+class Tracer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, str], StageHistogram] = {}
+        self._gauge_sources: List[Callable[[], List[Tuple[str, dict, float]]]] = []
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    # --- Registrazione ---
+    def observe(self, pipeline: str, stage: str, seconds: float):
+        with self._lock:
+            hist = self._histograms.get((pipeline, stage))
+            if hist is None:
+                hist = self._histograms[(pipeline, stage)] = StageHistogram()
+            hist.observe(seconds)
+
+    def add_gauge_source(self, source: Callable[[], List[Tuple[str, dict, float]]]):
+        """Registra una funzione che restituisce gauge (nome, etichette, valore) da esporre su /metrics."""
+        with self._lock:
+            self._gauge_sources.append(source)
+
+    @contextmanager
+    def turn(self, pipeline: str):
+        """Apre un turno: gli stadi cronometrati al suo interno vengono raccolti nel TurnTrace."""
+        trace = TurnTrace(pipeline)
+        token = _current_turn.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_turn.reset(token)
+            trace.total = time.perf_counter() - trace.started
+            self.observe(pipeline, "total", trace.total)
+            if TRACE_EXPORT_PATH:
+                try:
+                    self.export_json(TRACE_EXPORT_PATH)
+                except OSError as e:
+                    print("⚠️ Export tracing fallito:", e)
+
+    @contextmanager
+    def stage(self, name: str, pipeline: Optional[str] = None):
+        """
+        Cronometra uno stadio. La pipeline è quella del turno corrente; fuori da
+        un turno si usa `pipeline` se indicata, altrimenti 'default'.
+        """
+        trace = _current_turn.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(trace.pipeline if trace else (pipeline or "default"), name, elapsed)
+            if trace is not None:
+                trace.add(name, elapsed)
+
+    def record(self, name: str, seconds: float, pipeline: Optional[str] = None):
+        """Registra uno stadio già cronometrato altrove (es. dal servizio RAG) come se fosse locale."""
+        trace = _current_turn.get()
+        self.observe(trace.pipeline if trace else (pipeline or "default"), name, seconds)
+        if trace is not None:
+            trace.add(name, seconds)
+
+    # --- Lettura / export ---
+    def snapshot(self) -> dict:
+        with self._lock:
+            result: Dict[str, dict] = {}
+            for (pipeline, stage), hist in sorted(self._histograms.items()):
+                result.setdefault(pipeline, {})[stage] = hist.to_dict()
+            return result
+
+    def export_json(self, path: str):
+        """Scrive lo snapshot degli istogrammi su file (scrittura atomica)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generated_at": time.time(), "histograms": self.snapshot()}, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            f"# HELP {METRIC_NAME} Durata degli stadi delle pipeline MyNurseAI.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        with self._lock:
+            for (pipeline, stage), hist in sorted(self._histograms.items()):
+                labels = f'pipeline="{pipeline}",stage="{stage}"'
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.bucket_counts):
+                    cumulative += n
+                    lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f"{METRIC_NAME}_sum{{{labels}}} {hist.total}")
+                lines.append(f"{METRIC_NAME}_count{{{labels}}} {hist.count}")
+            sources = list(self._gauge_sources)
+        for source in sources:
+            for name, labels, value in source():
+                rendered = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{{{rendered}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def start_http_exporter(self, port: int, host: str = "127.0.0.1"):
+        """Avvia (una sola volta per processo) l'endpoint /metrics in formato Prometheus."""
+        with self._lock:
+            if self._server is not None:
+                return
+            tracer_ref = self
+
+            class _MetricsHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip("/") != "/metrics":
+                        self.send_response(404)
+                        self.end_headers()
+                        return
+                    body = tracer_ref.to_prometheus().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=self._server.serve_forever, name="metrics-exporter", daemon=True).start()
+
+
+tracer = Tracer()
+
+
+def start_metrics_exporter():
+    """Avvia l'endpoint Prometheus se configurato con TRACE_METRICS_PORT."""
+    if not TRACE_METRICS_PORT:
+        return
+    try:
+        tracer.start_http_exporter(TRACE_METRICS_PORT)
+    except OSError as e:
+        # Con più processi Streamlit sulla stessa porta solo il primo espone le metriche
+        print("⚠️ Impossibile avviare l'endpoint metriche:", e)
@@ -0,0 +1,628 @@
+"""
+Backend vettoriale SQLite + HNSW con persistenza incrementale.
+
+Il backend duckdb+parquet di Chroma 0.3 riscrive i file parquet dell'intera
+collection a ogni persist(), quindi il costo di un upload cresce con la
+collection. Qui invece:
+
+- chunk, metadati ed embedding (float32) sono righe di una tabella SQLite
+  (vectors.sqlite3, in modalità WAL): un upload scrive solo le proprie righe;
+- l'indice HNSW (hnswlib) vive in memoria e il file hnsw.bin ne è una copia
+  aggiornata a intervalli: persist() lo riscrive solo quando le modifiche non
+  salvate raggiungono le righe già coperte dal file (crescita geometrica,
+  costo ammortizzato costante per chunk) o VECTOR_INDEX_SAVE_EVERY. All'apertura
+  l'indice salvato viene completato con le righe aggiunte dopo il salvataggio
+  e con le eliminazioni successive; se manca o è illeggibile viene
+  ricostruito dalla tabella.
+
+Le etichette dell'indice sono le chiavi AUTOINCREMENT della tabella, mai
+riusate. SQLiteHNSWStore espone il sottoinsieme dell'API di Chroma usato
+dall'app (add_texts, get, delete, persist, ricerca con filtro `where`), così
+indicizzazione, chat e re-index funzionano con entrambi i backend. Il backend
+di una collection si riconosce dai file presenti (indexing.detect_backend);
+le collection esistenti si convertono con python -m app.services.reindex --migrate.
+
+Ogni collection conserva nella tabella meta i propri parametri dell'indice
+(m, ef_construction, ef_search, exact_threshold; default da VECTOR_HNSW_* e
+VECTOR_EXACT_THRESHOLD). Quando i chunk candidati di una ricerca (tutti o
+quelli che passano il filtro) non superano exact_threshold la ricerca è
+esatta, sui vettori già in memoria nell'indice: con pochi chunk costa meno
+del grafo e non perde vicini. I valori adatti alle varie dimensioni si
+scelgono con python -m app.benchmarks.bench_ann.
+
+Con il parametro encoding (default VECTOR_ENCODING) i vettori possono essere
+compressi:
+- float16: embedding salvati in SQLite a metà precisione (metà spazio su
+  disco); l'indice HNSW in memoria resta float32, costruito dai valori arrotondati;
+- pq: embedding float16 su disco e in memoria solo i codici della
+  quantizzazione prodotto (app.services.quantization), pq_subvectors byte per
+  chunk al posto del grafo HNSW. La ricerca scandisce i codici e riordina i
+  migliori k * pq_rerank candidati con i vettori letti da SQLite.
+Perdita di recall e memoria risparmiata si misurano con
+python -m app.benchmarks.bench_compression; l'encoding di una collection non
+vuota si cambia riscrivendola (reindex --compact --force --index-param encoding=...).
+"""
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain.vectorstores.base import VectorStore
+
+from app.config import (
+    VECTOR_ENCODING,
+    VECTOR_EXACT_THRESHOLD,
+    VECTOR_HNSW_EF_CONSTRUCTION,
+    VECTOR_HNSW_EF_SEARCH,
+    VECTOR_HNSW_M,
+    VECTOR_INDEX_SAVE_EVERY,
+    VECTOR_PQ_RERANK,
+    VECTOR_PQ_SUBVECTORS,
+)
+from app.services.quantization import PQIndex
+
+DB_FILE = "vectors.sqlite3"
+INDEX_FILE = "hnsw.bin"
+PQ_FILE = "pq.npz"
+HNSW_SPACE = "l2"  # come Chroma: distanza L2 al quadrato
+SQL_BATCH = 500
+MEMORY_SAMPLE = 256  # metadati letti per stimarne la memoria
+# m, ef_construction e pq_subvectors fissano la struttura dell'indice
+# (cambiarli lo ricostruisce), ef_search, exact_threshold e pq_rerank valgono
+# dalla ricerca successiva, encoding si sceglie quando la collection è vuota
+INDEX_PARAMS = {"m": int, "ef_construction": int, "ef_search": int, "exact_threshold": int,
+                "encoding": str, "pq_subvectors": int, "pq_rerank": int}
+GRAPH_PARAMS = ("m", "ef_construction")
+REBUILD_PARAMS = GRAPH_PARAMS + ("pq_subvectors",)
+ENCODINGS = ("float32", "float16", "pq")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    label INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    document TEXT,
+    metadata TEXT,
+    embedding BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def matches(metadata: dict, where: Optional[dict]) -> bool:
+    """Valuta un filtro `where` in stile Chroma: uguaglianza, $eq/$ne/$in/$nin, $and e $or."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(metadata, c) for c in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for op, target in condition.items():
+                if op == "$eq":
+                    ok = value == target
+                elif op == "$ne":
+                    ok = value != target
+                elif op == "$in":
+                    ok = value in target
+                elif op == "$nin":
+                    ok = value not in target
+                else:
+                    raise ValueError(f"Operatore where non supportato: {op}")
+                if not ok:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def default_index_params() -> dict:
+    return {"m": VECTOR_HNSW_M, "ef_construction": VECTOR_HNSW_EF_CONSTRUCTION,
+            "ef_search": VECTOR_HNSW_EF_SEARCH, "exact_threshold": VECTOR_EXACT_THRESHOLD,
+            "encoding": VECTOR_ENCODING, "pq_subvectors": VECTOR_PQ_SUBVECTORS, "pq_rerank": VECTOR_PQ_RERANK}
+
+
+def validate_index_params(params: dict) -> dict:
+    """Parametri dell'indice convertiti nel loro tipo; ValueError se sconosciuti o fuori intervallo."""
+    checked = {}
+    for key, value in params.items():
+        if key not in INDEX_PARAMS:
+            raise ValueError(f"Parametro dell'indice sconosciuto: {key} (ammessi: {', '.join(INDEX_PARAMS)})")
+        value = INDEX_PARAMS[key](value)
+        if key == "encoding":
+            if value not in ENCODINGS:
+                raise ValueError(f"Encoding non valido: {value} (valori ammessi: {', '.join(ENCODINGS)})")
+        elif value < (0 if key == "exact_threshold" else 1):
+            raise ValueError(f"Valore non valido per {key}: {value}")
+        checked[key] = value
+    return checked
+
+
+def exact_knn(query: np.ndarray, vectors: np.ndarray, k: int,
+              norms: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k esatto per distanza L2 al quadrato: (posizioni, distanze) in ordine
+    crescente. `norms` sono le norme al quadrato dei vettori, se già calcolate.
+    """
+    if norms is None:
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+    distances = np.maximum(norms - 2 * (vectors @ query) + float(query @ query), 0)
+    k = min(k, len(distances))
+    best = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(len(distances))
+    best = best[np.argsort(distances[best], kind="stable")]
+    return best, distances[best]
+
+
+def _hnswlib():
+    # importato solo dal backend sqlite: chi usa VECTOR_BACKEND=chroma non ne ha bisogno
+    try:
+        import hnswlib
+    except ImportError as e:
+        raise RuntimeError("Il backend vettoriale 'sqlite' richiede il pacchetto hnswlib.") from e
+    return hnswlib
+
+
+def _chunked(values: List, size: int = SQL_BATCH):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+class SQLiteHNSWStore(VectorStore):
+    def __init__(self, persist_directory: str, embedding_function=None,
+                 save_every: int = VECTOR_INDEX_SAVE_EVERY, index_params: Optional[dict] = None):
+        self.persist_directory = persist_directory
+        self._embedding = embedding_function
+        self.save_every = save_every
+        os.makedirs(persist_directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(persist_directory, DB_FILE), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self.params = self._load_params(index_params)
+        self._index = None
+        self._dim = None
+        self._metadatas = {}  # etichetta -> metadati, per i filtri where
+        self._max_label = 0   # etichetta più alta presente nell'indice in memoria
+        self._pending = 0     # modifiche non ancora salvate in hnsw.bin
+        self._saved = 0       # chunk coperti dall'ultimo hnsw.bin
+        self._exact = None    # (posizioni, matrice, norme) per la ricerca esatta, azzerata a ogni modifica
+        self._seen_version = None  # PRAGMA data_version all'ultimo allineamento con gli altri handle
+        self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    # --- Metadati della collection ---
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _load_params(self, requested: Optional[dict]) -> dict:
+        """Parametri salvati della collection; `requested` vale solo per una collection nuova."""
+        saved = self._get_meta("index_params")
+        if saved is not None:
+            return {**default_index_params(), **json.loads(saved)}
+        params = {**default_index_params(), **validate_index_params(requested or {})}
+        self._set_meta("index_params", json.dumps(params))
+        self._conn.commit()
+        return params
+
+    def index_params(self) -> dict:
+        with self._lock:
+            return dict(self.params)
+
+    def set_index_params(self, **changes) -> dict:
+        """Aggiorna i parametri della collection; m, ef_construction o pq_subvectors diversi ricostruiscono l'indice."""
+        changes = validate_index_params(changes)
+        with self._lock:
+            if changes.get("encoding", self.params["encoding"]) != self.params["encoding"] and self._metadatas:
+                raise ValueError("L'encoding di una collection non vuota si cambia riscrivendola "
+                                 "(python -m app.services.reindex --compact --force --index-param encoding=...)")
+            rebuild = any(changes.get(key, self.params[key]) != self.params[key] for key in REBUILD_PARAMS)
+            self.params = {**self.params, **changes}
+            self._set_meta("index_params", json.dumps(self.params))
+            self._conn.commit()
+            if rebuild and self._index is not None:
+                self._rebuild_index()
+            return dict(self.params)
+
+    # --- Vettori ---
+    @property
+    def _pq(self) -> bool:
+        return self.params["encoding"] == "pq"
+
+    @property
+    def _blob_dtype(self):
+        return np.float32 if self.params["encoding"] == "float32" else np.float16
+
+    def _decode(self, rows, column: int = 2) -> np.ndarray:
+        """Embedding delle righe come matrice float32."""
+        return np.vstack([np.frombuffer(r[column], dtype=self._blob_dtype) for r in rows]).astype(np.float32)
+
+    def _stored_vectors(self, labels: List[int]) -> np.ndarray:
+        """Vettori completi da SQLite, nell'ordine di `labels`."""
+        found = {}
+        for batch in _chunked(labels):
+            for row in self._conn.execute(
+                f"SELECT label, embedding FROM chunks WHERE label IN ({','.join('?' * len(batch))})", batch
+            ):
+                found[row[0]] = row
+        return self._decode([found[label] for label in labels], column=1)
+
+    def memory_bytes(self) -> int:
+        """Stima della memoria occupata da indice, metadati e cache della ricerca esatta."""
+        with self._lock:
+            count = len(self._metadatas)
+            if self._index is None:
+                index = 0
+            elif self._pq:
+                index = self._index.nbytes
+            else:
+                # vettori float32 più i collegamenti del livello base del grafo
+                index = count * (self._dim * 4 + self.params["m"] * 2 * 4 + 16)
+            exact = self._exact[1].nbytes + self._exact[2].nbytes if self._exact else 0
+            # metadati omogenei (doc_id, chunk, ...): basta un campione, a costo costante
+            sample = [len(json.dumps(m)) for m in itertools.islice(self._metadatas.values(), MEMORY_SAMPLE)]
+            metadata = sum(sample) * count // len(sample) if sample else 0
+            return index + exact + metadata
+
+    # --- Indice HNSW o PQ ---
+    def _index_path(self) -> str:
+        return os.path.join(self.persist_directory, PQ_FILE if self._pq else INDEX_FILE)
+
+    def _new_index(self, capacity: int):
+        if self._pq:
+            return PQIndex(self._dim, self.params["pq_subvectors"])
+        index = _hnswlib().Index(space=HNSW_SPACE, dim=self._dim)
+        index.init_index(max_elements=max(capacity, 16), M=self.params["m"],
+                         ef_construction=self.params["ef_construction"], allow_replace_deleted=False)
+        return index
+
+    def _open_index(self, path: str):
+        if self._pq:
+            index = PQIndex(self._dim, self.params["pq_subvectors"])
+        else:
+            index = _hnswlib().Index(space=HNSW_SPACE, dim=self._dim)
+        index.load_index(path)
+        return index
+
+    def _rebuild_index(self):
+        rows = self._rows_after(0)
+        self._metadatas = {label: json.loads(meta) if meta else {} for label, meta, _ in rows}
+        self._index = self._new_index(len(rows))
+        self._max_label = 0
+        if rows:
+            self._add_to_index([r[0] for r in rows], self._decode(rows))
+        self._write_index()
+
+    def _ensure_capacity(self, extra: int):
+        if self._pq:
+            return
+        needed = self._index.get_current_count() + extra
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+
+    def _add_to_index(self, labels: List[int], vectors: np.ndarray):
+        if not labels:
+            return
+        self._ensure_capacity(len(labels))
+        self._index.add_items(vectors, labels)
+        self._max_label = max(self._max_label, max(labels))
+        self._exact = None
+
+    def _rows_after(self, label: int):
+        return self._conn.execute(
+            "SELECT label, metadata, embedding FROM chunks WHERE label > ? ORDER BY label", (label,)
+        ).fetchall()
+
+    def _data_version(self) -> int:
+        """Cambia solo quando un'altra connessione (handle o processo) modifica il database."""
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load(self):
+        self._seen_version = self._data_version()
+        rows = self._conn.execute("SELECT label, metadata FROM chunks").fetchall()
+        self._metadatas = {label: json.loads(meta) if meta else {} for label, meta in rows}
+        dim = self._get_meta("dim")
+        if dim is None:
+            return
+        self._dim = int(dim)
+
+        saved = int(self._get_meta("index_label") or 0)
+        path = self._index_path()
+        index = None
+        if saved and os.path.exists(path):
+            try:
+                index = self._open_index(path)
+            except Exception as e:
+                print(f"⚠️ Indice di {self.persist_directory} illeggibile, lo ricostruisco:", e)
+                index = None
+        if index is None:
+            saved = 0
+            index = self._new_index(len(rows))
+        self._index = index
+        self._max_label = saved
+        self._saved = sum(1 for label in self._metadatas if label <= saved)
+
+        # eliminazioni successive al salvataggio
+        for label in set(index.get_ids_list()) - set(self._metadatas):
+            self._mark_deleted(label)
+        # righe aggiunte dopo il salvataggio (o tutte, se l'indice è nuovo)
+        new_rows = self._rows_after(saved)
+        if new_rows:
+            self._add_to_index([r[0] for r in new_rows], self._decode(new_rows))
+            self._pending += len(new_rows)
+
+    def _mark_deleted(self, label: int):
+        self._exact = None
+        try:
+            self._index.mark_deleted(label)
+        except RuntimeError:
+            pass  # già marcata o mai entrata in questo indice
+
+    def _sync(self):
+        """Allinea l'indice alle modifiche fatte da altri handle sulla stessa collection."""
+        self._seen_version = self._data_version()
+        live = {label for (label,) in self._conn.execute("SELECT label FROM chunks")}
+        known = set(self._metadatas)
+        for label in known - live:
+            self._metadatas.pop(label)
+            self._mark_deleted(label)
+        rows = []
+        for batch in _chunked(sorted(live - known)):
+            rows += self._conn.execute(
+                f"SELECT label, metadata, embedding FROM chunks WHERE label IN ({','.join('?' * len(batch))})", batch
+            ).fetchall()
+        for label, meta, _ in rows:
+            self._metadatas[label] = json.loads(meta) if meta else {}
+        if rows:
+            self._add_to_index([r[0] for r in rows], self._decode(rows))
+
+    def save_index(self):
+        """Riscrive il file dell'indice (scrittura atomica) e registra fin dove arriva."""
+        with self._lock:
+            if self._index is None:
+                return
+            self._sync()
+            trained_on = self._index.quantizer.trained_on if self._pq else 0
+            if trained_on and trained_on * 4 < len(self._metadatas):
+                # collection quadruplicata dall'addestramento: centroidi ricalcolati su tutti i vettori
+                return self._rebuild_index()
+            self._write_index()
+
+    def _write_index(self):
+        path = self._index_path()
+        tmp = f"{path}.tmp"
+        self._index.save_index(tmp)
+        os.replace(tmp, path)
+        self._set_meta("index_label", self._max_label)
+        self._conn.commit()
+        self._pending = 0
+        self._saved = len(self._metadatas)
+
+    def refresh(self):
+        """Allinea l'handle alle modifiche di altri handle o processi, se ce ne sono state (costo costante se no)."""
+        with self._lock:
+            if self._data_version() == self._seen_version:
+                return
+            if self._index is None:
+                self._load()  # collection creata da un altro handle
+            else:
+                self._sync()
+
+    def persist(self):
+        """Le righe sono già su disco: l'indice HNSW viene riscritto solo ogni tanto (vedi docstring del modulo)."""
+        with self._lock:
+            if self._pending and self._pending >= min(self.save_every, max(self._saved, 1)):
+                self.save_index()
+
+    def close(self):
+        """Chiude la connessione e libera indice e metadati in memoria (le righe sono già su SQLite)."""
+        with self._lock:
+            self._conn.close()
+            self._index = None
+            self._exact = None
+            self._metadatas = {}
+
+    # --- Scrittura ---
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        embeddings = self._embedding.embed_documents(texts)
+        return self.add_embeddings(ids or [str(uuid.uuid4()) for _ in texts], embeddings, texts, metadatas)
+
+    def add_embeddings(self, ids: List[str], embeddings, documents: List[str],
+                       metadatas: Optional[List[dict]] = None) -> List[str]:
+        """Aggiunge chunk con embedding già calcolati; un id esistente viene sostituito (come upsert)."""
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        metadatas = metadatas or [{} for _ in ids]
+        with self._lock:
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._set_meta("dim", self._dim)
+                self._index = self._new_index(len(ids))
+            elif vectors.shape[1] != self._dim:
+                raise ValueError(f"Dimensione degli embedding {vectors.shape[1]} diversa da quella della "
+                                 f"collection ({self._dim})")
+            self._delete_ids(ids)
+            stored = vectors.astype(self._blob_dtype)
+            cursor = self._conn.cursor()
+            labels = []
+            for chunk_id, document, meta, vector in zip(ids, documents, metadatas, stored):
+                cursor.execute("INSERT INTO chunks (id, document, metadata, embedding) VALUES (?, ?, ?, ?)",
+                               (chunk_id, document, json.dumps(meta or {}), vector.tobytes()))
+                labels.append(cursor.lastrowid)
+            self._conn.commit()
+            # l'indice riceve i valori salvati, così una ricostruzione dal disco dà lo stesso risultato
+            self._add_to_index(labels, stored.astype(np.float32))
+            for label, meta in zip(labels, metadatas):
+                self._metadatas[label] = dict(meta or {})
+            self._pending += len(labels)
+        return list(ids)
+
+    def _delete_ids(self, ids: List[str]) -> int:
+        labels = []
+        for batch in _chunked(list(ids)):
+            marks = ",".join("?" * len(batch))
+            labels += [l for (l,) in self._conn.execute(f"SELECT label FROM chunks WHERE id IN ({marks})", batch)]
+        for batch in _chunked(labels):
+            self._conn.execute(f"DELETE FROM chunks WHERE label IN ({','.join('?' * len(batch))})", batch)
+        for label in labels:
+            self._metadatas.pop(label, None)
+            if self._index is not None:
+                self._mark_deleted(label)
+        self._pending += len(labels)
+        return len(labels)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            deleted = self._delete_ids(ids)
+            self._conn.commit()
+        return deleted > 0
+
+    # --- Lettura ---
+    def count(self) -> int:
+        with self._lock:
+            return len(self._metadatas)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include: Optional[List[str]] = None, **kwargs: Any) -> dict:
+        """Come Collection.get di Chroma: per default metadati e testi, gli embedding solo se richiesti."""
+        include = include or ["metadatas", "documents"]
+        columns = "label, id, metadata, document" + (", embedding" if "embeddings" in include else "")
+        with self._lock:
+            if ids:
+                rows = []
+                for batch in _chunked(list(ids)):
+                    rows += self._conn.execute(
+                        f"SELECT {columns} FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+                    ).fetchall()
+                rows.sort(key=lambda r: r[0])
+            else:
+                rows = self._conn.execute(f"SELECT {columns} FROM chunks ORDER BY label").fetchall()
+        found = []
+        for row in rows:
+            meta = json.loads(row[2]) if row[2] else {}
+            if matches(meta, where):
+                found.append((row, meta))
+        found = found[offset or 0:]
+        if limit is not None:
+            found = found[:limit]
+        return {
+            "ids": [row[1] for row, _ in found],
+            "embeddings": [np.frombuffer(row[4], dtype=self._blob_dtype).astype(np.float32).tolist() for row, _ in found]
+            if "embeddings" in include else None,
+            "metadatas": [meta for _, meta in found] if "metadatas" in include else None,
+            "documents": [row[3] for row, _ in found] if "documents" in include else None,
+        }
+
+    def _vectors(self, labels: List[int]) -> np.ndarray:
+        """Vettori dall'indice HNSW in memoria; con pq, che in memoria ha solo i codici, da SQLite."""
+        if self._pq:
+            return self._stored_vectors(labels)
+        return np.asarray(self._index.get_items(labels), dtype=np.float32).reshape(len(labels), self._dim)
+
+    def _exact_matrix(self):
+        """Vettori di tutta la collection in una matrice, copiati alla prima ricerca esatta."""
+        if self._exact is None:
+            labels = list(self._metadatas)
+            matrix = self._vectors(labels)
+            norms = np.einsum("ij,ij->i", matrix, matrix)
+            self._exact = ({label: i for i, label in enumerate(labels)}, matrix, norms)
+        return self._exact
+
+    def _exact_search(self, query: np.ndarray, labels: List[int], k: int) -> Tuple[List[int], List[float]]:
+        """Ricerca esatta (pochi candidati, o HNSW che non trova k vicini col filtro)."""
+        if len(self._metadatas) <= self.params["exact_threshold"]:
+            # collection piccola: la matrice resta in memoria tra una ricerca e l'altra
+            positions, matrix, norms = self._exact_matrix()
+            if len(labels) < len(positions):
+                rows = [positions[label] for label in labels]
+                matrix, norms = matrix[rows], norms[rows]
+        else:
+            matrix, norms = self._vectors(labels), None
+        positions, distances = exact_knn(query, matrix, k, norms)
+        return [labels[i] for i in positions], [float(d) for d in distances]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None, **kwargs: Any):
+        query = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self._index is None or not self._metadatas:
+                return []
+            allowed = None
+            if filter:
+                allowed = [label for label, meta in self._metadatas.items() if matches(meta, filter)]
+                if not allowed:
+                    return []
+            candidates = list(self._metadatas) if allowed is None else allowed
+            k = min(k, len(candidates))
+            if len(candidates) <= self.params["exact_threshold"]:
+                labels, distances = self._exact_search(query, candidates, k)
+            else:
+                self._index.set_ef(max(self.params["ef_search"], k))
+                try:
+                    allowed_set = set(allowed) if allowed is not None else None
+                    shortlist = min(k * self.params["pq_rerank"], len(candidates)) if self._pq else k
+                    labels, distances = self._index.knn_query(
+                        query.reshape(1, -1), k=shortlist,
+                        filter=(lambda l: l in allowed_set) if allowed_set is not None else None
+                    )
+                    labels, distances = [int(l) for l in labels[0]], [float(d) for d in distances[0]]
+                    if self._pq:
+                        # distanze PQ approssimate: i candidati vengono riordinati con i vettori completi
+                        labels, distances = self._exact_search(query, labels, k)
+                except RuntimeError:
+                    labels, distances = self._exact_search(query, candidates, k)
+            documents = {}
+            for batch in _chunked(labels):
+                for label, document in self._conn.execute(
+                    f"SELECT label, document FROM chunks WHERE label IN ({','.join('?' * len(batch))})", batch
+                ):
+                    documents[label] = document
+            metadatas = {label: dict(self._metadatas[label]) for label in labels}
+        return [(Document(page_content=documents[l], metadata=metadatas[l]), d) for l, d in zip(labels, distances)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, filter: Optional[dict] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = None,
+                   index_params: Optional[dict] = None, **kwargs: Any):
+        store = cls(persist_directory, embedding, index_params=index_params)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.save_index()
+        return store